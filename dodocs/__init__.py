@@ -33,9 +33,11 @@ def main(argv=None):
         log.debug("Finished")
         return 0
     else:
-        # defaults profile to list
+        # defaults profile and cache to list
         if args.subparser_name == 'profile' and args.profile_cmd is None:
             main(sys.argv[1:] + ["list"])
+        elif args.subparser_name == 'cache' and args.cache_cmd is None:
+            main(sys.argv[1:] + ["list"])
         else:
             # in the other cases suggest to run -h
             msg = ("Please provide a valid command.\n"
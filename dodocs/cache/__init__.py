@@ -0,0 +1,77 @@
+"""Cache management
+
+This module provides the command line and the entry point for the sub-package
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+from dodocs import utils
+
+from dodocs.cache.artifacts import DEFAULT_MAX_SIZE
+from dodocs.cache.manage import clear, clist, prune, refresh
+
+
+def cache_cmd_arguments(subparser, formatter_class):
+    """Create the ``cache`` parser and fill it with the relevant options.
+
+    Parameters
+    ----------
+    subparser : instances of :class:`argparse._SubParsersAction`
+    formatter_class : argparse formatter
+        formatter to use when creating the subparser
+
+    Returns
+    -------
+    parser
+    """
+    description = """Inspect and prune the cache of documentation builds
+                     shared by all the profiles, in '{}'.
+                     """.format(utils.cache_dir())
+    cache = subparser.add_parser("cache", description=description,
+                                 formatter_class=formatter_class,
+                                 help="Build cache management")
+
+    cache_cmd = cache.add_subparsers(title="Actions", dest='cache_cmd',
+                                     description="""Type '%(prog)s cmd -h'
+                                     for detailed information about the
+                                     subcommands""")
+
+    # list the entries
+    description = "List the cached builds, the most recently used first."
+    cache_list = cache_cmd.add_parser("list", description=description,
+                                      help=description + " Default action",
+                                      aliases=['ls'])
+    cache_list.set_defaults(func=clist)
+
+    # prune
+    description = """Remove the least recently used builds until the cache is
+                     smaller than the given size."""
+    cache_prune = cache_cmd.add_parser("prune", description=description,
+                                       formatter_class=formatter_class,
+                                       help="Shrink the cache")
+    cache_prune.add_argument('-s', '--max-size', type=utils.positive_int,
+                             default=DEFAULT_MAX_SIZE,
+                             help="Maximum size of the cache in MB")
+    cache_prune.set_defaults(func=prune)
+
+    # clear
+    description = "Remove all the cached builds."
+    cache_clear = cache_cmd.add_parser("clear", description=description,
+                                       help=description)
+    cache_clear.add_argument('--venvs', action='store_true',
+                             help="""Remove also all the shared virtual
+                             environments not used by any project""")
+    cache_clear.set_defaults(func=clear)
+
+    # refresh the wheelhouse
+    description = """Download, or build, the latest version of the python
+                     packages in the wheelhouse in '{}'. The virtual
+                     environments install only from it, so run this before
+                     working offline.""".format(utils.wheelhouse_dir())
+    cache_refresh = cache_cmd.add_parser("refresh", description=description,
+                                         formatter_class=formatter_class,
+                                         help="Refresh the wheelhouse")
+    cache_refresh.set_defaults(func=refresh)
+
+    return subparser
@@ -0,0 +1,235 @@
+"""Content addressed cache of documentation builds
+
+The html built for a project is stored under a key computed from everything
+that determines it: the repository, the revision, the build command, the
+configuration of the project and the environment. Profiles including the same
+project then build it only once. The cache is bounded in size: the least
+recently used entries are evicted first.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import dodocs.utils as dutils
+
+INFO_FILE = "info.json"
+"name of the file describing a cache entry"
+
+HTML_DIRECTORY = "html"
+"name of the directory containing the cached html"
+
+IGNORED_OPTIONS = ["cpu-weight", "incremental"]
+"""project options that don't affect the built documentation, besides the
+fetch options returned by :func:`dodocs.mkdoc.vcs.fetch_only_options`"""
+
+DEFAULT_MAX_SIZE = 2048
+"default maximum size of the cache, in MB"
+
+
+def cache_key(url, revision, build_signature, conf, project, environment):
+    """Compute the key of a documentation build
+
+    Parameters
+    ----------
+    url : string
+        path or url of the repository
+    revision : string
+        revision of the source code
+    build_signature : list
+        description of the build command, independent of the profile
+    conf : :class:`configparser.ConfigParser` instance
+        configuration object
+    project : string
+        name of the project
+    environment : string or None
+        fingerprint of the environment used for the build
+
+    Returns
+    -------
+    string or None
+        hexadecimal key; ``None`` if the environment is not known
+    """
+    if environment is None:
+        return None
+    # imported here to avoid circular imports
+    from dodocs.mkdoc import vcs
+    ignored = IGNORED_OPTIONS + vcs.fetch_only_options()
+    options = sorted((k, v) for k, v in conf.items(project)
+                     if k not in ignored)
+    dump = json.dumps([dutils.get_version(), url, revision, build_signature,
+                       options, environment])
+    return hashlib.sha256(dump.encode()).hexdigest()
+
+
+def tree_size(path):
+    """Size in bytes of the files in the ``path`` tree
+
+    Parameters
+    ----------
+    path : string or :class:`pathlib.Path`
+        directory
+
+    Returns
+    -------
+    int
+    """
+    size = 0
+    for dirpath, _, filenames in os.walk(str(path)):
+        for f in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, f)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class ArtifactCache(object):
+    """Cache of documentation builds
+
+    Each entry is a directory named after the key and containing the
+    :data:`HTML_DIRECTORY` directory and the :data:`INFO_FILE` json file. The
+    modification time of the latter is the last time the entry has been used.
+
+    Parameters
+    ----------
+    path : :class:`pathlib.Path`, optional
+        directory of the cache; defaults to :func:`dodocs.utils.cache_dir`
+
+    Attributes
+    ----------
+    path : as above
+    """
+    def __init__(self, path=None):
+        self.path = dutils.cache_dir() if path is None else path
+
+    def lookup(self, key):
+        """Look for the documentation with ``key`` and mark it as used
+
+        Parameters
+        ----------
+        key : string
+            key of the build
+
+        Returns
+        -------
+        :class:`pathlib.Path` or None
+            directory with the html; ``None`` if not found
+        """
+        entry = self.path / key
+        try:
+            os.utime(str(entry / INFO_FILE))
+        except OSError:
+            return None
+        return entry / HTML_DIRECTORY
+
+    def store(self, key, html_dir, info):
+        """Copy the documentation in ``html_dir`` into the cache.
+
+        The entry is first written to a temporary directory and then renamed,
+        so that concurrent ``dodocs`` runs never see incomplete entries.
+
+        Parameters
+        ----------
+        key : string
+            key of the build
+        html_dir : :class:`pathlib.Path`
+            directory with the html
+        info : dict
+            description of the entry, e.g. repository and revision; must be
+            serialisable to json
+        """
+        entry = self.path / key
+        if entry.exists():
+            return
+        tmp = self.path / ".{}.{}.tmp".format(key, os.getpid())
+        if tmp.exists():
+            shutil.rmtree(str(tmp))
+        shutil.copytree(str(html_dir), str(tmp / HTML_DIRECTORY))
+
+        info = dict(info, key=key, size=tree_size(tmp),
+                    created=time.time())
+        with (tmp / INFO_FILE).open("w") as f:
+            json.dump(info, f, indent=2, sort_keys=True)
+        try:
+            os.rename(str(tmp), str(entry))
+        except OSError:
+            # an other process stored the same entry in the meantime
+            shutil.rmtree(str(tmp))
+
+    def entries(self):
+        """Describe the entries of the cache, from the most to the least
+        recently used
+
+        Returns
+        -------
+        list of dict
+            content of the :data:`INFO_FILE` of each entry, with the
+            additional keys ``last_used`` and ``path``
+        """
+        entries = []
+        if not self.path.exists():
+            return entries
+        for entry in self.path.iterdir():
+            info_file = entry / INFO_FILE
+            if entry.name.startswith('.'):
+                continue  # temporary directory
+            try:
+                with info_file.open() as f:
+                    info = json.load(f)
+                info["last_used"] = info_file.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            info["path"] = entry
+            entries.append(info)
+        entries.sort(key=lambda e: e["last_used"], reverse=True)
+        return entries
+
+    def size(self):
+        """Total size of the entries in bytes"""
+        return sum(e.get("size", 0) for e in self.entries())
+
+    def prune(self, max_size):
+        """Remove the least recently used entries until the total size is at
+        most ``max_size``
+
+        Parameters
+        ----------
+        max_size : int
+            maximum size of the cache, in bytes
+
+        Returns
+        -------
+        list of dict
+            entries removed, as returned by :meth:`entries`
+        """
+        removed = []
+        total = 0
+        for info in self.entries():
+            total += info.get("size", 0)
+            if total > max_size:
+                self.remove(info["key"])
+                removed.append(info)
+        return removed
+
+    def remove(self, key):
+        """Remove the entry with the given ``key``, if it exists
+
+        Parameters
+        ----------
+        key : string
+            key of the build
+        """
+        entry = self.path / key
+        # rename first, so that the entry disappears at once
+        trash = self.path / ".{}.{}.trash".format(key, os.getpid())
+        try:
+            os.rename(str(entry), str(trash))
+        except OSError:
+            return
+        shutil.rmtree(str(trash), ignore_errors=True)
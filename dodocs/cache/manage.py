@@ -0,0 +1,138 @@
+"""List, prune and clear the cache of documentation builds and refresh the
+wheelhouse
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import asyncio
+import datetime
+
+import dodocs.logger as dlog
+
+from dodocs.cache import artifacts
+from dodocs.mkdoc.builders import venvpool, wheelhouse
+from dodocs.mkdoc.runner import CommandRunner
+
+
+def _mb(size):
+    """Convert ``size`` from bytes to MB"""
+    return size / 2 ** 20
+
+
+def clist(args):
+    """List the cached builds
+
+    Parameters
+    ----------
+    args : namespace
+        parsed command line arguments
+    """
+    log = dlog.getLogger()
+    cache = artifacts.ArtifactCache()
+
+    venvs = venvpool.VenvPool().entries()
+    if venvs:
+        log.info("Shared virtual environments:")
+    for info in venvs:
+        last_used = datetime.datetime.fromtimestamp(info["last_used"])
+        log.info("  * %s: %s, python %s, used by %d projects, last used %s",
+                 info["key"][:12], " ".join(info.get("requirements", [])),
+                 info.get("python"), len(info["refs"]),
+                 last_used.strftime("%Y-%m-%d %H:%M"))
+
+    requirements = wheelhouse.Wheelhouse().requirements()
+    if requirements:
+        log.info("Wheelhouse requirements: %s", " ".join(requirements))
+
+    entries = cache.entries()
+    if not entries:
+        log.warning("The cache is empty")
+        return
+
+    log.info("Cached builds:")
+    for info in entries:
+        last_used = datetime.datetime.fromtimestamp(info["last_used"])
+        log.info("  * %s: %s (%s) revision %s, %.1f MB, last used %s",
+                 info["key"][:12], info.get("project"), info.get("url"),
+                 str(info.get("revision"))[:12], _mb(info.get("size", 0)),
+                 last_used.strftime("%Y-%m-%d %H:%M"))
+    log.info("Total size: %.1f MB", _mb(sum(e.get("size", 0)
+                                            for e in entries)))
+
+
+def prune(args):
+    """Remove the least recently used builds
+
+    Parameters
+    ----------
+    args : namespace
+        parsed command line arguments
+    """
+    log = dlog.getLogger()
+    cache = artifacts.ArtifactCache()
+
+    removed = cache.prune(args.max_size * 2 ** 20)
+    for info in removed:
+        log.debug("removed %s (%s)", info["key"][:12], info.get("project"))
+    log.info("%d cached builds removed, %.1f MB freed", len(removed),
+             _mb(sum(e.get("size", 0) for e in removed)))
+    _gc_venvs(venvpool.KEEP_UNUSED)
+
+
+def clear(args):
+    """Remove all the cached builds and, with ``--venvs``, the unused shared
+    virtual environments
+
+    Parameters
+    ----------
+    args : namespace
+        parsed command line arguments
+    """
+    log = dlog.getLogger()
+    cache = artifacts.ArtifactCache()
+
+    removed = cache.prune(0)
+    log.info("%d cached builds removed", len(removed))
+    if args.venvs:
+        _gc_venvs(0)
+
+
+def refresh(args):
+    """Refresh the wheelhouse
+
+    Parameters
+    ----------
+    args : namespace
+        parsed command line arguments
+    """
+    log = dlog.getLogger()
+    wheels = wheelhouse.Wheelhouse()
+
+    log.info("Refreshing the wheelhouse in '%s'", wheels.path)
+    result = asyncio.run(wheels.refresh(CommandRunner()))
+    if result.stdout:
+        log.debug(result.stdout)
+    if result.returncode != 0:
+        log.error(result.stderr)
+        log.error("The wheelhouse refresh failed. Are you connected to the"
+                  " internet?")
+    else:
+        log.info("Wheelhouse refreshed")
+        # new virtual environments get the latest packages
+        pool = venvpool.VenvPool()
+        pool.remove(pool.golden_dir().name)
+
+
+def _gc_venvs(keep):
+    """Remove the shared virtual environments not used by any project
+
+    Parameters
+    ----------
+    keep : int
+        number of unused virtual environments to keep
+    """
+    log = dlog.getLogger()
+    removed = venvpool.VenvPool().gc(keep=keep)
+    if removed:
+        log.info("%d unused virtual environments removed", len(removed))
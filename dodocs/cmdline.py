@@ -6,6 +6,7 @@ MIT Licence
 
 import argparse as ap
 
+from dodocs import cache
 from dodocs import mkdoc
 from dodocs import profiles
 from dodocs import utils
@@ -46,4 +47,7 @@ def parse(argv=None):
 
     # build the whole thing
     subparser = mkdoc.build_cmd_arguments(subparser, DEF_FORMATTER)
+
+    # manage the build cache
+    subparser = cache.cache_cmd_arguments(subparser, DEF_FORMATTER)
     return p.parse_args(args=argv)
@@ -53,6 +53,7 @@ def defaults():
     default_dict = {"vcs": "git",
                     "language": "python3",
                     "py-install": "no",
+                    "incremental": "no",
                     }
     return default_dict
 
@@ -33,6 +33,17 @@ def _colorformatter():
     return formatter
 
 
+class _ExtrasFilter(logging.Filter):
+    """Make sure that the records have the fields used by the formatter, also
+    when they don't come through a :class:`logging.LoggerAdapter`, e.g. from
+    :mod:`asyncio`"""
+    def filter(self, record):
+        for key, value in _def_extras.items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
 def setLogger(args, name=None):
     """Create the logger instance and save the extra dictionary used to create
     a :class:`logging.LoggerAdapter` instance.
@@ -67,6 +78,7 @@ def setLogger(args, name=None):
         handler = logging.StreamHandler()
         handler.setLevel(level)
         handler.setFormatter(_colorformatter())
+        handler.addFilter(_ExtrasFilter())
         log.addHandler(handler)
 
         # create the extra entry
@@ -93,12 +105,24 @@ def _get_subc(args):
     subc = args.subparser_name
     if args.subparser_name == 'profile' and args.profile_cmd is not None:
         subc += "." + args.profile_cmd
+    elif args.subparser_name == 'cache' and args.cache_cmd is not None:
+        subc += "." + args.cache_cmd
     return subc
 
 
-def getLogger(name=None):
+def getLogger(name=None, **kwargs):
     """Returns the adapted logger based on the logger called ``name``
 
+    Parameters
+    ----------
+    name : string or None
+        name of the logger to use. ``None`` is the root logger
+    kwargs : dict
+        override the entries of the extra dictionary, e.g. ``profile`` and
+        ``project``. The returned adapter uses a private copy of the extra
+        dictionary, so it is not affected by :func:`set_profile` and
+        :func:`set_project`. Use it when logging from concurrent workers
+
     Returns
     -------
     :class:`~logging.LoggerAdapter`
@@ -107,6 +131,8 @@ def getLogger(name=None):
         extra = _extra[name]
     except KeyError:
         extra = _def_extras.copy()
+    if kwargs:
+        extra = dict(extra, **kwargs)
     return logging.LoggerAdapter(logging.getLogger(name), extra)
 
 
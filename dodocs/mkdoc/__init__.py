@@ -8,7 +8,9 @@ import colorama
 
 import dodocs.config as dconf
 import dodocs.logger as dlog
+import dodocs.utils as dutils
 
+from dodocs.cache.artifacts import DEFAULT_MAX_SIZE
 from dodocs.mkdoc import mkprofile as mkp
 
 
@@ -35,6 +37,70 @@ def build_cmd_arguments(subparser, formatter_class):
     build.set_defaults(func=build_doc)
     build.add_argument('name', nargs="+", help="""Name(s) of the
                        profile(s) to process""")
+    build.add_argument('-f', '--force', action='store_true',
+                       help="""Build all the projects, even if nothing changed
+                       since their last build""")
+    build.add_argument('-j', '--jobs', type=dutils.positive_int, default=1,
+                       help="""Maximum number of documentation builds to run
+                       concurrently. The limit is global: the projects of all
+                       the profiles share the same workers. It is also the
+                       default for the other '--*-jobs' options""")
+    build.add_argument('--probe-jobs', type=dutils.positive_int, default=16,
+                       help="""Number of projects whose repository is checked
+                       for changes at the same time, before starting any
+                       work""")
+    build.add_argument('--fetch-jobs', type=dutils.positive_int,
+                       help="""Number of workers getting or updating the
+                       source code""")
+    build.add_argument('--install-jobs', type=dutils.positive_int,
+                       help="""Number of workers preparing the environments,
+                       e.g. installing the python packages""")
+    build.add_argument('--publish-jobs', type=dutils.positive_int,
+                       help="""Number of workers moving the documentation to
+                       the target directory""")
+    build.add_argument('--queue-size', type=dutils.positive_int,
+                       help="""Maximum number of projects waiting in front of
+                       each stage. Defaults to the value of '--jobs'""")
+    build.add_argument('--max-procs', type=dutils.positive_int,
+                       help="""Maximum number of external commands, e.g. 'git',
+                       'pip' or 'sphinx-build', running at the same time. By
+                       default there is no limit besides the number of
+                       workers""")
+    build.add_argument('--cpu-budget', type=dutils.positive_int,
+                       help="""Number of CPUs shared among the documentation
+                       builds. Each build gets a share sized after the project
+                       and passes it to the builder, e.g. as 'sphinx-build
+                       -j'. Defaults to the number of CPUs""")
+    build.add_argument('--no-adapt', action='store_true',
+                       help="""Use the full CPU budget, regardless of the
+                       system load and of the available memory""")
+    build.add_argument('--mem-per-cpu', type=dutils.positive_int, default=512,
+                       help="""Memory, in MB, that each CPU of a build is
+                       expected to use. The CPU budget shrinks when the
+                       available memory is low""")
+    build.add_argument('--timeout', type=float,
+                       help="""Kill any external command running longer than
+                       %(dest)s seconds. By default there is no limit""")
+    build.add_argument('--no-mirrors', action='store_true',
+                       help="""Clone and update each project directly from
+                       its repository, instead of through the mirror shared by
+                       all the profiles""")
+    build.add_argument('--no-sphinx-worker', action='store_true',
+                       help="""Run every build with 'sphinx-build' instead
+                       of a sphinx worker, that imports sphinx once for all
+                       the builds""")
+    build.add_argument('--offline', action='store_true',
+                       help="""Install the python packages only from the
+                       wheelhouse, without downloading anything. Use 'dodocs
+                       cache refresh' to update the wheelhouse""")
+    build.add_argument('--no-cache', action='store_true',
+                       help="""Don't use the cache of documentation builds
+                       shared by the profiles""")
+    build.add_argument('--cache-size', type=dutils.positive_int,
+                       default=DEFAULT_MAX_SIZE,
+                       help="""Maximum size of the build cache, in MB. The
+                       least recently used builds are removed at the end of
+                       the run""")
 
     return subparser
 
@@ -42,6 +108,10 @@ def build_cmd_arguments(subparser, formatter_class):
 def build_doc(args):
     """Build the documentation for the given profiles.
 
+    The configuration of every profile is checked first and the profiles with
+    invalid configurations are skipped. The projects of the remaining profiles
+    are then built together.
+
     Parameters
     ----------
     args : namespace
@@ -53,14 +123,22 @@ def build_doc(args):
     from dodocs.mkdoc.builders import init
     init()
 
+    # validate all the configurations before starting any build
+    profiles = []
     for name in args.name:
-        log.info(colorama.Fore.GREEN + "Building documentation for profile"
-                 " '{}'".format(name))
         try:
             dconf.get_config(name)
         except dconf.DodocConfigError as e:
             log.error("Profile {} won't be built because \n".format(name) +
                       str(e))
             continue
+        profiles.append(name)
+
+    for name in profiles:
+        dlog.set_profile(name)
+        log.info(colorama.Fore.GREEN + "Building documentation for profile"
+                 " '{}'".format(name))
+    # from now on the profile is in the loggers of the single projects
+    dlog.set_profile("")
 
-        mkp.main(name, args)
+    mkp.main(profiles, args)
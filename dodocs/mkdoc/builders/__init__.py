@@ -5,23 +5,24 @@ Initialise and return the appropriate builder for the given language.
 """
 
 import importlib
-from pathlib import Path
 
 # a builder for every language; key: language; value: builder class
 _builders = {}
 
+# modules in the builders directory that register a builder; the other ones
+# are helpers, imported by the builders when needed
+BUILDER_MODULES = ['python3', ]
+
 
 def init():
-    """Import all the modules in the builders directory to register the available
+    """Import the modules in :data:`BUILDER_MODULES` to register the available
     handlers.
 
     Must be called before using any of the handlers, e.g. in
     :func:`dodocs.mkdocs.build_doc`
     """
-    builders_dir = Path(__file__).parent
-    for to_register in builders_dir.glob('*py'):
-        if to_register.name not in ['__init__.py', 'base_builder.py']:
-            importlib.import_module(__name__ + '.' + to_register.stem)
+    for to_register in BUILDER_MODULES:
+        importlib.import_module(__name__ + '.' + to_register)
 
 
 def register_builder(language, BuilderClass):
@@ -37,7 +38,7 @@ def register_builder(language, BuilderClass):
     _builders[language] = BuilderClass
 
 
-def picker(profile, project, conf, log):
+def picker(profile, project, conf, log, session):
     """Pick and initialise the builder
 
     Parameters
@@ -50,6 +51,8 @@ def picker(profile, project, conf, log):
         configuration object
     log : :class:`~logging.LoggerAdapter` or :class:`~logging.Logger`
         logger
+    session : :class:`~dodocs.mkdoc.session.BuildSession`
+        current build session
 
     Returns
     -------
@@ -63,4 +66,4 @@ def picker(profile, project, conf, log):
         raise ValueError("The documentation builder for the language '{}'"
                          " is not implemented yet, sorry".format(language))
 
-    return BuilderClass(profile, project, conf, log)
+    return BuilderClass(profile, project, conf, log, session)
@@ -8,19 +8,30 @@ MIT Licence
 """
 
 import abc
+import hashlib
+import json
 from pathlib import Path
-import shutil
-import subprocess as sp
 
 import dodocs.utils as dutils
 
+from dodocs.mkdoc import manifest
+from dodocs.mkdoc import publish
 from dodocs.mkdoc import vcs
 
 
 class BaseBuilder(metaclass=abc.ABCMeta):
     """Base class documentation builder.
 
-    It defines the interface that any builder should implement.
+    It defines the interface that any builder should implement. The
+    documentation is created in four steps, executed in this order; the first
+    three are coroutines:
+
+    * :meth:`fetch`: get or update the source code, unless :meth:`probe`
+      found it already up to date;
+    * :meth:`install`: prepare what is needed to build the documentation;
+    * :meth:`build_doc`: build the documentation;
+    * :meth:`move_doc` and :meth:`clear_tmp`: publish the documentation and
+      clean up.
 
     Parameters
     ----------
@@ -32,31 +43,272 @@ class BaseBuilder(metaclass=abc.ABCMeta):
         configuration object
     log : :class:`~logging.LoggerAdapter` or :class:`~logging.Logger`
         logger
+    session : :class:`~dodocs.mkdoc.session.BuildSession`
+        current build session. Its ``runner`` executes all the external
+        commands
 
     Attributes
     ----------
-    profile, project, conf, log : as above
+    profile, project, conf, log, session : as above
     project_path : string
         path where to grab the project
+    subdir : string or None
+        subdirectory of the repository containing the project, from the
+        ``subdir`` option. The projects with this option and the same
+        repository share one checkout, fetched once per session
+    repo_dir : :class:`pathlib.Path`
+        directory containing the checkout of the repository
+    project_dir : :class:`pathlib.Path`
+        directory containing the source of the project: :attr:`subdir` of
+        :attr:`repo_dir`, if given, else the same as :attr:`repo_dir`. All the
+        external commands are executed in it
     language : string
         language of the project
+    cpu_jobs : int
+        number of processes the documentation build is allowed to use.
+        Builders supporting parallel builds should honour it in
+        :attr:`build_cmd`
+    incremental : bool
+        if ``True`` the build directory is kept between builds, so that the
+        next build can reuse it, and the documentation is copied, instead of
+        moved, to the target directory
+    up_to_date : bool
+        if ``True`` :meth:`probe` found that the source code is already up to
+        date, so :meth:`fetch` doesn't need to do anything
     """
-    def __init__(self, profile, project, conf, log):
+    def __init__(self, profile, project, conf, log, session):
         self.profile = profile
         self.project = project
         self.conf = conf
         self.log = log
+        self.session = session
 
         self.project_path = conf.get(project, "project_path")
-
-        # get or update the source
-        vcs_type = conf.get(project, "vcs")
-        vcs.get_or_update_source(vcs_type, self.project_path)
-        log.debug("%s repository updated", vcs_type)
+        self.subdir = conf.get(project, "subdir", fallback="").strip("/")
+        if self.subdir:
+            self.repo_dir = dutils.shared_project_dir(profile,
+                                                      self._checkout_key())
+            self.project_dir = self.repo_dir / self.subdir
+        else:
+            self.subdir = None
+            self.repo_dir = dutils.project_dir(profile, project)
+            self.project_dir = self.repo_dir
 
         # save the language
         self.language = conf.get(project, "language").lower()
 
+        self.cpu_jobs = 1
+        self.incremental = conf.getboolean(project, "incremental")
+        self.up_to_date = False
+
+    def _checkout_key(self):
+        """Identifier of the checkout shared by the projects with the same
+        repository and fetch options
+
+        Returns
+        -------
+        string
+        """
+        options = vcs.fetch_options(self.conf, self.project)
+        dump = json.dumps([self.project_path,
+                           self.conf.get(self.project, "vcs"), list(options)])
+        return hashlib.sha1(dump.encode()).hexdigest()
+
+    async def probe(self):
+        """Check whether the source code is already up to date, comparing the
+        revision in the remote repository with the one checked out, without
+        fetching anything or scanning the working tree.
+
+        Returns
+        -------
+        bool
+            stored also in :attr:`up_to_date`
+        """
+        vcs_type = self.conf.get(self.project, "vcs")
+        options = vcs.fetch_options(self.conf, self.project)
+        self.up_to_date = await vcs.is_up_to_date(
+            vcs_type, self.project_path, self.repo_dir,
+            self.session.runner, options=options)
+        return self.up_to_date
+
+    async def fetch(self):
+        """Get or update the source code of the project.
+
+        Unless disabled, the repository is first mirrored in the ``dodocs``
+        home, once per session, and the repository of the project borrows
+        the objects of the mirror and is updated from it. Shallow and partial
+        clones don't use the mirror, as it would hold the whole history.
+
+        Nothing is done if :meth:`probe` found the source code up to date.
+        Checkouts shared by multiple projects are updated once per session.
+        """
+        vcs_type = self.conf.get(self.project, "vcs")
+        if self.up_to_date:
+            self.log.debug("%s repository already up to date", vcs_type)
+            return
+        if self.subdir is None:
+            dutils.mk_project(self.profile, self.project)
+            await self._fetch_repo(vcs_type)
+        else:
+            await self.session.once(("fetch", str(self.repo_dir)),
+                                    self._fetch_repo, vcs_type)
+        self.log.debug("%s repository updated", vcs_type)
+
+    async def _fetch_repo(self, vcs_type):
+        """Get or update the repository in :attr:`repo_dir`
+
+        Parameters
+        ----------
+        vcs_type : string
+            kind of version control system
+        """
+        self.repo_dir.mkdir(parents=True, exist_ok=True)
+        options = vcs.fetch_options(self.conf, self.project)
+        mirror = None
+        if not (self.session.args.no_mirrors or options.depth is not None or
+                options.filter is not None):
+            mirror = await self._update_mirror(vcs_type)
+        await vcs.get_or_update_source(vcs_type, self.project_path,
+                                       self.repo_dir, self.session.runner,
+                                       mirror=mirror, options=options)
+
+    async def _update_mirror(self, vcs_type):
+        """Create or update the mirror of the repository, once per session
+
+        Parameters
+        ----------
+        vcs_type : string
+            kind of version control system
+
+        Returns
+        -------
+        :class:`pathlib.Path` or None
+            directory of the mirror; ``None`` if it cannot be updated
+        """
+        mirror = dutils.mirror_dir(self.project_path)
+        try:
+            await self.session.once(("mirror", str(mirror)), vcs.update_mirror,
+                                    vcs_type, self.project_path, mirror,
+                                    self.session.runner)
+        except vcs.VCSError as e:
+            self.log.warning("Cannot update the mirror of '%s', using it"
+                             " directly: %s", self.project_path, e)
+            return None
+        return mirror
+
+    async def prepare(self):
+        """Prepare whatever is necessary to build the documentation and
+        doesn't depend on the source code. It runs concurrently with
+        :meth:`fetch`.
+
+        By default it does nothing.
+        """
+        pass
+
+    async def install(self):
+        """Prepare whatever is necessary to build the documentation.
+
+        By default it does nothing.
+        """
+        pass
+
+    async def build_inputs(self):
+        """Inputs of the documentation build: if none of them changed since
+        the last build, the documentation doesn't need to be rebuilt.
+
+        Must be called after :meth:`fetch`.
+
+        Returns
+        -------
+        dict
+            the revision of the source code, the hash of the configuration of
+            the project, the fingerprint of the environment and the directory
+            where the documentation is published
+        """
+        vcs_type = self.conf.get(self.project, "vcs")
+        revision = await vcs.get_revision(vcs_type, self.project_dir,
+                                          self.session.runner)
+        return {"revision": revision,
+                "config": manifest.config_hash(self.conf, self.project),
+                "environment": self.env_fingerprint(),
+                "target": str(self.target_dir),
+                }
+
+    def doc_paths(self):
+        """Paths, relative to :attr:`project_dir`, of the files the
+        documentation depends upon, from the ``doc-paths`` option.
+
+        Returns
+        -------
+        list of strings or None
+            ``None`` if any file might affect the documentation
+        """
+        paths = self.conf.get(self.project, "doc-paths", fallback="").split()
+        return paths or None
+
+    async def doc_changed(self, since):
+        """Check whether the files the documentation depends upon, see
+        :meth:`doc_paths`, changed since the revision ``since``.
+
+        Must be called after :meth:`fetch`.
+
+        Parameters
+        ----------
+        since : string
+            revision of the last build
+
+        Returns
+        -------
+        bool
+            ``True`` also if it can't be decided
+        """
+        paths = self.doc_paths()
+        if paths is None:
+            return True
+        if self.subdir is not None:
+            paths = [str(Path(self.subdir) / p) for p in paths]
+        vcs_type = self.conf.get(self.project, "vcs")
+        try:
+            revision = await vcs.get_revision(vcs_type, self.repo_dir,
+                                              self.session.runner)
+            changed = await vcs.changed_files(vcs_type, since, revision, paths,
+                                              self.repo_dir,
+                                              self.session.runner)
+        except vcs.VCSError as e:
+            self.log.debug("cannot compare with revision %s: %s", since, e)
+            return True
+        self.log.debug("%d documentation files changed since %s",
+                       len(changed), since)
+        return bool(changed)
+
+    def env_fingerprint(self):
+        """Fingerprint of the environment used to build the documentation, e.g.
+        the installed packages.
+
+        It is used to decide whether the documentation must be rebuilt. By
+        default there is no environment.
+
+        Returns
+        -------
+        string or None
+            ``None`` if the environment is not ready yet
+        """
+        return ""
+
+    def build_signature(self):
+        """Description of the documentation build that doesn't depend on the
+        profile, e.g. the build command without the profile directories.
+
+        It is part of the key of the build in the artifact cache. By default
+        the builds are not cached.
+
+        Returns
+        -------
+        list or None
+            ``None`` if the build must not be cached
+        """
+        return None
+
     @property
     @abc.abstractmethod
     def build_cmd(self):
@@ -73,35 +325,57 @@ class BaseBuilder(metaclass=abc.ABCMeta):
         cmd = []
         return cmd
 
-    def build_doc(self):
+    async def build_doc(self):
         """Build the documentation.
 
-        Execute the :attr:`build_cmd` in a shell and log the output
+        Execute the :attr:`build_cmd` and log the output as it comes
+
+        Returns
+        -------
+        bool
+            whether the build succeeded
         """
-        self.log.debug("running '%s'", " ".join(self.build_cmd))
-        p = sp.Popen(self.build_cmd, stdout=sp.PIPE, stderr=sp.PIPE,
-                     universal_newlines=True)
-        stdout, stderr = p.communicate()
-        if stdout:
-            self.log.debug(stdout)
-        if stderr:
-            self.log.error(stderr)
-        if p.returncode > 0:
-            self.log.critical("'%s' return code is '%d'",
-                              " ".join(self.build_cmd), p.returncode)
+        cmd = self.build_cmd
+        self.log.debug("running '%s'", " ".join(cmd))
+        result = await self._run_build(cmd)
+        if result.returncode > 0:
+            self.log.critical("'%s' return code is '%d'", " ".join(cmd),
+                              result.returncode)
+        return result.returncode == 0
+
+    async def _run_build(self, cmd):
+        """Execute the build command, logging the output as it comes
+
+        Parameters
+        ----------
+        cmd : list of strings
+            build command
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.runner.CommandResult`
+        """
+        return await self.session.runner.run(cmd, cwd=self.project_dir,
+                                             on_stdout=self.log.debug,
+                                             on_stderr=self.log.error)
 
     @property
     def html_dir(self):
         """Directory where the documentation has been built.
 
-        If the documentation builder, doesn't allow to decide the output
-        directory, override this property.
+        If the ``staging_dir`` option of the ``general`` section is given, the
+        documentation is built there, so that it can be renamed, instead of
+        copied, to the target directory. If the documentation builder, doesn't
+        allow to decide the output directory, override this property.
 
         Returns
         -------
         :class:`pathlib.Path`
             directory contating the html files
         """
+        staging_dir = self.conf.get('general', 'staging_dir', fallback=None)
+        if staging_dir:
+            return Path(staging_dir) / self.profile / self.project
         return dutils.build_dir(self.profile, self.project) / 'html'
 
     @property
@@ -116,19 +390,48 @@ class BaseBuilder(metaclass=abc.ABCMeta):
         _target_dir = Path(self.conf.get('general', 'target_dir'))
         return _target_dir / self.profile / self.project
 
+    @property
+    def publish_mode(self):
+        """How the documentation is published, from the ``publish`` option of
+        the ``general`` section; see :mod:`~dodocs.mkdoc.publish`"""
+        return self.conf.get('general', 'publish',
+                             fallback=publish.DEFAULT_MODE)
+
     def move_doc(self):
         """Move the documentation to the ``target_dir`` defined in the
         configuration file.
+
+        In :attr:`incremental` mode, copy it instead.
+
+        Returns
+        -------
+        :class:`pathlib.Path` or None
+            the old documentation, to be removed with
+            :func:`~dodocs.mkdoc.publish.remove_tree`
         """
-        # Remove the target directory. This way it avoids having spurious stuff
-        # for older builds
-        target_dir = str(self.target_dir)
-        try:
-            shutil.rmtree(target_dir)
-        except FileNotFoundError:
-            pass  # the directory does not exist
-        # move the hml
-        shutil.move(str(self.html_dir), target_dir)
+        return publish.publish(self.publish_mode, self.html_dir,
+                               self.target_dir, move=not self.incremental)
+
+    def copy_doc(self, html_dir, move=False):
+        """Copy the documentation in ``html_dir``, e.g. from the artifact
+        cache, to the ``target_dir`` defined in the configuration file.
+
+        Parameters
+        ----------
+        html_dir : :class:`pathlib.Path`
+            directory containing the html files
+        move : bool, optional
+            if ``True`` move ``html_dir`` instead, e.g. if it is a private
+            copy of the cached documentation
+
+        Returns
+        -------
+        :class:`pathlib.Path` or None
+            the old documentation, to be removed with
+            :func:`~dodocs.mkdoc.publish.remove_tree`
+        """
+        return publish.publish(self.publish_mode, html_dir, self.target_dir,
+                               move=move)
 
     @abc.abstractmethod
     def clear_tmp(self):
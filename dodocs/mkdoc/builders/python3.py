@@ -7,14 +7,38 @@ Copyright (c) 2015 Francesco Montesano
 MIT Licence
 """
 
+import hashlib
+import json
+import os
 import shutil
-import subprocess as sp
 
 import dodocs.utils as dutils
 
 import dodocs.mkdoc.builders.base_builder as bb
 from dodocs.mkdoc.builders import register_builder
 from dodocs.mkdoc.builders import pyvenvex
+from dodocs.mkdoc.builders import sphinxworker
+from dodocs.mkdoc.builders import venvpool
+from dodocs.mkdoc import runner as drunner
+from dodocs.mkdoc import vcs
+
+STAMP_FILE = "dodocs_stamp.json"
+"""name of the file, in the build directory, recording what the incremental
+builds depend upon"""
+
+PACKAGING_FILES = ["setup.cfg", "pyproject.toml", "requirements.txt",
+                   "MANIFEST.in"]
+"""files, besides python modules, that might affect the documentation of a
+package"""
+
+INSTALL_STAMP_FILE = "dodocs_installed.json"
+"""name of the file, in the virtual environment, recording what the
+installation of each project depends upon"""
+
+INSTALL_FILES = ["setup.py", "setup.cfg", "pyproject.toml",
+                 "requirements*.txt", "requirements/*.txt"]
+"""glob patterns of the files, relative to the project directory, determining
+how a package is installed"""
 
 
 class Py3BuilderError(RuntimeError):
@@ -25,25 +49,96 @@ class Py3BuilderError(RuntimeError):
 class Python3Builder(bb.BaseBuilder):
     """Python
 
+    Sphinx runs in a virtual environment of the pool shared by all the
+    profiles (see :mod:`~dodocs.mkdoc.builders.venvpool`), chosen after the
+    ``sphinx-requirements`` option. If the project must be installed, it is
+    installed in a virtual environment layered on top of it: the one of the
+    profile or, with the ``isolated-venv`` option, one of the project.
+
     Parameters
     ----------
     same as :class:`bb.BaseBuilder`
     """
-    def __init__(self, *args, **kwargs):
-        super(Python3Builder, self).__init__(*args, **kwargs)
-        self._prepare_venv()
+    async def prepare(self):
+        """Prepare the virtual environment"""
+        await self._prepare_venv()
 
+    async def install(self):
+        """If required, install the project in the virtual environment"""
         py_install = self.conf.get(self.project, "py-install")
-        if py_install.lower() not in ['no', 'none']:
-            self.log.debug("install %s? %s", self.project, py_install)
-            self._install_pkg(py_install)
+        if not self._installs:
+            return
+        self.log.debug("install %s? %s", self.project, py_install)
+        stamp = await drunner.in_thread(self._install_stamp, py_install)
+        # unless isolated, projects of the same profile share the virtual
+        # environment: don't let concurrent builds run pip in it at the same
+        # time
+        async with self.session.lock(str(self.venv_dir)):
+            if await drunner.in_thread(self._is_installed, stamp):
+                self.log.debug("packaging unchanged, skip the installation")
+                return
+            await self._install_pkg(py_install)
+            await drunner.in_thread(self._save_install_stamp, stamp)
+
+    @property
+    def _installs(self):
+        """Whether the project must be installed"""
+        py_install = self.conf.get(self.project, "py-install")
+        return py_install.lower() not in ['no', 'none']
+
+    def requirements(self):
+        """Packages needed to build the documentation, from the
+        ``sphinx-requirements`` option
+
+        Returns
+        -------
+        list of strings
+        """
+        requirements = self.conf.get(self.project, "sphinx-requirements",
+                                     fallback="").split()
+        return requirements or pyvenvex.DEFAULT_REQUIREMENTS
+
+    @property
+    def _isolated(self):
+        """Whether the project is installed in a virtual environment of its
+        own"""
+        return self.conf.getboolean(self.project, "isolated-venv",
+                                    fallback=False)
+
+    @property
+    def venv_dir(self):
+        """Directory of the virtual environment used to build the
+        documentation: the one of the pool or, if the project must be
+        installed, the one of the profile or of the project layered on top of
+        it.
+
+        Returns
+        -------
+        :class:`pathlib.Path`
+        """
+        pool_dir = venvpool.VenvPool().venv_dir(self.requirements())
+        if self._installs:
+            project = self.project if self._isolated else None
+            return dutils.venv_dir(self.profile, self.language,
+                                   key=pool_dir.name, project=project)
+        return pool_dir
 
-    def _prepare_venv(self):
+    async def _prepare_venv(self):
         """Prepare the virtual environment if necessary"""
-        self._venv_bin = pyvenvex.venv_bin(self.profile, self.language)
-        self.log.debug("virtualenv bin directory '%s'", self._venv_bin)
+        user = "{}.{}".format(self.profile, self.project)
+        pool_dir = await venvpool.VenvPool().get(
+            self.requirements(), user, dutils.profile_dir(self.profile),
+            self.session)
+        venv_dir = self.venv_dir
+        if venv_dir != pool_dir:
+            # the projects of a profile might share the layered virtual
+            # environment
+            async with self.session.lock(str(venv_dir)):
+                if not venv_dir.exists():
+                    await pyvenvex.layer_venv(venv_dir, pool_dir)
+        self.log.debug("virtualenv directory '%s'", venv_dir)
 
-    def _install_pkg(self, what_install):
+    async def _install_pkg(self, what_install):
         """Install it in developer mode
 
         Parameters
@@ -52,18 +147,21 @@ class Python3Builder(bb.BaseBuilder):
             what to install; if ``yes`` just install, if any other string
             interpret it as optional dependences
         """
-        pip = self._venv_bin / 'pip'
-        cmd = [str(pip), 'install', '-e']
+        venv_dir = self.venv_dir
         if what_install.lower() == 'yes':
-            cmd += ['.']
+            requirements = ['-e', '.']
         else:
-            cmd += ['.[{}]'.format(what_install)]
-        self.log.debug("running '%s'", " ".join(cmd))
+            requirements = ['-e', '.[{}]'.format(what_install)]
+        self.log.debug("installing '%s'", " ".join(requirements))
 
-        p = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE,
-                     universal_newlines=True)
-        stdout, stderr = p.communicate()
-        if p.returncode < 0:
+        # pip comes from the base virtual environment
+        wheelhouse = self.session.wheelhouse
+        result = await wheelhouse.install(pyvenvex.python_exe(venv_dir),
+                                          requirements, self.session,
+                                          cwd=self.project_dir)
+        cmd = result.cmd
+        stdout, stderr = result.stdout, result.stderr
+        if result.returncode < 0:
             if stdout:
                 self.log.debug(str(stdout).replace('\n\n', '\n'))
         else:
@@ -71,31 +169,257 @@ class Python3Builder(bb.BaseBuilder):
                 self.log.error(str(stdout).replace('\n\n', '\n'))
         if stderr:
             self.log.error(stderr)
-        if p.returncode > 0:
-            self.log.error("'%s' return code: %d", " ".join(cmd), p.returncode)
+        if result.returncode > 0:
+            self.log.error("'%s' return code: %d", " ".join(cmd),
+                           result.returncode)
             raise Py3BuilderError("pip failed")
 
+    def _install_stamp(self, what_install):
+        """Collect what the installation of the project depends upon: what to
+        install, the packaging files and the base virtual environment. The
+        installation is in developer mode, so the rest of the code is not
+        relevant.
+
+        Parameters
+        ----------
+        what_install : string
+            value of the ``py-install`` option
+
+        Returns
+        -------
+        string
+            hexadecimal digest
+        """
+        files = set()
+        for pattern in INSTALL_FILES:
+            files.update(self.project_dir.glob(pattern))
+        hashes = []
+        for fname in sorted(files):
+            with fname.open('rb') as f:
+                hashes.append([str(fname.relative_to(self.project_dir)),
+                               hashlib.sha1(f.read()).hexdigest()])
+        base_dir = pyvenvex.layer_base(self.venv_dir)
+        base = None if base_dir is None else pyvenvex.fingerprint(base_dir)
+        dump = json.dumps([str(self.project_dir), what_install, hashes, base])
+        return hashlib.sha1(dump.encode()).hexdigest()
+
+    def _installed_stamps(self):
+        """Stamps of the projects installed in the virtual environment
+
+        Returns
+        -------
+        dict
+            project name: stamp
+        """
+        try:
+            with (self.venv_dir / INSTALL_STAMP_FILE).open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _is_installed(self, stamp):
+        """Whether the project has already been installed with the same
+        ``stamp``, as returned by :meth:`_install_stamp`"""
+        return self._installed_stamps().get(self.project) == stamp
+
+    def _save_install_stamp(self, stamp):
+        """Record the ``stamp`` of the project after installing it"""
+        stamps = self._installed_stamps()
+        stamps[self.project] = stamp
+        stamp_file = self.venv_dir / INSTALL_STAMP_FILE
+        tmp = stamp_file.with_name(stamp_file.name + ".tmp")
+        with tmp.open('w') as f:
+            json.dump(stamps, f, indent=2, sort_keys=True)
+        os.replace(str(tmp), str(stamp_file))
+
+    def env_fingerprint(self):
+        """Fingerprint of the virtual environment"""
+        return pyvenvex.fingerprint(self.venv_dir)
+
     @property
-    def build_cmd(self):
-        project_dir = dutils.project_dir(self.profile, self.project)
-        source_dirs = project_dir.glob('doc*/**/*source*/conf.py')
+    def source_dir(self):
+        """Directory containing the sphinx ``conf.py`` file
+
+        Returns
+        -------
+        :class:`pathlib.Path`
+        """
+        source_dirs = self.project_dir.glob('doc*/**/*source*/conf.py')
         try:
-            source_dir = next(source_dirs).parent
+            return next(source_dirs).parent
         except StopIteration:
             msg = ("The documentation is expected to be found in a `*source*`"
                    " directory, containing a `conf.py` file, at any depth"
                    " within `doc` or `docs` directory")
             raise Py3BuilderError(msg)
 
+    def doc_paths(self):
+        """The ``doc-paths`` option or, if not given: the documentation
+        directory, the packages and modules, for ``autodoc``, and the
+        packaging files"""
+        paths = super(Python3Builder, self).doc_paths()
+        if paths is not None:
+            return paths
+        try:
+            source_dir = self.source_dir.relative_to(self.project_dir)
+        except Py3BuilderError:
+            return None
+        paths = [source_dir.parts[0]]
+        for path in self.project_dir.iterdir():
+            if path.name.startswith('.') or path.name == paths[0]:
+                continue
+            if (path.name == 'src' or (path / '__init__.py').exists() or
+                    path.suffix == '.py' or path.name in PACKAGING_FILES):
+                paths.append(path.name)
+        return sorted(paths)
+
+    def build_signature(self):
+        """The builder and the source directory, relative to the
+        repository"""
+        source_dir = self.source_dir.relative_to(self.repo_dir)
+        return ['sphinx-build', '-b', 'html', str(source_dir)]
+
+    @property
+    def sphinx_args(self):
+        """Arguments of ``sphinx-build``
+
+        Returns
+        -------
+        list of strings
+        """
+        build_dir = dutils.build_dir(self.profile, self.project)
+        args = ['-b', 'html', '-d', str(build_dir / 'doctrees')]
+        if self.cpu_jobs > 1:
+            args += ['-j', str(self.cpu_jobs)]
+        args += [str(self.source_dir), str(self.html_dir)]
+        return args
+
+    @property
+    def build_cmd(self):
+        """Run sphinx, with :attr:`sphinx_args`, with the python of the
+        virtual environment"""
+        python = pyvenvex.python_exe(self.venv_dir)
+        return [str(python), '-m', 'sphinx'] + self.sphinx_args
+
+    async def _run_build(self, cmd):
+        """Run the build in the warm sphinx worker of the virtual environment,
+        if available, otherwise execute the build command"""
+        python = pyvenvex.python_exe(self.venv_dir)
+        worker = await self.session.sphinx_worker(python,
+                                                  self.env_fingerprint())
+        if worker is None:
+            return await super(Python3Builder, self)._run_build(cmd)
+
+        runner = self.session.runner
+        try:
+            if runner.semaphore is None:
+                return await self._worker_build(worker)
+            async with runner.semaphore:
+                return await self._worker_build(worker)
+        except sphinxworker.WorkerError as e:
+            self.log.warning("%s: using sphinx-build", e)
+            return await super(Python3Builder, self)._run_build(cmd)
+
+    async def _worker_build(self, worker):
+        """Run the build, with :attr:`sphinx_args`, in the sphinx
+        ``worker``"""
+        self.log.debug("building in the sphinx %s worker",
+                       worker.sphinx_version)
+        return await worker.build(self.sphinx_args, self.project_dir,
+                                  timeout=self.session.runner.timeout,
+                                  on_stdout=self.log.debug,
+                                  on_stderr=self.log.error)
+
+    async def build_doc(self):
+        """Build the documentation.
+
+        In incremental mode, sphinx reuses the environment and doctrees of the
+        previous build, unless a full rebuild is needed, i.e. if ``conf.py``,
+        the virtual environment (e.g. the sphinx or extensions versions) or
+        the branch changed.
+        """
+        if not self.incremental:
+            return await super(Python3Builder, self).build_doc()
+        stamp = await drunner.in_thread(self._incremental_stamp)
+        await drunner.in_thread(self._check_stamp, stamp)
+        success = await super(Python3Builder, self).build_doc()
+        # a failed build might leave the doctrees half done
+        await drunner.in_thread(self._save_stamp, stamp if success else None)
+        return success
+
+    def _incremental_stamp(self):
+        """Collect what the incremental builds depend upon.
+
+        The branch is the one configured with the ``branch`` option: the
+        updates reset the local branch to the fetched one without renaming
+        it, so its name doesn't tell what is checked out.
+
+        Returns
+        -------
+        dict
+        """
+        with (self.source_dir / 'conf.py').open('rb') as f:
+            conf_hash = hashlib.sha1(f.read()).hexdigest()
+        branch = vcs.fetch_options(self.conf, self.project).branch
+        return {"conf.py": conf_hash,
+                "environment": self.env_fingerprint(),
+                "branch": branch or "HEAD",
+                }
+
+    def _check_stamp(self, stamp):
+        """Remove the build directory if ``stamp`` differs from the one of
+        the previous successful build.
+
+        Parameters
+        ----------
+        stamp : dict
+            output of :meth:`_incremental_stamp`
+        """
         build_dir = dutils.build_dir(self.profile, self.project)
-        cmd = ['sphinx-build', '-b', 'html', '-d', str(build_dir / 'doctrees'),
-               str(source_dir), str(build_dir / 'html')]
-        return cmd
+        stamp_file = build_dir / STAMP_FILE
+        try:
+            with stamp_file.open() as f:
+                old_stamp = json.load(f)
+        except (OSError, ValueError):
+            old_stamp = None
+
+        if old_stamp != stamp:
+            if build_dir.exists():
+                self.log.info("Full rebuild needed")
+                shutil.rmtree(str(build_dir))
+            # e.g. in the staging directory
+            shutil.rmtree(str(self.html_dir), ignore_errors=True)
+            build_dir.mkdir(parents=True)
+        else:
+            self.log.debug("Incremental build")
+
+    def _save_stamp(self, stamp):
+        """Save the ``stamp`` of a successful build, or remove the one saved
+        if ``None``, so that the next build is a full one
+
+        Parameters
+        ----------
+        stamp : dict or None
+            output of :meth:`_incremental_stamp`
+        """
+        stamp_file = dutils.build_dir(self.profile, self.project) / STAMP_FILE
+        if stamp is None:
+            try:
+                stamp_file.unlink()
+            except FileNotFoundError:
+                pass
+            return
+        with stamp_file.open('w') as f:
+            json.dump(stamp, f, indent=2, sort_keys=True)
 
     def clear_tmp(self):
-        """Clear the temporary directory where the documentation has been built
+        """Clear the temporary directory where the documentation has been
+        built, unless in incremental mode
         """
-        shutil.rmtree(str(dutils.build_dir(self.profile, self.project)))
+        if not self.incremental:
+            shutil.rmtree(str(dutils.build_dir(self.profile, self.project)))
+            # still there if copied, e.g. by the sync publish mode
+            shutil.rmtree(str(self.html_dir), ignore_errors=True)
 
 
 register_builder('python3', Python3Builder)
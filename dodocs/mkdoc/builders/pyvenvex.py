@@ -12,19 +12,29 @@ Copyright 2015 Francesco Montesano.
 MIT Licence
 """
 
+import hashlib
 import os
+from pathlib import Path
 import shutil
-import subprocess as sp
 import sys
 import venv
 
-import dodocs.utils as dutils
 import dodocs.logger as dlog
 
+from dodocs.mkdoc import runner as drunner
+
 if sys.version_info < (3, 3) or not hasattr(sys, 'base_prefix'):
     raise ValueError('This script is only for use with Python 3.3 or later')
 
 
+DEFAULT_REQUIREMENTS = ["sphinx"]
+"packages installed in the virtual environments by default"
+
+LAYER_FILE = "_dodocs_base.pth"
+"""name of the file, in ``site-packages``, pointing a layered virtual
+environment to its base"""
+
+
 class VenvError(RuntimeError):
     """Error raised when something goes wrong with the virtualenv"""
 
@@ -46,50 +56,141 @@ def bin_dir(venv_dir):
     return venv_dir / 'bin'
 
 
-def venv_bin(profile, pyversion):
-    """Returns the path to the bin directory of the virtual environment for the
-    given python version. Create it if necessary
+def python_exe(venv_dir):
+    """Python executable of the virtual environment
 
     Parameters
     ----------
-    profile : string
-        name of the profile
-    pyversion : string
-        name of the python exe (e.g. ``python3``)
+    venv_dir : :class:`pathlib.Path`
+        directory of the virtual environment
 
     Returns
     -------
-    string
-        bin directory
+    :class:`pathlib.Path`
     """
-    venv_dir = dutils.venv_dir(profile, pyversion)
-    bindir = bin_dir(venv_dir)
-    if not venv_dir.exists():
-        create_venv(venv_dir)
+    return bin_dir(venv_dir) / 'python'
+
+
+def site_packages(venv_dir):
+    """``site-packages`` directory of the virtual environment, created with
+    the current python version
 
-    return bindir
+    Parameters
+    ----------
+    venv_dir : :class:`pathlib.Path`
+        directory of the virtual environment
 
+    Returns
+    -------
+    :class:`pathlib.Path`
+    """
+    python = "python{}.{}".format(*sys.version_info[:2])
+    return venv_dir / 'lib' / python / 'site-packages'
 
-@dutils.format_docstring(dutils.VENV_DIRECTORY)
-def create_venv(venv_dir):
-    """Create the virtual environment for the given python version and install
-    sphinx in it.
 
-    The virtual environment is located into the "{0}" subdirectory in the
-    project.
+def fingerprint(venv_dir):
+    """Fingerprint of the virtual environment: it changes when the python
+    version or any installed package changes. It doesn't depend on the
+    location of the virtual environment.
 
     Parameters
     ----------
     venv_dir : string
+        name of the directory of the virtual environment
+
+    Returns
+    -------
+    string or None
+        hexadecimal digest, ``None`` if the virtual environment does not exist
+    """
+    try:
+        with (venv_dir / 'pyvenv.cfg').open() as f:
+            # the command used to create the venv contains its path: skip it
+            cfg = [line for line in f if not line.startswith('command')]
+    except OSError:
+        return None
+
+    sha = hashlib.sha1("".join(cfg).encode())
+    # the names of the metadata directories contain package names and versions
+    installed = sorted(p.name for p in
+                       venv_dir.glob('lib/python*/site-packages/*-info'))
+    for name in installed:
+        sha.update(name.encode())
+
+    # the packages of the base virtual environment are visible as well
+    base_dir = layer_base(venv_dir)
+    if base_dir is not None:
+        base = fingerprint(base_dir)
+        if base is None:
+            return None
+        sha.update(base.encode())
+    return sha.hexdigest()
+
+
+def layer_base(venv_dir):
+    """Base of a layered virtual environment, see :func:`layer_venv`
+
+    Parameters
+    ----------
+    venv_dir : :class:`pathlib.Path`
+        directory of the virtual environment
+
+    Returns
+    -------
+    :class:`pathlib.Path` or None
+        directory of the base virtual environment, ``None`` if ``venv_dir``
+        is not layered
+    """
+    try:
+        with (site_packages(venv_dir) / LAYER_FILE).open() as f:
+            base_site = Path(f.read().strip())
+    except OSError:
+        return None
+    # <base>/lib/pythonX.Y/site-packages
+    return base_site.parents[2]
+
+
+async def create_venv(venv_dir, session, requirements=None):
+    """Create the virtual environment and install sphinx in it.
+
+    Parameters
+    ----------
+    venv_dir : :class:`pathlib.Path`
         name of the directory in which the virtual environment should be
         created
+    session : :class:`~dodocs.mkdoc.session.BuildSession`
+        current build session; its wheelhouse provides the packages
+    requirements : list of strings, optional
+        packages to install; defaults to :data:`DEFAULT_REQUIREMENTS`
     """
     log = dlog.getLogger()
 
-    build_venv(venv_dir)
+    await build_venv(venv_dir, session, requirements=requirements)
     log.debug("Virtualenv '%s' created", venv_dir)
 
 
+async def layer_venv(venv_dir, base_dir):
+    """Create a virtual environment on top of the one in ``base_dir``: the
+    packages installed in the latter, e.g. sphinx and pip, are visible also in
+    the new one, while new packages are installed in the new one.
+
+    Parameters
+    ----------
+    venv_dir : :class:`pathlib.Path`
+        name of the directory in which the virtual environment should be
+        created
+    base_dir : :class:`pathlib.Path`
+        directory of the base virtual environment
+    """
+    log = dlog.getLogger()
+
+    builder = VenvInVenvBuilder(with_pip=False)
+    await drunner.in_thread(builder.create, str(venv_dir))
+    with (site_packages(venv_dir) / LAYER_FILE).open('w') as f:
+        f.write(str(site_packages(base_dir)) + '\n')
+    log.debug("Virtualenv '%s' created on top of '%s'", venv_dir, base_dir)
+
+
 class VenvInVenvBuilder(venv.EnvBuilder):
     """Virtual environment builder that, when instantiated from an other
     virtual environment, modifies the context to use global
@@ -136,42 +237,132 @@ class VenvInVenvBuilder(venv.EnvBuilder):
         return context
 
 
-def build_venv(venv_dir):
+async def build_venv(venv_dir, session, requirements=None):
     """Create the virtual environments
 
     Parameters
     ----------
-    venv_dir : string
+    venv_dir : :class:`pathlib.Path`
         name of the directory of the virtual environment
+    session : :class:`~dodocs.mkdoc.session.BuildSession`
+        current build session; its wheelhouse provides the packages
+    requirements : list of strings, optional
+        packages to install; defaults to :data:`DEFAULT_REQUIREMENTS`
     """
-    log = dlog.getLogger()
+    if requirements is None:
+        requirements = DEFAULT_REQUIREMENTS
 
     builder = VenvInVenvBuilder(with_pip=True)
-    builder.create(str(venv_dir))
-    log.debug("Installing sphinx")
-    pip = bin_dir(venv_dir) / 'pip'
-    cmd = [str(pip), 'install', 'sphinx']
+    await drunner.in_thread(builder.create, str(venv_dir))
+    await install_packages(venv_dir, session, requirements)
+
+
+def clone_venv(src_dir, venv_dir):
+    """Copy the virtual environment in ``src_dir`` to ``venv_dir``, creating
+    hard links instead of copying the files whenever possible. Symbolic links
+    are copied as such.
+
+    The copy shares the files with the original one: they must never be
+    modified in place. ``pip`` removes the files before writing them and
+    :func:`relocate_venv` replaces the ones it changes.
+
+    Parameters
+    ----------
+    src_dir : :class:`pathlib.Path`
+        directory of the virtual environment to copy
+    venv_dir : :class:`pathlib.Path`
+        directory of the new virtual environment; it must not exist
+    """
+    src_dir = str(src_dir)
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dest = os.path.join(str(venv_dir), os.path.relpath(dirpath, src_dir))
+        os.makedirs(dest)
+        for name in dirnames + filenames:
+            src = os.path.join(dirpath, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), os.path.join(dest, name))
+            elif name in filenames:
+                try:
+                    os.link(src, os.path.join(dest, name))
+                except OSError:  # e.g. on an other file system
+                    shutil.copy2(src, os.path.join(dest, name))
+        # don't walk into the linked directories
+        dirnames[:] = [d for d in dirnames
+                       if not os.path.islink(os.path.join(dirpath, d))]
+
+
+def relocate_venv(venv_dir, old_dir, new_dir):
+    """Replace ``old_dir`` with ``new_dir`` in the files of the virtual
+    environment that contain its path: ``pyvenv.cfg``, the activation scripts
+    and the shebang of the scripts in the ``bin`` directory. The modified
+    files are written anew, so that the hard links created by
+    :func:`clone_venv` are broken.
+
+    Parameters
+    ----------
+    venv_dir : :class:`pathlib.Path`
+        directory of the virtual environment to fix
+    old_dir, new_dir : :class:`pathlib.Path`
+        directory of the virtual environment the files refer to and the one
+        they must refer to
+    """
+    old, new = str(old_dir).encode(), str(new_dir).encode()
+    fnames = [venv_dir / 'pyvenv.cfg']
+    fnames += [p for p in bin_dir(venv_dir).iterdir()
+               if p.is_file() and not p.is_symlink()]
+    for fname in fnames:
+        with fname.open('rb') as f:
+            content = f.read()
+        if old not in content:
+            continue
+        tmp = fname.with_name(fname.name + '.tmp')
+        with tmp.open('wb') as f:
+            f.write(content.replace(old, new))
+        shutil.copymode(str(fname), str(tmp))
+        os.replace(str(tmp), str(fname))
+
+
+async def install_packages(venv_dir, session, requirements):
+    """Install ``requirements`` in the virtual environment. If this fails, the
+    virtual environment is removed.
+
+    Parameters
+    ----------
+    venv_dir : :class:`pathlib.Path`
+        name of the directory of the virtual environment
+    session : :class:`~dodocs.mkdoc.session.BuildSession`
+        current build session; its wheelhouse provides the packages
+    requirements : list of strings
+        packages to install
+    """
+    log = dlog.getLogger()
+    log.debug("Installing %s", " ".join(requirements))
+    pip = python_exe(venv_dir)
     try:
-        p = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE,
-                     universal_newlines=True)
-        stdout, stderr = p.communicate()
-        if p.returncode == 0:
-            if stdout:
-                log.debug(stdout)
-            if stderr:
-                log.warning(stderr)
-            log.debug("Sphinx installed")
+        result = await session.wheelhouse.install(pip, requirements, session)
+        if result.returncode == 0:
+            if result.stdout:
+                log.debug(result.stdout)
+            if result.stderr:
+                log.warning(result.stderr)
+            log.debug("%s installed", " ".join(requirements))
         else:
-            if stdout:
-                log.warning(stdout)
-            if stderr:
-                log.error(stderr)
+            if result.stdout:
+                log.warning(result.stdout)
+            if result.stderr:
+                log.error(result.stderr)
 
             log.info("Removing '%s' to avoid future problems", venv_dir)
-            shutil.rmtree(str(venv_dir))
-            raise VenvError("The installation of sphinx failed. Are you"
-                            " connected to the internet?")
+            await drunner.in_thread(shutil.rmtree, str(venv_dir))
+            if session.wheelhouse.offline:
+                msg = ("The installation of {} failed. Are they in the"
+                       " wheelhouse '{}'?")
+            else:
+                msg = ("The installation of {} failed. Are you connected to"
+                       " the internet?")
+            raise VenvError(msg.format(" ".join(requirements),
+                                       session.wheelhouse.path))
 
     except FileNotFoundError:
-        log.error("The installation of 'sphinx' failed because '%s' could not"
-                  " be found ", pip)
+        log.error("The installation of '%s' failed because '%s' could not"
+                  " be found ", " ".join(requirements), pip)
@@ -0,0 +1,180 @@
+"""Sphinx build server
+
+This script runs in a virtual environment with sphinx, started by
+:class:`~dodocs.mkdoc.builders.sphinxworker.SphinxWorker`: it must not import
+``dodocs`` and depend only on the standard library and sphinx.
+
+It imports sphinx and its builtin extensions once, then reads build requests,
+one json object per line, from the standard input. Every build runs
+``sphinx-build`` in a forked child, so that the builds don't affect each other
+and can run concurrently. The output of the builds is streamed back, one json
+object per line, on the standard output:
+
+* ``{"ready": true, "sphinx": version}``: once the server is ready;
+* ``{"id": id, "stdout": line}`` and ``{"id": id, "stderr": line}``: a line of
+  output of the build ``id``;
+* ``{"id": id, "returncode": code}``: the build ``id`` is finished.
+
+The requests are ``{"id": id, "argv": arguments, "cwd": directory}`` to start a
+build with the given ``sphinx-build`` arguments and ``{"kill": id}`` to stop
+it. The server exits when its standard input is closed.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import importlib
+import json
+import os
+import selectors
+import signal
+import sys
+import traceback
+
+PRELOAD = ["sphinx.ext.autodoc", "sphinx.ext.autosummary",
+           "sphinx.ext.intersphinx", "sphinx.ext.mathjax",
+           "sphinx.ext.napoleon", "sphinx.ext.viewcode"]
+"""extensions, besides the builtin ones, imported at start up if available"""
+
+_CHUNK = 2 ** 16
+
+
+def main():
+    """Run the server"""
+    # keep the standard output for the protocol only
+    channel = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+    # the directory of this script: its modules must not shadow the ones of
+    # the projects
+    del sys.path[0]
+
+    import sphinx
+    from sphinx import application
+    from sphinx.cmd import build
+    for name in list(application.builtin_extensions) + PRELOAD:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+    _send(channel, ready=True, sphinx=sphinx.__version__)
+
+    selector = selectors.DefaultSelector()
+    selector.register(0, selectors.EVENT_READ)
+    pending = b""
+    children = {}  # build id: [pid, number of open pipes]
+    while True:
+        for key, _ in selector.select():
+            if key.data is None:
+                data = os.read(0, _CHUNK)
+                if not data:
+                    for pid, _ in children.values():
+                        _kill(pid)
+                    return
+                lines = (pending + data).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    request = json.loads(line.decode())
+                    if "kill" in request:
+                        child = children.get(request["kill"])
+                        if child is not None:
+                            _kill(child[0])
+                        continue
+                    children[request["id"]] = [
+                        _start(build, request, selector, channel), 2]
+                continue
+
+            build_id, stream, buf = key.data
+            data = os.read(key.fd, _CHUNK)
+            lines = (buf[0] + data).split(b"\n")
+            buf[0] = lines.pop()
+            if not data and buf[0]:
+                lines.append(buf[0])
+            for line in lines:
+                _send(channel, id=build_id,
+                      **{stream: line.decode(errors="replace")})
+            if data:
+                continue
+
+            selector.unregister(key.fd)
+            os.close(key.fd)
+            child = children[build_id]
+            child[1] -= 1
+            if child[1] == 0:
+                del children[build_id]
+                _, status = os.waitpid(child[0], 0)
+                if os.WIFSIGNALED(status):
+                    returncode = -os.WTERMSIG(status)
+                else:
+                    returncode = os.WEXITSTATUS(status)
+                _send(channel, id=build_id, returncode=returncode)
+
+
+def _start(build, request, selector, channel):
+    """Fork a child running ``sphinx-build`` and register the pipes with its
+    output in the ``selector``
+
+    Parameters
+    ----------
+    build : module
+        :mod:`sphinx.cmd.build`
+    request : dict
+        build request
+    selector : :class:`selectors.BaseSelector`
+        selector of the server
+    channel : file object
+        protocol channel, closed in the child
+
+    Returns
+    -------
+    int
+        pid of the child
+    """
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        returncode = 1
+        try:
+            os.close(channel.fileno())
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            os.chdir(request["cwd"])
+            # like "python -m sphinx" run in the same directory
+            sys.path.insert(0, os.getcwd())
+            sys.argv = ["sphinx-build"] + request["argv"]
+            returncode = build.main(request["argv"])
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(returncode)
+
+    os.close(out_w)
+    os.close(err_w)
+    selector.register(out_r, selectors.EVENT_READ,
+                      (request["id"], "stdout", [b""]))
+    selector.register(err_r, selectors.EVENT_READ,
+                      (request["id"], "stderr", [b""]))
+    return pid
+
+
+def _kill(pid):
+    """Kill the child ``pid``, if still running"""
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _send(channel, **message):
+    """Write the ``message`` to the ``channel``"""
+    channel.write(json.dumps(message) + "\n")
+
+
+if __name__ == "__main__":
+    main()
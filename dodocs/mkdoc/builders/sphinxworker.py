@@ -0,0 +1,208 @@
+"""Warm sphinx worker
+
+Starting ``sphinx-build`` means starting the interpreter and importing sphinx
+and its extensions, which for small projects takes most of the build time. A
+:class:`SphinxWorker` runs :mod:`~dodocs.mkdoc.builders.sphinx_server` in a
+virtual environment: it imports sphinx once and then runs every build in a
+forked child, streaming back its output.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import asyncio
+import collections
+import itertools
+import json
+from pathlib import Path
+
+from dodocs.mkdoc import runner as drunner
+
+SERVER_SCRIPT = Path(__file__).with_name("sphinx_server.py")
+"script run by the worker"
+
+START_TIMEOUT = 60.
+"maximum time, in seconds, the worker can take to start"
+
+# maximum length of a message from the worker
+_LINE_LIMIT = 2 ** 20
+
+# build running in the worker
+_Build = collections.namedtuple("_Build", ["future", "stdout", "stderr",
+                                           "on_stdout", "on_stderr"])
+
+
+class WorkerError(RuntimeError):
+    """The worker can't be started or died"""
+    pass
+
+
+class SphinxWorker(object):
+    """Long lived process building documentation with sphinx
+
+    Parameters
+    ----------
+    python : :class:`pathlib.Path`
+        python executable of the virtual environment with sphinx
+
+    Attributes
+    ----------
+    python : as above
+    sphinx_version : string
+        version of sphinx, once the worker is started
+    """
+    def __init__(self, python):
+        self.python = python
+        self.sphinx_version = None
+        self._proc = None
+        self._reader = None
+        self._builds = {}
+        self._ids = itertools.count()
+
+    async def start(self):
+        """Start the worker and wait for it to be ready
+
+        Raises
+        ------
+        WorkerError
+            if the worker doesn't start
+        """
+        self._proc = await asyncio.create_subprocess_exec(
+            str(self.python), str(SERVER_SCRIPT),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL, limit=_LINE_LIMIT)
+        try:
+            line = await asyncio.wait_for(self._proc.stdout.readline(),
+                                          START_TIMEOUT)
+            message = json.loads(line.decode())
+        except (asyncio.TimeoutError, ValueError):
+            message = {}
+        if not message.get("ready"):
+            await self._kill()
+            raise WorkerError("The sphinx worker for '{}' didn't"
+                              " start".format(self.python))
+        self.sphinx_version = message.get("sphinx")
+        self._reader = asyncio.ensure_future(self._read())
+
+    @property
+    def alive(self):
+        """Whether the worker is running"""
+        return self._reader is not None and not self._reader.done()
+
+    async def build(self, argv, cwd, timeout=None, on_stdout=None,
+                    on_stderr=None):
+        """Run ``sphinx-build`` with the given arguments in the worker.
+
+        If the task running the build is cancelled, the build is killed.
+
+        Parameters
+        ----------
+        argv : list of strings
+            arguments of ``sphinx-build``
+        cwd : string or :class:`pathlib.Path`
+            directory where to run the build
+        timeout : float, optional
+            kill the build after this number of seconds. If ``None`` the
+            build can run forever
+        on_stdout, on_stderr : callable, optional
+            called with every line of the standard output and error as soon
+            as it is available
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.runner.CommandResult`
+            the outcome of the build
+
+        Raises
+        ------
+        WorkerError
+            if the worker is not running or dies during the build
+        :class:`~dodocs.mkdoc.runner.CommandTimeout`
+            if the build takes longer than ``timeout``
+        """
+        if not self.alive:
+            raise WorkerError("The sphinx worker for '{}' is not"
+                              " running".format(self.python))
+        argv = [str(a) for a in argv]
+        cmd = [str(self.python), '-m', 'sphinx'] + argv
+        build_id = next(self._ids)
+        build = _Build(asyncio.get_event_loop().create_future(), [], [],
+                       on_stdout, on_stderr)
+        self._builds[build_id] = build
+        self._send(id=build_id, argv=argv, cwd=str(cwd))
+        try:
+            returncode = await asyncio.wait_for(asyncio.shield(build.future),
+                                                timeout)
+        except asyncio.TimeoutError:
+            self._send(kill=build_id)
+            msg = "'{}' killed after {} seconds".format(" ".join(cmd),
+                                                        timeout)
+            raise drunner.CommandTimeout(_result(cmd, None, build), msg)
+        except asyncio.CancelledError:
+            self._send(kill=build_id)
+            raise
+        finally:
+            del self._builds[build_id]
+        return _result(cmd, returncode, build)
+
+    async def close(self):
+        """Stop the worker, killing the builds still running"""
+        if self._proc is None:
+            return
+        if self._proc.returncode is None:
+            self._proc.stdin.close()
+            try:
+                await asyncio.wait_for(self._proc.wait(), START_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self._kill()
+        if self._reader is not None:
+            await self._reader
+
+    async def _read(self):
+        """Dispatch the messages of the worker to the builds until it
+        exits"""
+        while True:
+            line = await self._proc.stdout.readline()
+            if not line:
+                break
+            message = json.loads(line.decode())
+            build = self._builds.get(message.get("id"))
+            if build is None:
+                continue  # e.g. a build killed after a timeout
+            if "returncode" in message:
+                if not build.future.done():
+                    build.future.set_result(message["returncode"])
+                continue
+            for stream in ["stdout", "stderr"]:
+                if stream in message:
+                    getattr(build, stream).append(message[stream])
+                    callback = getattr(build, "on_" + stream)
+                    if callback is not None:
+                        callback(message[stream])
+
+        for build in self._builds.values():
+            if not build.future.done():
+                build.future.set_exception(WorkerError(
+                    "The sphinx worker for '{}' died".format(self.python)))
+
+    def _send(self, **message):
+        """Send the ``message`` to the worker"""
+        try:
+            self._proc.stdin.write((json.dumps(message) + "\n").encode())
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the worker died, :meth:`_read` notices it
+
+    async def _kill(self):
+        """Kill the worker, if still running"""
+        if self._proc.returncode is None:
+            try:
+                self._proc.kill()
+            except ProcessLookupError:
+                pass
+            await self._proc.wait()
+
+
+def _result(cmd, returncode, build):
+    """Build the :class:`~dodocs.mkdoc.runner.CommandResult`"""
+    return drunner.CommandResult(cmd, returncode, "\n".join(build.stdout),
+                                 "\n".join(build.stderr))
@@ -0,0 +1,352 @@
+"""Pool of virtual environments shared by all the profiles
+
+Every virtual environment of the pool is identified by the python interpreter
+and by the packages installed in it, e.g. sphinx and its extensions. Projects
+asking for the same packages share the same virtual environment, so a new
+profile doesn't need to create and fill a new one.
+
+Each virtual environment records the projects using it: the ones whose profile
+has been removed, or that moved to an other virtual environment, are not
+counted. The virtual environments not used by any project are removed, least
+recently used first.
+
+The virtual environments are not built from scratch: a "golden" virtual
+environment with the default packages is built once for each interpreter and
+copied, using hard links, into a temporary directory. There the paths are
+fixed, the packages requested installed, and finally the temporary directory
+is renamed.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import hashlib
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+
+import dodocs.logger as dlog
+import dodocs.utils as dutils
+
+from dodocs.mkdoc import runner as drunner
+from dodocs.mkdoc.builders import pyvenvex
+
+INFO_FILE = "dodocs_pool.json"
+"name of the file describing a virtual environment of the pool"
+
+REFS_DIRECTORY = "dodocs_refs"
+"""name of the directory, in each virtual environment of the pool, containing
+one file per project using it"""
+
+GOLDEN_PREFIX = ".golden-"
+"""prefix of the name of the golden virtual environment; the leading dot hides
+it from the virtual environments of the pool"""
+
+KEEP_UNUSED = 2
+"number of unused virtual environments kept by :meth:`VenvPool.gc`"
+
+
+def pool_key(requirements):
+    """Key of the virtual environment with the given requirements
+
+    Parameters
+    ----------
+    requirements : list of strings
+        packages installed in the virtual environment
+
+    Returns
+    -------
+    string
+        hexadecimal digest
+    """
+    interpreter = [platform.python_implementation(),
+                   platform.python_version(),
+                   os.path.realpath(sys.base_prefix)]
+    dump = json.dumps([interpreter, sorted(requirements)])
+    return hashlib.sha1(dump.encode()).hexdigest()
+
+
+class VenvPool(object):
+    """Pool of virtual environments
+
+    Parameters
+    ----------
+    path : :class:`pathlib.Path`, optional
+        directory of the pool; defaults to :func:`dodocs.utils.venv_pool_dir`
+
+    Attributes
+    ----------
+    path : as above
+    """
+    def __init__(self, path=None):
+        self.path = dutils.venv_pool_dir() if path is None else path
+
+    def venv_dir(self, requirements):
+        """Directory of the virtual environment with the given
+        ``requirements``; it might not exist
+
+        Parameters
+        ----------
+        requirements : list of strings
+            packages installed in the virtual environment
+
+        Returns
+        -------
+        :class:`pathlib.Path`
+        """
+        return self.path / pool_key(requirements)
+
+    def golden_dir(self):
+        """Directory of the golden virtual environment of the current
+        interpreter, with the default packages; it might not exist
+
+        Returns
+        -------
+        :class:`pathlib.Path`
+        """
+        key = pool_key(pyvenvex.DEFAULT_REQUIREMENTS)
+        return self.path / (GOLDEN_PREFIX + key)
+
+    async def golden(self, session):
+        """Get the golden virtual environment, creating it if necessary
+
+        Parameters
+        ----------
+        session : :class:`~dodocs.mkdoc.session.BuildSession`
+            current build session
+
+        Returns
+        -------
+        :class:`pathlib.Path`
+            directory of the golden virtual environment
+        """
+        log = dlog.getLogger()
+        golden_dir = self.golden_dir()
+        async with session.lock(str(golden_dir)):
+            if golden_dir.exists():
+                return golden_dir
+            tmp = await self._tmp_dir(golden_dir)
+            await pyvenvex.create_venv(tmp, session)
+            await drunner.in_thread(pyvenvex.relocate_venv, tmp, tmp,
+                                    golden_dir)
+            await self._rename(tmp, golden_dir)
+        log.debug("Golden virtualenv '%s' created", golden_dir)
+        return golden_dir
+
+    async def get(self, requirements, user, user_path, session):
+        """Get the virtual environment with the given ``requirements``,
+        creating it if necessary, and register ``user`` as using it.
+
+        Parameters
+        ----------
+        requirements : list of strings
+            packages installed in the virtual environment
+        user : string
+            who is using the virtual environment, e.g. profile and project
+        user_path : :class:`pathlib.Path`
+            directory whose existence means that ``user`` is still around,
+            e.g. the profile directory
+        session : :class:`~dodocs.mkdoc.session.BuildSession`
+            current build session
+
+        Returns
+        -------
+        :class:`pathlib.Path`
+            directory of the virtual environment
+        """
+        venv_dir = self.venv_dir(requirements)
+        async with session.lock(str(venv_dir)):
+            if not venv_dir.exists():
+                await self._create(venv_dir, requirements, session)
+        await drunner.in_thread(self.add_ref, venv_dir.name, user, user_path)
+        return venv_dir
+
+    async def _create(self, venv_dir, requirements, session):
+        """Copy the golden virtual environment in a temporary directory,
+        install the ``requirements`` and move it into the pool
+
+        Parameters
+        ----------
+        venv_dir : :class:`pathlib.Path`
+            final directory of the virtual environment
+        requirements : list of strings
+            packages to install
+        session : :class:`~dodocs.mkdoc.session.BuildSession`
+            current build session
+        """
+        log = dlog.getLogger()
+        golden_dir = await self.golden(session)
+        tmp = await self._tmp_dir(venv_dir)
+        await drunner.in_thread(pyvenvex.clone_venv, golden_dir, tmp)
+        await drunner.in_thread(pyvenvex.relocate_venv, tmp, golden_dir,
+                                venv_dir)
+        if sorted(requirements) != sorted(pyvenvex.DEFAULT_REQUIREMENTS):
+            await pyvenvex.install_packages(tmp, session, requirements)
+
+        info = {"requirements": sorted(requirements),
+                "python": platform.python_version(),
+                "created": time.time()}
+        with (tmp / INFO_FILE).open("w") as f:
+            json.dump(info, f, indent=2, sort_keys=True)
+        await self._rename(tmp, venv_dir)
+        log.debug("Virtualenv '%s' added to the pool", venv_dir)
+
+    async def _tmp_dir(self, venv_dir):
+        """Temporary directory where to create ``venv_dir``; it doesn't exist
+
+        Parameters
+        ----------
+        venv_dir : :class:`pathlib.Path`
+            final directory of the virtual environment
+
+        Returns
+        -------
+        :class:`pathlib.Path`
+        """
+        tmp = self.path / ".{}.{}.tmp".format(venv_dir.name, os.getpid())
+        if tmp.exists():
+            await drunner.in_thread(shutil.rmtree, str(tmp))
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        return tmp
+
+    async def _rename(self, tmp, venv_dir):
+        """Move the virtual environment from ``tmp`` to ``venv_dir``
+
+        Parameters
+        ----------
+        tmp, venv_dir : :class:`pathlib.Path`
+            temporary and final directory of the virtual environment
+        """
+        try:
+            os.rename(str(tmp), str(venv_dir))
+        except OSError:
+            # an other process created the same environment in the meantime
+            await drunner.in_thread(shutil.rmtree, str(tmp))
+
+    def add_ref(self, key, user, user_path):
+        """Register ``user`` as using the virtual environment ``key`` and no
+        other virtual environment of the pool. Mark the virtual environment
+        as used now.
+
+        Parameters
+        ----------
+        key : string
+            key of the virtual environment
+        user : string
+            who is using the virtual environment
+        user_path : :class:`pathlib.Path`
+            directory whose existence means that ``user`` is still around
+        """
+        ref_name = hashlib.sha1(user.encode()).hexdigest()
+        for entry in self._venvs():
+            ref = entry / REFS_DIRECTORY / ref_name
+            if entry.name != key:
+                try:
+                    ref.unlink()
+                except FileNotFoundError:
+                    pass
+                continue
+            ref.parent.mkdir(exist_ok=True)
+            with ref.open("w") as f:
+                json.dump({"user": user, "path": str(user_path)}, f)
+            os.utime(str(entry / INFO_FILE))
+
+    def refs(self, key):
+        """Users of the virtual environment ``key`` still around
+
+        Parameters
+        ----------
+        key : string
+            key of the virtual environment
+
+        Returns
+        -------
+        list of strings
+        """
+        users = []
+        for ref in (self.path / key / REFS_DIRECTORY).glob("*"):
+            try:
+                with ref.open() as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if os.path.exists(info["path"]):
+                users.append(info["user"])
+        return sorted(users)
+
+    def entries(self):
+        """Describe the virtual environments of the pool, from the most to
+        the least recently used
+
+        Returns
+        -------
+        list of dict
+            content of the :data:`INFO_FILE` of each virtual environment, with
+            the additional keys ``key``, ``last_used``, ``path`` and ``refs``
+        """
+        entries = []
+        for entry in self._venvs():
+            info_file = entry / INFO_FILE
+            try:
+                with info_file.open() as f:
+                    info = json.load(f)
+                info["last_used"] = info_file.stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            info.update(key=entry.name, path=entry,
+                        refs=self.refs(entry.name))
+            entries.append(info)
+        entries.sort(key=lambda e: e["last_used"], reverse=True)
+        return entries
+
+    def gc(self, keep=KEEP_UNUSED):
+        """Remove the virtual environments not used by any project, except
+        the ``keep`` most recently used ones
+
+        Parameters
+        ----------
+        keep : int, optional
+            number of unused virtual environments to keep
+
+        Returns
+        -------
+        list of dict
+            virtual environments removed, as returned by :meth:`entries`
+        """
+        unused = [e for e in self.entries() if not e["refs"]]
+        removed = unused[keep:]
+        for info in removed:
+            self.remove(info["key"])
+        return removed
+
+    def remove(self, key):
+        """Remove the virtual environment ``key``, if it exists
+
+        Parameters
+        ----------
+        key : string
+            key of the virtual environment
+        """
+        entry = self.path / key
+        # rename first, so that the virtual environment disappears at once
+        trash = self.path / ".{}.{}.trash".format(key, os.getpid())
+        try:
+            os.rename(str(entry), str(trash))
+        except OSError:
+            return
+        shutil.rmtree(str(trash), ignore_errors=True)
+
+    def _venvs(self):
+        """Directories of the virtual environments in the pool
+
+        Returns
+        -------
+        list of :class:`pathlib.Path`
+        """
+        if not self.path.exists():
+            return []
+        return [p for p in self.path.iterdir()
+                if not p.name.startswith('.') and p.is_dir()]
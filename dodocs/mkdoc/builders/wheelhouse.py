@@ -0,0 +1,379 @@
+"""Local wheelhouse shared by all the profiles
+
+All the ``pip install`` run by ``dodocs`` install from the wheelhouse only
+(``--no-index --find-links``). When something is missing, the wheels are
+downloaded, or built from the source distributions, into the wheelhouse and
+the installation is retried. The local projects are built by the installation
+itself and never added to the wheelhouse, but the packages needed to build
+them, from the ``[build-system]`` table of their ``pyproject.toml``, are. In
+offline mode the wheelhouse is never populated, so the builds work without
+network access as long as it contains all the packages needed.
+
+Resolving the requirements needs ``pip`` 22.2 or later: older versions are
+upgraded, from the package index, before adding anything to the wheelhouse.
+Reading ``pyproject.toml`` with python older than 3.11 requires the `tomli
+<https://pypi.org/project/tomli/>`_ package: without it the local projects are
+assumed to be built with ``setuptools``.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import json
+from pathlib import Path
+import sys
+import tempfile
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+import dodocs.logger as dlog
+import dodocs.utils as dutils
+
+REQUIREMENTS_FILE = "requirements.json"
+"""name of the file, in the wheelhouse, recording the requirements added to it,
+so that they can be refreshed"""
+
+BUILD_REQUIREMENTS = ["setuptools", "wheel"]
+"""packages needed to build most of the projects; added to the wheelhouse
+together with the projects, as ``pip`` doesn't save the build dependencies"""
+
+MIN_PIP = (22, 2)
+"""oldest version of ``pip`` with ``install --dry-run --report``"""
+
+
+class Wheelhouse(object):
+    """Directory of wheels used by all the ``pip install`` of ``dodocs``
+
+    Parameters
+    ----------
+    path : :class:`pathlib.Path`, optional
+        directory of the wheelhouse; defaults to
+        :func:`dodocs.utils.wheelhouse_dir`
+    offline : bool, optional
+        if ``True`` never add new wheels to the wheelhouse
+
+    Attributes
+    ----------
+    path, offline : as above
+    """
+    def __init__(self, path=None, offline=False):
+        self.path = dutils.wheelhouse_dir() if path is None else path
+        self.offline = offline
+
+    def install_args(self):
+        """Arguments of ``pip install`` to install from the wheelhouse only
+
+        Returns
+        -------
+        list of strings
+        """
+        return ['--no-index', '--find-links', str(self.path)]
+
+    async def install(self, python, requirements, session, cwd=None):
+        """Install ``requirements`` from the wheelhouse. If this fails, unless
+        offline, add them to the wheelhouse and try again.
+
+        Parameters
+        ----------
+        python : :class:`pathlib.Path`
+            python executable of the virtual environment where to install
+        requirements : list of strings
+            arguments of ``pip install`` specifying what to install, e.g.
+            ``['sphinx']`` or ``['-e', '.']``
+        session : :class:`~dodocs.mkdoc.session.BuildSession`
+            current build session
+        cwd : :class:`pathlib.Path`, optional
+            where to run ``pip``, e.g. the project directory
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.runner.CommandResult`
+            result of the last ``pip install``
+        """
+        log = dlog.getLogger()
+        cmd = ([str(python), '-m', 'pip', 'install'] + self.install_args() +
+               list(requirements))
+        result = await session.runner.run(cmd, cwd=cwd)
+        if result.returncode == 0 or self.offline:
+            return result
+
+        log.debug("%s not in the wheelhouse, adding them",
+                  " ".join(requirements))
+        # only the dependencies of the editable installs are added
+        to_add = [r for r in requirements if r != '-e']
+        added = await self.add(python, to_add, session, cwd=cwd)
+        if added.returncode != 0:
+            return added
+        return await session.runner.run(cmd, cwd=cwd)
+
+    async def add(self, python, requirements, session, cwd=None):
+        """Download, or build, the wheels of ``requirements`` and of their
+        dependencies into the wheelhouse. The wheels already there are reused.
+
+        The local projects, e.g. ``.``, are not added, only their
+        dependencies: the wheel of a development version would grow the
+        wheelhouse at every revision and could satisfy the requirements of
+        other projects instead of the released package. The packages needed
+        to build the local projects are added instead, as the installations
+        from the wheelhouse can't download them. The requirements are first
+        resolved with ``pip install --dry-run --report``: if ``pip`` is older
+        than :data:`MIN_PIP` it's upgraded, once per session.
+
+        Parameters
+        ----------
+        python : :class:`pathlib.Path`
+            python executable, with ``pip``, for which the wheels are built
+        requirements : list of strings
+            requirements in ``pip`` syntax
+        session : :class:`~dodocs.mkdoc.session.BuildSession`
+            current build session
+        cwd : :class:`pathlib.Path`, optional
+            where to run ``pip``
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.runner.CommandResult`
+        """
+        result = await session.once(("pip", str(python)), self._check_pip,
+                                    python, session)
+        if result.returncode != 0:
+            return result
+        requirements = list(requirements) + BUILD_REQUIREMENTS
+        # the build requirements of the local projects might conflict with
+        # the requirements of the installation: resolve them apart
+        build_requirements = set()
+        for requirement in requirements:
+            if _is_local(requirement):
+                project_dir = Path(cwd or ".") / requirement.split("[")[0]
+                build_requirements.update(_build_requirements(project_dir))
+        groups = [requirements]
+        if build_requirements - set(BUILD_REQUIREMENTS):
+            groups.append(sorted(build_requirements))
+        # pip wheel doesn't expect concurrent writes in the same directory
+        async with session.lock(str(self.path)):
+            self.path.mkdir(parents=True, exist_ok=True)
+            resolved = []
+            for group in groups:
+                result, pinned = await self._resolve(python, group, session,
+                                                     cwd)
+                if result.returncode != 0:
+                    return result
+                resolved += pinned
+            cmd = ([str(python), '-m', 'pip', 'wheel', '--no-deps',
+                    '--wheel-dir', str(self.path), '--find-links',
+                    str(self.path)] + sorted(set(resolved)))
+            result = await session.runner.run(cmd, cwd=cwd)
+            if result.returncode == 0:
+                self._record(sorted(set(requirements) | build_requirements))
+        return result
+
+    async def _resolve(self, python, requirements, session, cwd):
+        """Resolve ``requirements`` with ``pip install --dry-run --report``
+
+        Parameters
+        ----------
+        python : :class:`pathlib.Path`
+            python executable, with ``pip``
+        requirements : list of strings
+            requirements in ``pip`` syntax
+        session : :class:`~dodocs.mkdoc.session.BuildSession`
+            current build session
+        cwd : :class:`pathlib.Path` or None
+            where to run ``pip``
+
+        Returns
+        -------
+        result : :class:`~dodocs.mkdoc.runner.CommandResult`
+            result of ``pip``
+        pinned : list of strings or None
+            the pinned requirements, as returned by
+            :func:`_resolved_requirements`; ``None`` if ``pip`` failed
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            report = Path(tmp) / "report.json"
+            cmd = ([str(python), '-m', 'pip', 'install', '--dry-run',
+                    '--ignore-installed', '--quiet', '--report', str(report),
+                    '--find-links', str(self.path)] + requirements)
+            result = await session.runner.run(cmd, cwd=cwd)
+            if result.returncode != 0:
+                return result, None
+            return result, _resolved_requirements(report)
+
+    async def _check_pip(self, python, session):
+        """Upgrade ``pip`` if it's older than :data:`MIN_PIP`
+
+        Parameters
+        ----------
+        python : :class:`pathlib.Path`
+            python executable, with ``pip``
+        session : :class:`~dodocs.mkdoc.session.BuildSession`
+            current build session
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.runner.CommandResult`
+            result of ``pip --version`` or of the upgrade
+        """
+        cmd = [str(python), '-m', 'pip', '--version']
+        result = await session.runner.run(cmd)
+        if result.returncode != 0 or _pip_version(result.stdout) >= MIN_PIP:
+            return result
+        dlog.getLogger().info("Upgrading the pip of '%s'", python)
+        min_pip = "pip>={}".format(".".join(str(i) for i in MIN_PIP))
+        cmd = [str(python), '-m', 'pip', 'install', '--upgrade', min_pip]
+        return await session.runner.run(cmd)
+
+    async def refresh(self, runner, python=None):
+        """Download, or build, the latest version of all the requirements
+        added so far
+
+        Parameters
+        ----------
+        runner : :class:`~dodocs.mkdoc.runner.CommandRunner`
+            runner executing ``pip``
+        python : :class:`pathlib.Path`, optional
+            python executable, with ``pip``, for which the wheels are built;
+            defaults to the one running ``dodocs``
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.runner.CommandResult`
+        """
+        python = sys.executable if python is None else python
+        requirements = sorted(set(self.requirements()) |
+                              set(BUILD_REQUIREMENTS))
+        self.path.mkdir(parents=True, exist_ok=True)
+        # without --find-links, so that the newest versions are taken
+        cmd = ([str(python), '-m', 'pip', 'wheel', '--wheel-dir',
+                str(self.path)] + requirements)
+        return await runner.run(cmd)
+
+    def requirements(self):
+        """Requirements added so far, excluding the local projects
+
+        Returns
+        -------
+        list of strings
+        """
+        try:
+            with (self.path / REQUIREMENTS_FILE).open() as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def _record(self, requirements):
+        """Add ``requirements``, excluding the local projects, to the
+        :data:`REQUIREMENTS_FILE`
+
+        Parameters
+        ----------
+        requirements : list of strings
+            requirements in ``pip`` syntax
+        """
+        remote = {r for r in requirements if not _is_local(r)}
+        recorded = set(self.requirements())
+        if remote <= recorded:
+            return
+        with (self.path / REQUIREMENTS_FILE).open('w') as f:
+            json.dump(sorted(recorded | remote), f, indent=2)
+
+
+def _resolved_requirements(report):
+    """Pinned requirements of the packages, but the local projects, in the
+    installation report of ``pip``
+
+    Parameters
+    ----------
+    report : :class:`pathlib.Path`
+        json report written by ``pip install --report``
+
+    Returns
+    -------
+    list of strings
+        requirements in ``pip`` syntax
+    """
+    with report.open() as f:
+        to_install = json.load(f)["install"]
+    requirements = []
+    for item in to_install:
+        name = item["metadata"]["name"]
+        info = item["download_info"]
+        if not item.get("is_direct"):
+            requirements.append("{}=={}".format(name,
+                                                item["metadata"]["version"]))
+        elif "vcs_info" in info:
+            vcs_info = info["vcs_info"]
+            requirements.append("{} @ {}+{}@{}".format(
+                name, vcs_info["vcs"], info["url"], vcs_info["commit_id"]))
+        elif "archive_info" in info:
+            requirements.append("{} @ {}".format(name, info["url"]))
+        # else a local directory
+    return requirements
+
+
+def _is_local(requirement):
+    """Whether ``requirement`` is a local project, e.g. ``.[doc]``
+
+    Parameters
+    ----------
+    requirement : string
+        requirement in ``pip`` syntax
+
+    Returns
+    -------
+    bool
+    """
+    return requirement.startswith(('.', '/'))
+
+
+def _build_requirements(project_dir):
+    """Packages needed to build the project, from the ``[build-system]``
+    table of its ``pyproject.toml``. Without the table, or if the file cannot
+    be read, the project is built with ``setuptools``
+
+    Parameters
+    ----------
+    project_dir : :class:`pathlib.Path`
+        directory of the project
+
+    Returns
+    -------
+    list of strings
+        requirements in ``pip`` syntax
+    """
+    if tomllib is None:
+        return BUILD_REQUIREMENTS
+    try:
+        with (project_dir / "pyproject.toml").open("rb") as f:
+            pyproject = tomllib.load(f)
+    except (OSError, ValueError):
+        return BUILD_REQUIREMENTS
+    return pyproject.get("build-system", {}).get("requires",
+                                                 BUILD_REQUIREMENTS)
+
+
+def _pip_version(output):
+    """Version of ``pip`` from the output of ``pip --version``, e.g. ``pip
+    22.3.1 from ...``
+
+    Parameters
+    ----------
+    output : string
+        output of ``pip --version``
+
+    Returns
+    -------
+    tuple of ints
+        major and minor version; ``(0, 0)`` if unknown
+    """
+    try:
+        major, minor = output.split()[1].split(".")[:2]
+        return int(major), int(minor)
+    except (IndexError, ValueError):
+        return (0, 0)
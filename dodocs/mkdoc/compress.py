@@ -0,0 +1,223 @@
+"""Precompress the documentation
+
+Web servers like nginx, with ``gzip_static``, can serve a precompressed copy
+of a file, e.g. ``index.html.gz`` for ``index.html``, instead of compressing it
+on the fly. The text files of the documentation are compressed, in a process
+pool, just before publishing, so that the compressed copies are always in sync
+with the html.
+
+The digest of the files compressed is recorded next to the target directory:
+the files that didn't change since the last publish are not compressed again,
+but their compressed copies are taken from the target directory.
+
+Compressing with ``brotli`` requires the `brotli
+<https://pypi.org/project/Brotli/>`_ package.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from dodocs.mkdoc import runner as drunner
+
+SUFFIXES = {"gzip": ".gz", "brotli": ".br"}
+"suffix of the compressed copy for each supported compression"
+
+COMPRESS_EXTENSIONS = [".html", ".css", ".js", ".json", ".svg", ".txt",
+                       ".xml", ".map"]
+"extensions of the files to compress"
+
+MIN_SIZE = 256
+"files smaller than this number of bytes are not worth compressing"
+
+DIGESTS_FILE = ".{}.compress.json"
+"""name, formatted with the name of the target directory, of the file with the
+digests of the files compressed by the last publish"""
+
+
+def compressions(conf, log):
+    """Compressions requested with the ``compress`` option of the ``general``
+    section
+
+    Parameters
+    ----------
+    conf : :class:`configparser.ConfigParser` instance
+        configuration object
+    log : :class:`~logging.LoggerAdapter` or :class:`~logging.Logger`
+        logger
+
+    Returns
+    -------
+    list of strings
+        keys of :data:`SUFFIXES`
+    """
+    requested = conf.get('general', 'compress', fallback='').split()
+    available = []
+    for compression in requested:
+        if compression not in SUFFIXES:
+            log.warning("Unknown compression '%s'. Available: %s",
+                        compression, ", ".join(sorted(SUFFIXES)))
+        elif compression == "brotli" and brotli is None:
+            log.warning("Install 'brotli' to compress with brotli")
+        else:
+            available.append(compression)
+    return available
+
+
+async def precompress(html_dir, target_dir, compressions, session):
+    """Create the compressed copies of the text files in ``html_dir``
+
+    Parameters
+    ----------
+    html_dir : :class:`pathlib.Path`
+        directory containing the html files
+    target_dir : :class:`pathlib.Path`
+        directory where the documentation is going to be published
+    compressions : list of strings
+        keys of :data:`SUFFIXES`
+    session : :class:`~dodocs.mkdoc.session.BuildSession`
+        current build session; its process pool compresses the files
+
+    Returns
+    -------
+    dict
+        digest of the files compressed, to be saved with :func:`save_digests`
+        once the documentation is published
+    """
+    digests, to_compress = await drunner.in_thread(
+        _reuse_compressed, html_dir, target_dir, compressions)
+    loop = asyncio.get_event_loop()
+    await asyncio.gather(*[
+        loop.run_in_executor(session.process_pool, compress_file, fname,
+                             compression)
+        for fname, compression in to_compress])
+    return digests
+
+
+def save_digests(target_dir, digests):
+    """Record the digests of the files compressed for ``target_dir``
+
+    Parameters
+    ----------
+    target_dir : :class:`pathlib.Path`
+        directory where the documentation has been published
+    digests : dict
+        as returned by :func:`precompress`
+    """
+    digests_file = _digests_file(target_dir)
+    tmp = digests_file.with_name(digests_file.name + ".tmp")
+    with tmp.open("w") as f:
+        json.dump(digests, f)
+    os.replace(str(tmp), str(digests_file))
+
+
+def compress_file(fname, compression):
+    """Write the compressed copy of ``fname``; it runs in a process pool
+
+    Parameters
+    ----------
+    fname : string
+        file to compress
+    compression : string
+        key of :data:`SUFFIXES`
+    """
+    with open(fname, "rb") as f:
+        content = f.read()
+    if compression == "gzip":
+        buf = io.BytesIO()
+        # no timestamp: the same content gives the same file
+        with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9,
+                           mtime=0) as gz:
+            gz.write(content)
+        compressed = buf.getvalue()
+    else:
+        compressed = brotli.compress(content)
+    dest = fname + SUFFIXES[compression]
+    tmp = "{}.{}.tmp".format(dest, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(compressed)
+    shutil.copystat(fname, tmp)
+    os.replace(tmp, dest)
+
+
+def _reuse_compressed(html_dir, target_dir, compressions):
+    """Copy from ``target_dir`` the compressed files whose original didn't
+    change since the last publish
+
+    Parameters
+    ----------
+    html_dir, target_dir : :class:`pathlib.Path`
+        directory containing the html files and target directory
+    compressions : list of strings
+        keys of :data:`SUFFIXES`
+
+    Returns
+    -------
+    digests : dict
+        relative path: sha1 of the files to compress
+    to_compress : list of tuples
+        files to compress and compression to use
+    """
+    try:
+        with _digests_file(target_dir).open() as f:
+            published = json.load(f)
+    except (OSError, ValueError):
+        published = {}
+
+    digests, to_compress = {}, []
+    for dirpath, _, filenames in os.walk(str(html_dir)):
+        for name in filenames:
+            fname = os.path.join(dirpath, name)
+            if (os.path.splitext(name)[1] not in COMPRESS_EXTENSIONS or
+                    os.path.getsize(fname) < MIN_SIZE):
+                continue
+            rel_path = os.path.relpath(fname, str(html_dir))
+            with open(fname, "rb") as f:
+                digests[rel_path] = hashlib.sha1(f.read()).hexdigest()
+            unchanged = published.get(rel_path) == digests[rel_path]
+            for compression in compressions:
+                suffix = SUFFIXES[compression]
+                if unchanged and _copy(target_dir / (rel_path + suffix),
+                                       fname + suffix):
+                    continue
+                to_compress.append((fname, compression))
+    return digests, to_compress
+
+
+def _copy(src, dest):
+    """Hard link, or copy, ``src`` to ``dest``
+
+    Returns
+    -------
+    bool
+        ``False`` if ``src`` doesn't exist
+    """
+    if os.path.exists(dest):
+        os.unlink(dest)
+    try:
+        os.link(str(src), dest)
+    except FileNotFoundError:
+        return False
+    except OSError:  # e.g. on an other file system
+        try:
+            shutil.copy2(str(src), dest)
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def _digests_file(target_dir):
+    """File with the digests of the files compressed for ``target_dir``"""
+    return target_dir.with_name(DIGESTS_FILE.format(target_dir.name))
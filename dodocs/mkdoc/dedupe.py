@@ -0,0 +1,263 @@
+"""Deduplicate the published documentation
+
+Many files are the same in the documentation of different projects, e.g. the
+``_static`` files of the sphinx themes. With the ``dedupe`` option of the
+``general`` section, the files of the published documentation are replaced
+with hard links to a blob store, where each file is stored once, named after
+the hash of its content, its modification time and its permissions: files
+sharing a blob share all of them, so the timestamps of the published files are
+preserved. Sphinx copies the static files keeping their timestamps, so the
+ones coming from the same theme are still deduplicated.
+
+The blob store is in the ``dodocs`` home, see
+:func:`dodocs.utils.blobs_dir`, or in the directory given with the
+``dedupe_store`` option, out of the published tree. Hard links can't cross
+file systems: the store must be on the one of the target directory.
+
+This is safe because ``dodocs`` never writes into an existing file: the publish
+modes and the compression write new files aside and rename them over the old
+ones, and the hard links made by the compression, between the published
+documentation and the new build, are never written either. So a blob never
+changes under the feet of the documentation linking it. Each file is replaced
+by a link to its blob with a rename, so the documentation is never incomplete.
+Removing the documentation removes only the links: the blobs not linked from
+anywhere else are removed by :func:`gc`. The deduplication holds a shared lock
+on the store and :func:`gc` an exclusive one, so that the blobs are not
+removed while other ``dodocs`` runs are linking them.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+import stat
+
+import dodocs.logger as dlog
+import dodocs.utils as dutils
+
+LOCK_FILE = ".lock"
+"name of the lock file in the blob store"
+
+
+def enabled(conf):
+    """Whether the deduplication is enabled
+
+    Parameters
+    ----------
+    conf : :class:`configparser.ConfigParser` instance
+        configuration object
+
+    Returns
+    -------
+    bool
+    """
+    return conf.getboolean('general', 'dedupe', fallback=False)
+
+
+def blob_store(conf):
+    """Directory of the blob store: the ``dedupe_store`` option or, by
+    default, :func:`dodocs.utils.blobs_dir`
+
+    Parameters
+    ----------
+    conf : :class:`configparser.ConfigParser` instance
+        configuration object
+
+    Returns
+    -------
+    :class:`pathlib.Path`
+    """
+    store = conf.get('general', 'dedupe_store', fallback='')
+    return Path(store) if store else dutils.blobs_dir()
+
+
+def dedupe_tree(tree, store):
+    """Replace the files in ``tree`` with hard links to the blobs with the
+    same content, modification time and permissions, adding the missing blobs
+    to the ``store``. Files already linked to a blob, e.g. by an earlier call,
+    are skipped.
+
+    Parameters
+    ----------
+    tree : :class:`pathlib.Path`
+        directory to deduplicate
+    store : :class:`pathlib.Path`
+        blob store; it must be on the same file system of ``tree``
+
+    Returns
+    -------
+    int
+        number of bytes saved
+    """
+    log = dlog.getLogger()
+    saved = 0
+    with _locked(store, exclusive=False):
+        blobs = _blob_inodes(store)
+        for dirpath, _, filenames in os.walk(str(tree)):
+            for name in filenames:
+                fname = os.path.join(dirpath, name)
+                st = os.lstat(fname)
+                if (not stat.S_ISREG(st.st_mode) or st.st_size == 0 or
+                        (st.st_dev, st.st_ino) in blobs):
+                    continue
+                if _link_blob(fname, _blob_name(fname, st, store),
+                              st.st_size):
+                    saved += st.st_size
+    log.debug("%.1f MB saved deduplicating '%s'", saved / 2 ** 20, tree)
+    return saved
+
+
+def gc(store):
+    """Remove the blobs not linked from any published documentation. It waits
+    for the deduplications running in other processes
+
+    Parameters
+    ----------
+    store : :class:`pathlib.Path`
+        blob store
+
+    Returns
+    -------
+    int
+        number of blobs removed
+    """
+    removed = 0
+    with _locked(store, exclusive=True):
+        for blob in _blobs(store):
+            try:
+                if os.stat(blob).st_nlink == 1:
+                    os.unlink(blob)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # removed by an other process
+    return removed
+
+
+@contextlib.contextmanager
+def _locked(store, exclusive):
+    """Lock the blob store, also against the other processes, for the
+    duration of the context
+
+    Parameters
+    ----------
+    store : :class:`pathlib.Path`
+        blob store
+    exclusive : bool
+        if ``True`` take an exclusive lock, otherwise a shared one
+    """
+    store.mkdir(parents=True, exist_ok=True)
+    with (store / LOCK_FILE).open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def _blobs(store):
+    """Iterate over the blobs in the ``store``
+
+    Parameters
+    ----------
+    store : :class:`pathlib.Path`
+        blob store
+
+    Yields
+    ------
+    string
+        file name of the blob
+    """
+    for dirpath, _, filenames in os.walk(str(store)):
+        for name in filenames:
+            if dirpath != str(store) or name != LOCK_FILE:
+                yield os.path.join(dirpath, name)
+
+
+def _blob_name(fname, st, store):
+    """Blob with the same content, modification time and permissions as
+    ``fname``
+
+    Parameters
+    ----------
+    fname : string
+        file to deduplicate
+    st : :class:`os.stat_result`
+        status of ``fname``
+    store : :class:`pathlib.Path`
+        blob store
+
+    Returns
+    -------
+    :class:`pathlib.Path`
+    """
+    sha = hashlib.sha256()
+    with open(fname, "rb") as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    name = "{}-{}-{:o}".format(digest, st.st_mtime_ns,
+                               stat.S_IMODE(st.st_mode))
+    return store / digest[:2] / name
+
+
+def _blob_inodes(store):
+    """Device and inode of the blobs in the ``store``
+
+    Parameters
+    ----------
+    store : :class:`pathlib.Path`
+        blob store
+
+    Returns
+    -------
+    set of tuples
+    """
+    inodes = set()
+    for blob in _blobs(store):
+        try:
+            st = os.stat(blob)
+        except FileNotFoundError:
+            continue  # removed by an other process
+        inodes.add((st.st_dev, st.st_ino))
+    return inodes
+
+
+def _link_blob(fname, blob, size):
+    """Replace ``fname`` with a hard link to ``blob``. If the blob doesn't
+    exist, ``fname`` becomes the blob.
+
+    Parameters
+    ----------
+    fname : string
+        file to deduplicate
+    blob : :class:`pathlib.Path`
+        blob with the same content
+    size : int
+        size of ``fname``
+
+    Returns
+    -------
+    bool
+        whether ``fname`` has been replaced
+    """
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    tmp = "{}.{}.dedupe".format(fname, os.getpid())
+    try:
+        os.link(str(blob), tmp)
+    except FileNotFoundError:
+        try:
+            os.link(fname, str(blob))
+        except FileExistsError:
+            # added by an other process in the meantime
+            return _link_blob(fname, blob, size)
+        except OSError:  # e.g. on an other file system
+            pass
+        return False
+    except OSError:
+        return False
+    if os.stat(tmp).st_size != size:
+        os.unlink(tmp)  # corrupted blob, don't spread it
+        return False
+    os.replace(tmp, fname)
+    return True
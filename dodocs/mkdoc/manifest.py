@@ -0,0 +1,132 @@
+"""Build manifest
+
+For every project of a profile, the manifest records the inputs of the last
+successful build: the revision of the source code, the configuration of the
+project, a fingerprint of the environment used to build the documentation and
+the directory where it has been published. If none of them changed, or if only
+the revision changed but none of the files the documentation depends upon,
+there is no need to build the project again.
+
+The manifest is stored in the state directory of the profile.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import hashlib
+import json
+import os
+
+import dodocs.utils as dutils
+
+MANIFEST_FILE = "manifest.json"
+"name of the file, in the state directory, storing the manifest"
+
+
+def config_hash(conf, project):
+    """Hash of the configuration of ``project``, including the defaults
+
+    Parameters
+    ----------
+    conf : :class:`configparser.ConfigParser` instance
+        configuration object
+    project : string
+        name of the project
+
+    Returns
+    -------
+    string
+        hexadecimal digest
+    """
+    items = sorted(conf.items(project))
+    # a new version of dodocs might build differently
+    dump = json.dumps([dutils.get_version(), items])
+    return hashlib.sha1(dump.encode()).hexdigest()
+
+
+class Manifest(object):
+    """Manifest of the builds of a profile
+
+    Parameters
+    ----------
+    profile : string
+        name of the profile
+    """
+    def __init__(self, profile):
+        self.profile = profile
+        self.fname = dutils.state_dir(profile) / MANIFEST_FILE
+        try:
+            with self.fname.open() as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, project):
+        """Inputs of the last successful build of ``project``
+
+        Parameters
+        ----------
+        project : string
+            name of the project
+
+        Returns
+        -------
+        dict or None
+            ``None`` if the project has never been built
+        """
+        return self._entries.get(project)
+
+    def set(self, project, entry):
+        """Record the inputs of the last successful build of ``project``
+
+        Parameters
+        ----------
+        project : string
+            name of the project
+        entry : dict
+            inputs of the build; must be serialisable to json
+        """
+        self._entries[project] = entry
+
+    def remove(self, project):
+        """Forget the last successful build of ``project``, e.g. because its
+        documentation has been replaced by a failed build
+
+        Parameters
+        ----------
+        project : string
+            name of the project
+        """
+        self._entries.pop(project, None)
+
+    def changed_inputs(self, project, entry):
+        """Inputs of the build of ``project`` that differ from the last
+        successful build
+
+        Parameters
+        ----------
+        project : string
+            name of the project
+        entry : dict
+            inputs of the build. The directory of the published documentation
+            must be stored in the ``target`` key
+
+        Returns
+        -------
+        set of strings
+            keys of ``entry`` that changed. All of them if the project has
+            never been built or its documentation is not published anymore
+        """
+        old = self.get(project)
+        if old is None or not os.path.isdir(entry["target"]):
+            return set(entry)
+        return {k for k in set(entry) | set(old)
+                if entry.get(k) != old.get(k)}
+
+    def save(self):
+        """Write the manifest to the state directory"""
+        self.fname.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.fname.with_name(self.fname.name + ".tmp")
+        with tmp.open("w") as f:
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+        os.replace(str(tmp), str(self.fname))
@@ -4,70 +4,516 @@ Copyright (c) 2015 Francesco Montesano
 MIT Licence
 """
 
+import asyncio
+import itertools
+import shutil
+import time
+
 import dodocs.config as dconf
 import dodocs.logger as dlog
-import dodocs.utils as dutils
 
+from dodocs.cache import artifacts
 from dodocs.mkdoc import builders
+from dodocs.mkdoc import compress
+from dodocs.mkdoc import dedupe
+from dodocs.mkdoc import pipeline
+from dodocs.mkdoc import publish
+from dodocs.mkdoc import runner
+from dodocs.mkdoc import scheduler
+from dodocs.mkdoc import session as dsession
 
 
-def main(profile, args):
-    """Make the documentation for on project
+class ProjectJob(object):
+    """Project travelling through the build pipeline
 
     Parameters
     ----------
     profile : string
         name of the profile
+    project : string
+        name of the project
+    session : :class:`~dodocs.mkdoc.session.BuildSession`
+        current build session
+    index : int, optional
+        position of the job in the build order
+
+    Attributes
+    ----------
+    profile, project, session, index : as above
+    log : :class:`~logging.LoggerAdapter`
+        logger tagged with the profile and project names
+    builder : :class:`~dodocs.mkdoc.builders.base_builder.BaseBuilder`
+        builder of the project; ``None`` until the project has been probed
+    inputs : dict
+        inputs of the build, recorded in the manifest once the documentation
+        is published; ``None`` until the project has been fetched
+    cache_key : string or None
+        key of the build in the artifact cache; ``None`` if not cacheable
+    cached_html : :class:`pathlib.Path` or None
+        if the build has been found in the artifact cache, directory with the
+        html to publish
+    failed : bool
+        whether the documentation build failed: the documentation is
+        published anyway, but not recorded in the manifest, so that the next
+        run builds it again
+    """
+    def __init__(self, profile, project, session, index=0):
+        self.profile = profile
+        self.project = project
+        self.session = session
+        self.index = index
+        self.log = dlog.getLogger(profile=profile, project=project)
+        self.builder = None
+        self.inputs = None
+        self.cache_key = None
+        self.cached_html = None
+        self.failed = False
+
+
+def main(profiles, args):
+    """Make the documentation for the projects of the given profiles
+
+    First all the projects are probed concurrently: the ones whose source code
+    is up to date and whose inputs didn't change since the last build are
+    skipped without any further work. The others go through a pipeline with
+    four stages, each with its own workers:
+
+    * fetch: get or update the source code;
+    * install: prepare the environment, e.g. ``pip install -e``;
+    * build: build the documentation, unless it's found in the cache shared
+      by all the profiles;
+    * publish: move the documentation to the target directory.
+
+    So the network and disk bound steps of some projects overlap with the
+    documentation builds of others. None of the stages changes the working
+    directory: all the external commands are run in the project directory. A
+    failure in one project is logged and doesn't affect the others.
+
+    The whole build is driven by an :mod:`asyncio` event loop.
+
+    Parameters
+    ----------
+    profiles : list of strings
+        name of the profiles
+    args : namespace
+        parsed command line arguments
+    """
+    asyncio.run(run(profiles, args))
+
+
+async def run(profiles, args):
+    """Coroutine implementing :func:`main`
+
+    Parameters
+    ----------
+    profiles : list of strings
+        name of the profiles
     args : namespace
         parsed command line arguments
     """
     log = dlog.getLogger()
+    session = dsession.BuildSession(args)
 
-    for s in dconf.get_projects(profile):
-        log.debug("building project %s", s)
-        try:
-            build_project(profile, s, args)
-        except Exception:
-            msg = "something bad happened"
-            log.exception(msg)
-            continue
+    def jobs_or_default(n):
+        return args.jobs if n is None else n
 
+    maxsize = jobs_or_default(args.queue_size)
+    stages = [pipeline.Stage("fetch", fetch_project,
+                             workers=jobs_or_default(args.fetch_jobs),
+                             maxsize=maxsize),
+              pipeline.Stage("install", install_project,
+                             workers=jobs_or_default(args.install_jobs),
+                             maxsize=maxsize),
+              pipeline.Stage("build", build_project, workers=args.jobs,
+                             maxsize=maxsize),
+              pipeline.Stage("publish", publish_project,
+                             workers=jobs_or_default(args.publish_jobs),
+                             maxsize=maxsize),
+              ]
 
-def build_project(profile, project, args):
-    """Build the project documentation.
+    jobs = []
+    for i, (profile, s) in enumerate(interleave_projects(profiles)):
+        log.debug("building project %s of profile %s", s, profile)
+        jobs.append(ProjectJob(profile, s, session, index=i))
+
+    try:
+        # find out which projects need any work before starting
+        probe = pipeline.Stage("probe", probe_project,
+                               workers=args.probe_jobs)
+        jobs = await pipeline.Pipeline([probe],
+                                       on_error=_log_failure).run(jobs)
+        # the probe finishes in random order
+        jobs.sort(key=lambda j: j.index)
+        await pipeline.Pipeline(stages, on_error=_log_failure).run(jobs)
+    finally:
+        await session.close()
+        session.save()
+        _collect_blobs(profiles)
+
+
+def _collect_blobs(profiles):
+    """Remove the blobs not used anymore from the blob stores of the
+    ``profiles`` deduplicating the published documentation
+
+    Parameters
+    ----------
+    profiles : list of strings
+        name of the profiles
+    """
+    log = dlog.getLogger()
+    stores = set()
+    for profile in profiles:
+        conf = dconf.get_config(profile)
+        if dedupe.enabled(conf):
+            stores.add(dedupe.blob_store(conf))
+    for store in sorted(stores):
+        removed = dedupe.gc(store)
+        log.debug("%d unused blobs removed from '%s'", removed, store)
+
+
+def _log_failure(job, stage):
+    """Log the exception that stopped ``job`` in ``stage``
+
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        the failed job
+    stage : :class:`~dodocs.mkdoc.pipeline.Stage`
+        stage where the failure happened
+    """
+    msg = "something bad happened during the %s stage"
+    job.log.exception(msg, stage.name)
+
+
+def interleave_projects(profiles):
+    """Pair the profiles with their projects, alternating between profiles.
+
+    Submitting the projects in this order lets all the profiles progress
+    together instead of one after the other.
+
+    Parameters
+    ----------
+    profiles : list of strings
+        name of the profiles
+
+    Returns
+    -------
+    list of tuples
+        ``(profile, project)`` pairs
+    """
+    per_profile = [[(p, s) for s in dconf.get_projects(p)] for p in profiles]
+    pairs = []
+    for group in itertools.zip_longest(*per_profile):
+        pairs.extend(pair for pair in group if pair is not None)
+    return pairs
+
+
+async def probe_project(job):
+    """Pick the builder and check, without fetching anything, whether the
+    source code of the project is up to date.
+
+    If so, unless ``--force`` is given, stop the project if the inputs of the
+    build are the same as the last successful one and the documentation is
+    still published.
+
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        project to probe
+
+    Raises
+    ------
+    :class:`~dodocs.mkdoc.pipeline.Skip`
+        if nothing changed since the last build
+    """
+    conf = dconf.get_config(job.profile)
+    job.builder = builders.picker(job.profile, job.project, conf, job.log,
+                                  job.session)
+    if await job.builder.probe():
+        await _skip_unchanged(job)
+        # fetch anyway if the configuration, e.g. the sparse checkout, changed
+        manifest = job.session.manifest(job.profile)
+        if "config" in manifest.changed_inputs(job.project, job.inputs):
+            job.builder.up_to_date = False
+
+
+async def fetch_project(job):
+    """Fetch the code of the project, if not up to date, and meanwhile prepare
+    what doesn't depend on it, e.g. the virtual environment.
+
+    Unless ``--force`` is given, stop the project if the inputs of the build
+    are the same as the last successful one and the documentation is still
+    published.
+
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        project to fetch
+
+    Raises
+    ------
+    :class:`~dodocs.mkdoc.pipeline.Skip`
+        if nothing changed since the last build
+    """
+    await asyncio.gather(job.builder.fetch(), job.builder.prepare())
+    if job.inputs is None:
+        await _skip_unchanged(job)
+
+
+async def _skip_unchanged(job):
+    """Collect the inputs of the build and stop the project if they are the
+    same as the last successful build, unless ``--force`` is given.
+
+    If only the revision changed, but none of the files the documentation
+    depends upon, the project is stopped as well and the new revision is
+    recorded in the manifest.
+
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        project to check
+
+    Raises
+    ------
+    :class:`~dodocs.mkdoc.pipeline.Skip`
+        if nothing changed since the last build
+    """
+    job.inputs = await job.builder.build_inputs()
+    if job.session.args.force:
+        return
+    manifest = job.session.manifest(job.profile)
+    changed = manifest.changed_inputs(job.project, job.inputs)
+    if not changed:
+        job.log.info("Nothing changed since the last build. Skipping")
+        raise pipeline.Skip()
+    if changed == {"revision"}:
+        since = manifest.get(job.project)["revision"]
+        if not await job.builder.doc_changed(since):
+            job.log.info("No documentation file changed since the last"
+                         " build. Skipping")
+            manifest.set(job.project, job.inputs)
+            raise pipeline.Skip()
+
+
+async def install_project(job):
+    """Prepare the environment to build the documentation, e.g.:
 
-    * Fetch the code
     * if it's python:
         * make a virtualenv, if it does not exists already
         * pip install -e
-    * build the documentation
-    * if it's python:
-        * deactivate the virtualenv
 
     Parameters
     ----------
-    profile : string
-        name of the profile
-    project : string
-        name of the project
-    args : namespace
-        parsed command line arguments
+    job : :class:`ProjectJob`
+        project to prepare
     """
-    conf = dconf.get_config(profile)
-    log = dlog.getLogger()
+    await job.builder.install()
+
+
+async def build_project(job):
+    """Build the project documentation.
+
+    The build gets a share of the CPU budget sized after the ``cpu-weight``
+    option of the project or, if not given, after the duration of its last
+    build.
+
+    If the same build, i.e. same repository, revision, build command,
+    configuration and environment, is in the artifact cache, e.g. because an
+    other profile includes the same project, the documentation is published
+    from the cache instead.
+
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        project to build
+    """
+    conf = dconf.get_config(job.profile)
+
+    cache = job.session.cache
+    if cache is not None:
+        signature = job.builder.build_signature()
+        if signature is not None:
+            job.cache_key = artifacts.cache_key(
+                job.builder.project_path, job.inputs["revision"], signature,
+                conf, job.project, job.builder.env_fingerprint())
+        if job.cache_key is not None:
+            job.cached_html = await runner.in_thread(cache.lookup,
+                                                     job.cache_key)
+        if job.cached_html is not None:
+            job.log.info("Documentation found in the cache")
+            return
+
+    durations = job.session.durations(job.profile)
+    wanted = conf.getint(job.project, "cpu-weight", fallback=None)
+    if wanted is None:
+        wanted = scheduler.tokens_for_duration(durations.get(job.project))
+
+    async with job.session.scheduler.tokens(wanted) as tokens:
+        job.log.debug("building with %d of the %d wanted CPU tokens", tokens,
+                      wanted)
+        job.builder.cpu_jobs = tokens
+        start = time.monotonic()
+        success = await job.builder.build_doc()
+        durations.set(job.project, (time.monotonic() - start) * tokens)
+    if not success:
+        job.failed = True
+        job.cache_key = None  # don't cache broken documentation
+
 
-    # create the directory
-    dutils.mk_project(profile, project)
+async def _check_file_system(job):
+    """Warn if the documentation of ``job`` is built on a file system other
+    than the one of the target directory
 
-    # cd into it
-    with dutils.cd_project(profile, project):
-        log.debug("cd'ed into the project '%s' directory", project)
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        project to publish
+    """
+    html_dir, target_dir = job.builder.html_dir, job.builder.target_dir
+    same = await runner.in_thread(publish.same_file_system, html_dir,
+                                  target_dir)
+    if not same:
+        job.log.warning("'%s' and '%s' are on different file systems: the"
+                        " documentation is copied instead of moved. Set"
+                        " 'staging_dir' in the 'general' section to a"
+                        " directory on the file system of the target"
+                        " directory", html_dir.parent, target_dir.parent)
+
+
+async def _check_blob_store(job, store):
+    """Check that the blob store is on the file system of the target
+    directory, as the published files are hard linked to the blobs
+
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        project to publish
+    store : :class:`pathlib.Path`
+        blob store
+
+    Returns
+    -------
+    bool
+        whether the documentation can be deduplicated
+    """
+    target_dir = job.builder.target_dir
+    if await runner.in_thread(publish.same_file_system, store, target_dir):
+        return True
+    job.log.warning("The blob store '%s' and '%s' are on different file"
+                    " systems: the documentation is not deduplicated. Set"
+                    " 'dedupe_store' in the 'general' section to a directory"
+                    " on the file system of the target directory", store,
+                    target_dir.parent)
+    return False
+
+
+def _stage_cached(job):
+    """Copy the documentation of ``job`` found in the artifact cache next to
+    its build directory, so that it can be modified before being published
+
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        project to publish
+
+    Returns
+    -------
+    :class:`pathlib.Path`
+        directory containing the copy
+    """
+    html_dir = job.builder.html_dir
+    staged = html_dir.with_name(".{}.cached".format(html_dir.name))
+    shutil.rmtree(str(staged), ignore_errors=True)
+    staged.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copytree(str(job.cached_html), str(staged))
+    return staged
+
+
+def _clean_published(old, target_dir, store):
+    """Remove the old documentation and deduplicate the new one, in this
+    order, so that the old files don't keep the blob store busy
+
+    Parameters
+    ----------
+    old : :class:`pathlib.Path` or None
+        old documentation returned by the publish
+    target_dir : :class:`pathlib.Path`
+        directory where the documentation has been published
+    store : :class:`pathlib.Path` or None
+        blob store; ``None`` if the deduplication is disabled
+    """
+    if old is not None:
+        publish.remove_tree(old)
+    if store is not None:
+        dedupe.dedupe_tree(target_dir, store)
+
+
+async def publish_project(job):
+    """Move the documentation to the target directory, remove the build
+    directory and, unless the build failed, record it in the manifest. Fresh
+    builds are stored in the artifact cache first. The old documentation is
+    removed in the background.
+
+    If requested, the text files are precompressed before being stored in the
+    cache and published. The cached builds are never modified: they are
+    copied next to the build directory and compressed there. If requested,
+    the published documentation is deduplicated in the background.
+
+    Parameters
+    ----------
+    job : :class:`ProjectJob`
+        project to publish
+    """
+    cache = job.session.cache
+    target_dir = job.builder.target_dir
+    compressions = compress.compressions(job.builder.conf, job.log)
+    cached_html = job.cached_html
+    if compressions:
+        if cached_html is not None:
+            # other builds might be copying the cache entry
+            cached_html = await runner.in_thread(_stage_cached, job)
+        digests = await compress.precompress(
+            cached_html or job.builder.html_dir, target_dir, compressions,
+            job.session)
 
-        builder = builders.picker(profile, project, conf, log)
+    if cached_html is not None:
+        # the private copy can be moved
+        old = await runner.in_thread(job.builder.copy_doc, cached_html,
+                                     cached_html != job.cached_html)
+    else:
+        if job.cache_key is not None:
+            info = {"project": job.project, "profile": job.profile,
+                    "url": job.builder.project_path,
+                    "revision": job.inputs["revision"]}
+            try:
+                await runner.in_thread(cache.store, job.cache_key,
+                                       job.builder.html_dir, info)
+            except OSError as e:
+                job.log.warning("Cannot store the documentation in the"
+                                " cache: %s", e)
+        await job.session.once(("file-system", job.profile),
+                               _check_file_system, job)
+        old = await runner.in_thread(job.builder.move_doc)
+        await runner.in_thread(job.builder.clear_tmp)
+    if compressions:
+        await runner.in_thread(compress.save_digests, target_dir, digests)
+    store = None
+    if dedupe.enabled(job.builder.conf):
+        store = dedupe.blob_store(job.builder.conf)
+        if not await job.session.once(("blob-store", job.profile),
+                                      _check_blob_store, job, store):
+            store = None
+    if old is not None or store is not None:
+        job.session.background(_clean_published, old, target_dir, store)
 
-        # build the documentation
-        builder.build_doc()
-        # move it
-        builder.move_doc()
-        # remove the build directory
-        builder.clear_tmp()
+    profile_manifest = job.session.manifest(job.profile)
+    if job.failed:
+        # the published documentation is not the one of the last successful
+        # build anymore, e.g. with --force
+        profile_manifest.remove(job.project)
+        job.log.warning("The documentation build failed: it will be built"
+                        " again by the next run")
+        return
+    # the environment might have been modified by the install stage
+    job.inputs["environment"] = job.builder.env_fingerprint()
+    profile_manifest.set(job.project, job.inputs)
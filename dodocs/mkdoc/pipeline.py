@@ -0,0 +1,150 @@
+"""Staged pipeline
+
+A pipeline is a sequence of stages joined by bounded queues. Each stage has its
+own pool of workers, so that different stages process different items at the
+same time: e.g. while one project is being fetched, an other is installed and
+a third one is built.
+
+The pipeline runs in an :mod:`asyncio` event loop: the workers are tasks and
+the stages are coroutine functions.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import asyncio
+
+# sentinel telling the workers of a stage that no more items are coming
+_STOP = object()
+
+
+class Skip(Exception):
+    """Raised by a stage to stop an item without it being an error: the item
+    doesn't reach the following stages and no error is reported"""
+    pass
+
+
+class Stage(object):
+    """Stage of a :class:`Pipeline`
+
+    Parameters
+    ----------
+    name : string
+        name of the stage
+    func : coroutine function
+        function processing one item. It is called with the item as only
+        argument and its return value is ignored: the same item is passed to
+        the following stage. It can raise :class:`Skip` to stop the item
+    workers : int, optional
+        number of workers executing ``func`` concurrently
+    maxsize : int, optional
+        maximum number of items waiting to be processed by the stage. If ``0``
+        the queue is unbounded
+
+    Attributes
+    ----------
+    name, func, workers, maxsize : as above
+    """
+    def __init__(self, name, func, workers=1, maxsize=0):
+        if workers < 1:
+            raise ValueError("Stage '{}' needs at least one"
+                             " worker".format(name))
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.maxsize = maxsize
+
+
+class Pipeline(object):
+    """Run items through a sequence of stages.
+
+    Parameters
+    ----------
+    stages : list of :class:`Stage`
+        stages to run, in order
+    on_error : callable, optional
+        called as ``on_error(item, stage)`` from within the ``except`` block
+        when a stage raises an exception. The item is then dropped and doesn't
+        reach the following stages. If ``None``, the errors are silently
+        dropped
+    """
+    def __init__(self, stages, on_error=None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.on_error = on_error
+
+    async def run(self, items):
+        """Push the items through the pipeline and wait for all of them to be
+        processed
+
+        Parameters
+        ----------
+        items : iterable
+            items to process
+
+        Returns
+        -------
+        list
+            items that went through all the stages, in the order they
+            finished
+        """
+        done = []
+        queues = [asyncio.Queue(maxsize=s.maxsize) for s in self.stages]
+        queues.append(None)  # the last stage has no one to pass items to
+
+        stage_tasks = []
+        for i, stage in enumerate(self.stages):
+            workers = [self._worker(stage, queues[i], queues[i + 1], done)
+                       for _ in range(stage.workers)]
+            stage_tasks.append(asyncio.gather(*workers))
+
+        async def feed():
+            for item in items:
+                await queues[0].put(item)
+            await self._stop_stage(0, queues[0])
+
+        async def chain_stops():
+            # once all the workers of a stage are done, stop the next one
+            for i, task in enumerate(stage_tasks[:-1]):
+                await task
+                await self._stop_stage(i + 1, queues[i + 1])
+
+        await asyncio.gather(feed(), chain_stops(), *stage_tasks)
+        return done
+
+    async def _worker(self, stage, inqueue, outqueue, done):
+        """Process the items of ``stage`` until the stop sentinel is received
+
+        Parameters
+        ----------
+        stage : :class:`Stage`
+            stage to work for
+        inqueue, outqueue : :class:`asyncio.Queue`
+            queues where to get the items from and where to put the processed
+            ones; ``outqueue`` is ``None`` for the last stage
+        done : list
+            where the last stage collects the processed items
+        """
+        while True:
+            item = await inqueue.get()
+            if item is _STOP:
+                break
+            try:
+                await stage.func(item)
+            except Skip:
+                continue
+            except Exception:
+                if self.on_error is not None:
+                    self.on_error(item, stage)
+                continue
+            if outqueue is not None:
+                await outqueue.put(item)
+            else:
+                done.append(item)
+
+    async def _stop_stage(self, index, queue):
+        """Tell all the workers of the stage number ``index`` to stop once
+        they have processed the items already in the ``queue``"""
+        for _ in range(self.stages[index].workers):
+            await queue.put(_STOP)
@@ -0,0 +1,392 @@
+"""Publish the documentation in the target directory
+
+The documentation can be published in different ways, the publish modes,
+selected with the ``publish`` option of the ``general`` section:
+
+* ``replace``, the default: remove the published documentation and move the
+  new one in its place. The documentation is missing while it is copied;
+* ``rename``: copy the new documentation next to the published one, then swap
+  them. On Linux the swap is a single atomic ``rename``, elsewhere, or if the
+  file system doesn't support it, e.g. NFS, it takes two;
+* ``symlink``: the target directory is a symbolic link to a hidden directory
+  next to it. The new documentation is copied in an other hidden directory and
+  the link is atomically replaced;
+* ``sync``: only the files that changed since the last publish are written,
+  each atomically, and the ones that disappeared are removed. What has been
+  published is recorded in a hidden manifest next to the target directory.
+
+In the ``rename`` and ``symlink`` modes the documentation is never missing or
+incomplete and the old documentation is returned, so that it can be removed in
+the background.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import ctypes
+import errno
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import time
+
+DEFAULT_MODE = "replace"
+"default publish mode"
+
+SYNC_MANIFEST = ".{}.sync.json"
+"""name, formatted with the name of the target directory, of the manifest of
+the ``sync`` mode"""
+
+# a publish mode for every name; key: mode; value: function
+_publishers = {}
+
+# disambiguate the staging directories of the same process
+_counter = itertools.count()
+
+
+def register_publisher(mode, func):
+    """Register ``func`` as the publish ``mode``
+
+    Parameters
+    ----------
+    mode : string
+        name of the publish mode
+    func : callable
+        function publishing the documentation. It is called as ``func(html_dir,
+        target_dir, move)``, with the arguments of :func:`publish`, and
+        returns the same
+    """
+    _publishers[mode] = func
+
+
+def modes():
+    """Names of the available publish modes
+
+    Returns
+    -------
+    list of strings
+    """
+    return sorted(_publishers)
+
+
+def publish(mode, html_dir, target_dir, move=False):
+    """Publish the documentation in ``html_dir`` in ``target_dir``
+
+    Parameters
+    ----------
+    mode : string
+        publish mode
+    html_dir : :class:`pathlib.Path`
+        directory containing the html files
+    target_dir : :class:`pathlib.Path`
+        directory where to publish the documentation
+    move : bool, optional
+        if ``True`` move the documentation, otherwise copy it
+
+    Returns
+    -------
+    :class:`pathlib.Path` or None
+        the old documentation, out of the way and to be removed with
+        :func:`remove_tree`; ``None`` if there is nothing to remove
+    """
+    try:
+        publisher = _publishers[mode]
+    except KeyError:
+        raise ValueError("Unknown publish mode '{}'. Available: {}"
+                         "".format(mode, ", ".join(modes())))
+    target_dir.parent.mkdir(parents=True, exist_ok=True)
+    return publisher(html_dir, target_dir, move)
+
+
+def same_file_system(path1, path2):
+    """Whether ``path1`` and ``path2`` are on the same file system, i.e. if
+    a directory can be renamed from one to the other. Paths that don't exist
+    are checked through their closest existing parent.
+
+    Parameters
+    ----------
+    path1, path2 : :class:`pathlib.Path`
+        paths to check
+
+    Returns
+    -------
+    bool
+    """
+    devices = []
+    for path in [path1, path2]:
+        path = path.absolute()
+        while not path.exists() and path != path.parent:
+            path = path.parent
+        devices.append(path.stat().st_dev)
+    return devices[0] == devices[1]
+
+
+def remove_tree(path):
+    """Remove the old documentation returned by :func:`publish`
+
+    Parameters
+    ----------
+    path : :class:`pathlib.Path`
+        old documentation
+    """
+    shutil.rmtree(str(path), ignore_errors=True)
+
+
+def _hidden(target_dir, suffix):
+    """Hidden sibling of the target directory, unique to this process
+
+    Parameters
+    ----------
+    target_dir : :class:`pathlib.Path`
+        target directory
+    suffix : string
+        suffix of the name
+
+    Returns
+    -------
+    :class:`pathlib.Path`
+    """
+    name = ".{}.{}.{}.{}".format(target_dir.name, os.getpid(), next(_counter),
+                                 suffix)
+    return target_dir.with_name(name)
+
+
+def _stage(html_dir, staging_dir, move):
+    """Move or copy ``html_dir`` to ``staging_dir``"""
+    if move:
+        shutil.move(str(html_dir), str(staging_dir))
+    else:
+        shutil.copytree(str(html_dir), str(staging_dir))
+
+
+def _find_renameat2():
+    """Look for the ``renameat2`` function of the C library
+
+    Returns
+    -------
+    :class:`ctypes._CFuncPtr` or None
+        ``None`` if not available, e.g. not on Linux or with an old C library
+    """
+    try:
+        return ctypes.CDLL(None, use_errno=True).renameat2
+    except (AttributeError, OSError):
+        return None
+
+
+_renameat2 = _find_renameat2()
+RENAME_EXCHANGE = 2
+"flag of ``renameat2`` swapping the two paths"
+
+
+def _exchange(path1, path2):
+    """Atomically swap ``path1`` and ``path2`` with ``renameat2``.
+
+    Parameters
+    ----------
+    path1, path2 : :class:`pathlib.Path`
+        paths to swap; both must exist
+
+    Returns
+    -------
+    bool
+        ``False`` if the system or the file system don't support the swap
+    """
+    if _renameat2 is None:
+        return False
+    at_fdcwd = -100
+    if _renameat2(at_fdcwd, os.fsencode(str(path1)), at_fdcwd,
+                  os.fsencode(str(path2)), RENAME_EXCHANGE) == 0:
+        return True
+    err = ctypes.get_errno()
+    if err in (errno.ENOSYS, errno.EINVAL, errno.ENOTSUP):
+        return False
+    raise OSError(err, os.strerror(err), str(path1))
+
+
+def _linked(target_dir):
+    """If ``target_dir`` is a symbolic link created by the ``symlink`` mode,
+    return the directory it points to
+
+    Parameters
+    ----------
+    target_dir : :class:`pathlib.Path`
+        target directory
+
+    Returns
+    -------
+    :class:`pathlib.Path` or None
+    """
+    if not target_dir.is_symlink():
+        return None
+    linked = target_dir.parent / os.readlink(str(target_dir))
+    # don't touch links not created by dodocs
+    if (linked.parent == target_dir.parent and
+            linked.name.startswith(".{}.".format(target_dir.name))):
+        return linked
+    return None
+
+
+def _replace(html_dir, target_dir, move):
+    """Remove the published documentation and put the new one in its
+    place"""
+    old = _linked(target_dir)
+    if target_dir.is_symlink():
+        target_dir.unlink()
+    else:
+        shutil.rmtree(str(target_dir), ignore_errors=True)
+    _stage(html_dir, target_dir, move)
+    return old
+
+
+def _rename(html_dir, target_dir, move):
+    """Stage the documentation next to the published one and swap them"""
+    staging_dir = _hidden(target_dir, "new")
+    _stage(html_dir, staging_dir, move)
+    if not os.path.lexists(str(target_dir)):
+        os.rename(str(staging_dir), str(target_dir))
+        return None
+
+    linked = _linked(target_dir)
+    if _exchange(staging_dir, target_dir):
+        old = staging_dir
+    else:
+        old = _hidden(target_dir, "old")
+        os.rename(str(target_dir), str(old))
+        os.rename(str(staging_dir), str(target_dir))
+    if old.is_symlink():
+        # switching from the symlink mode
+        old.unlink()
+        old = linked
+    return old
+
+
+def _symlink(html_dir, target_dir, move):
+    """Stage the documentation in a hidden directory and point the target
+    directory, a symbolic link, to it"""
+    version_dir = _hidden(target_dir, int(time.time()))
+    _stage(html_dir, version_dir, move)
+    link = _hidden(target_dir, "link")
+    # relative, so that the whole tree can be moved
+    os.symlink(version_dir.name, str(link))
+
+    old = _linked(target_dir)
+    if target_dir.exists() and not target_dir.is_symlink():
+        # switching from an other mode: a moment without documentation
+        old = _hidden(target_dir, "old")
+        os.rename(str(target_dir), str(old))
+    os.replace(str(link), str(target_dir))
+    return old
+
+
+def _sync(html_dir, target_dir, move):
+    """Write only the files that changed since the last publish and remove
+    the ones not published anymore"""
+    old = _linked(target_dir)
+    if target_dir.is_symlink():
+        # switching from the symlink mode
+        target_dir.unlink()
+
+    manifest_file = target_dir.with_name(
+        SYNC_MANIFEST.format(target_dir.name))
+    new = _tree_hashes(html_dir)
+    published = _load_sync_manifest(manifest_file, target_dir)
+    if published is None:
+        published = _tree_hashes(target_dir)
+
+    target_dir.mkdir(exist_ok=True)
+    for rel_path, digest in sorted(new.items()):
+        dest = target_dir / rel_path
+        if published.get(rel_path) == digest and _size(dest) == digest[1]:
+            continue
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_name(".{}.{}.tmp".format(dest.name, os.getpid()))
+        shutil.copy2(str(html_dir / rel_path), str(tmp))
+        os.replace(str(tmp), str(dest))
+
+    for rel_path in set(published) - set(new):
+        try:
+            (target_dir / rel_path).unlink()
+        except FileNotFoundError:
+            pass
+    for dirpath, _, _ in os.walk(str(target_dir), topdown=False):
+        if dirpath != str(target_dir) and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+    tmp = manifest_file.with_name(manifest_file.name + ".tmp")
+    with tmp.open("w") as f:
+        json.dump({"inode": target_dir.stat().st_ino, "files": new}, f)
+    os.replace(str(tmp), str(manifest_file))
+
+    if move:
+        shutil.rmtree(str(html_dir))
+    return old
+
+
+def _tree_hashes(path):
+    """Hash and size of the files in the ``path`` tree
+
+    Parameters
+    ----------
+    path : :class:`pathlib.Path`
+        directory; it might not exist
+
+    Returns
+    -------
+    dict
+        path relative to ``path``: [sha1 of the content, size in bytes]
+    """
+    hashes = {}
+    for dirpath, _, filenames in os.walk(str(path)):
+        for fname in filenames:
+            full_path = os.path.join(dirpath, fname)
+            sha = hashlib.sha1()
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(2 ** 20), b""):
+                    sha.update(chunk)
+            rel_path = os.path.relpath(full_path, str(path))
+            hashes[rel_path] = [sha.hexdigest(), os.path.getsize(full_path)]
+    return hashes
+
+
+def _load_sync_manifest(manifest_file, target_dir):
+    """Files published by the last ``sync``
+
+    Parameters
+    ----------
+    manifest_file : :class:`pathlib.Path`
+        manifest of the ``sync`` mode
+    target_dir : :class:`pathlib.Path`
+        target directory
+
+    Returns
+    -------
+    dict or None
+        as returned by :func:`_tree_hashes`; ``None`` if the manifest doesn't
+        exist or if the target directory has been replaced since, e.g.
+        published with an other mode
+    """
+    try:
+        with manifest_file.open() as f:
+            manifest = json.load(f)
+        inode = target_dir.stat().st_ino
+    except (OSError, ValueError):
+        return None
+    if manifest.get("inode") != inode:
+        return None
+    return manifest.get("files")
+
+
+def _size(path):
+    """Size of the file ``path``, ``None`` if it doesn't exist"""
+    try:
+        return path.stat().st_size
+    except OSError:
+        return None
+
+
+register_publisher("replace", _replace)
+register_publisher("rename", _rename)
+register_publisher("symlink", _symlink)
+register_publisher("sync", _sync)
@@ -0,0 +1,219 @@
+"""Run external commands
+
+All the external commands executed while building the documentation, e.g.
+``git``, ``pip`` and ``sphinx-build``, go through a :class:`CommandRunner`. It
+runs them as :mod:`asyncio` subprocesses, so that many of them can be in flight
+at the same time without a thread per child.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import asyncio
+import collections
+import functools
+
+# maximum length of a line of output
+_LINE_LIMIT = 2 ** 20
+
+CommandResult = collections.namedtuple("CommandResult",
+                                       ["cmd", "returncode", "stdout",
+                                        "stderr"])
+"""Outcome of a command: the command itself, its return code and its standard
+output and error as strings"""
+
+
+class CommandError(RuntimeError):
+    """The command failed
+
+    Parameters
+    ----------
+    result : :class:`CommandResult`
+        outcome of the command
+    msg : string, optional
+        error message. If not given, it is built from ``result``
+
+    Attributes
+    ----------
+    result : as above
+    """
+    def __init__(self, result, msg=None):
+        if msg is None:
+            msg = "'{}' return code is '{}'".format(" ".join(result.cmd),
+                                                    result.returncode)
+        super(CommandError, self).__init__(msg)
+        self.result = result
+
+
+class CommandTimeout(CommandError):
+    """The command didn't finish in the given time and has been killed"""
+    pass
+
+
+class CommandRunner(object):
+    """Run external commands asynchronously.
+
+    Parameters
+    ----------
+    max_procs : int, optional
+        maximum number of commands running at the same time. If ``None`` there
+        is no limit
+    timeout : float, optional
+        default timeout, in seconds, for the commands. If ``None`` the commands
+        can run forever
+    """
+    def __init__(self, max_procs=None, timeout=None):
+        self.max_procs = max_procs
+        self.timeout = timeout
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        """Semaphore limiting the number of running commands. ``None`` if
+        there is no limit"""
+        if self._semaphore is None and self.max_procs is not None:
+            self._semaphore = asyncio.Semaphore(self.max_procs)
+        return self._semaphore
+
+    async def run(self, cmd, cwd=None, env=None, timeout=None, check=False,
+                  stdin=None, on_stdout=None, on_stderr=None):
+        """Run ``cmd`` and wait for it to finish.
+
+        If the task running the command is cancelled, the command is killed.
+
+        Parameters
+        ----------
+        cmd : list of strings
+            command to execute
+        cwd : string or :class:`pathlib.Path`, optional
+            directory where to run the command
+        env : dict, optional
+            environment of the command. If ``None`` the environment of
+            ``dodocs`` is used
+        timeout : float, optional
+            kill the command after this number of seconds. If ``None`` use the
+            runner default
+        check : bool, optional
+            if ``True`` raise an error if the return code is not zero
+        stdin : string, optional
+            text to send to the command standard input
+        on_stdout, on_stderr : callable, optional
+            called with every line, without the trailing newline, of the
+            standard output and error as soon as it is available
+
+        Returns
+        -------
+        :class:`CommandResult`
+            the outcome of the command
+
+        Raises
+        ------
+        CommandError
+            if ``check`` is ``True`` and the command fails
+        CommandTimeout
+            if the command takes longer than ``timeout``
+        """
+        cmd = [str(c) for c in cmd]
+        if timeout is None:
+            timeout = self.timeout
+
+        if self.semaphore is None:
+            return await self._run(cmd, cwd, env, timeout, check, stdin,
+                                   on_stdout, on_stderr)
+        async with self.semaphore:
+            return await self._run(cmd, cwd, env, timeout, check, stdin,
+                                   on_stdout, on_stderr)
+
+    async def _run(self, cmd, cwd, env, timeout, check, stdin, on_stdout,
+                   on_stderr):
+        """Implement :meth:`run`, once the semaphore has been acquired"""
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, cwd=None if cwd is None else str(cwd), env=env,
+            stdin=asyncio.subprocess.DEVNULL if stdin is None else
+            asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            limit=_LINE_LIMIT)
+
+        stdout, stderr = [], []
+        communicate = asyncio.gather(
+            _feed(proc.stdin, stdin),
+            _read_lines(proc.stdout, stdout, on_stdout),
+            _read_lines(proc.stderr, stderr, on_stderr))
+        try:
+            await asyncio.wait_for(communicate, timeout)
+            await proc.wait()
+        except asyncio.TimeoutError:
+            await _kill(proc)
+            msg = "'{}' killed after {} seconds".format(" ".join(cmd),
+                                                        timeout)
+            raise CommandTimeout(_result(cmd, proc, stdout, stderr), msg)
+        except BaseException:
+            # e.g. cancellation: don't leave orphans behind
+            await _kill(proc)
+            raise
+
+        result = _result(cmd, proc, stdout, stderr)
+        if check and result.returncode != 0:
+            raise CommandError(result)
+        return result
+
+
+def _result(cmd, proc, stdout, stderr):
+    """Build the :class:`CommandResult`"""
+    return CommandResult(cmd, proc.returncode, "\n".join(stdout),
+                         "\n".join(stderr))
+
+
+async def _feed(writer, text):
+    """Write ``text`` into the standard input and close it"""
+    if writer is None:
+        return
+    try:
+        writer.write(text.encode())
+        await writer.drain()
+        writer.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass  # the command doesn't want to read
+
+
+async def _read_lines(reader, lines, callback):
+    """Read ``reader`` line by line, store the lines in ``lines`` and pass
+    them to ``callback``, if given"""
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.decode(errors="replace").rstrip("\n")
+        lines.append(line)
+        if callback is not None:
+            callback(line)
+
+
+async def _kill(proc):
+    """Kill the process, if still running, and reap it"""
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+async def in_thread(func, *args, **kwargs):
+    """Run the blocking function ``func`` in a worker thread without blocking
+    the event loop, e.g. for file system operations.
+
+    Parameters
+    ----------
+    func : callable
+        function to run
+    args, kwargs :
+        positional and keyword arguments passed to ``func``
+
+    Returns
+    -------
+    the return value of ``func``
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None,
+                                      functools.partial(func, *args, **kwargs))
@@ -0,0 +1,246 @@
+"""CPU budget for the documentation builds
+
+The :class:`CPUScheduler` owns a budget of CPU tokens. Every documentation
+build asks for a number of tokens, sized after its project, and is granted as
+many as are free, at least one. The granted tokens are the number of processes
+the build is allowed to use, e.g. ``sphinx-build -j``. This way a large project
+can use many cores, while the small ones share the rest and the machine is not
+oversubscribed.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import asyncio
+import contextlib
+import json
+import math
+import os
+
+import dodocs.utils as dutils
+
+DURATIONS_FILE = "build_times.json"
+"name of the file, in the state directory, storing the build durations"
+
+SECONDS_PER_TOKEN = 30.
+"""When sizing a project after its last build duration, ask one token for each
+of these many seconds"""
+
+# how often, in seconds, to check again the system load when waiting
+_POLL_INTERVAL = 1.
+
+
+def load_average():
+    """One minute system load average
+
+    Returns
+    -------
+    float or None
+        load average, ``None`` if not available on this system
+    """
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def available_memory():
+    """Memory available for new processes, from ``/proc/meminfo``
+
+    Returns
+    -------
+    int or None
+        available memory in bytes, ``None`` if not available on this system
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class CPUScheduler(object):
+    """Share a budget of CPU tokens among concurrent documentation builds.
+
+    Parameters
+    ----------
+    budget : int, optional
+        number of tokens; defaults to the number of CPUs
+    adapt : bool, optional
+        if ``True`` shrink the budget when the machine is loaded by other
+        processes or when the available memory is low
+    mem_per_token : int, optional
+        memory, in bytes, needed by each token. Used only if ``adapt`` is
+        ``True``. If ``None`` the available memory is ignored
+
+    Attributes
+    ----------
+    budget, adapt, mem_per_token : as above
+    in_use : int
+        number of tokens currently granted
+    """
+    def __init__(self, budget=None, adapt=True, mem_per_token=None):
+        self.budget = budget or os.cpu_count() or 1
+        self.adapt = adapt
+        self.mem_per_token = mem_per_token
+        self.in_use = 0
+        self._condition = None
+
+    @property
+    def condition(self):
+        """Condition notified when tokens are released"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def limit(self):
+        """Number of tokens that can currently be in use, taking into account
+        the system load and the available memory if ``adapt`` is ``True``.
+
+        Returns
+        -------
+        int
+        """
+        limit = self.budget
+        if not self.adapt:
+            return limit
+
+        load = load_average()
+        if load is not None:
+            # the load average includes our own processes
+            external = max(0., load - self.in_use)
+            limit = min(limit, self.budget - int(external))
+
+        if self.mem_per_token:
+            memory = available_memory()
+            if memory is not None:
+                limit = min(limit, self.in_use + memory // self.mem_per_token)
+
+        return limit
+
+    def free(self):
+        """Number of tokens that can be granted now. At least one if no token
+        is in use, so that the builds always progress
+
+        Returns
+        -------
+        int
+        """
+        free = self.limit() - self.in_use
+        if self.in_use == 0:
+            free = max(free, 1)
+        return max(free, 0)
+
+    async def acquire(self, wanted):
+        """Wait until some token is free and grab up to ``wanted`` of them
+
+        Parameters
+        ----------
+        wanted : int
+            number of tokens wanted
+
+        Returns
+        -------
+        int
+            number of tokens granted, between 1 and ``wanted``
+        """
+        wanted = max(1, min(wanted, self.budget))
+        async with self.condition:
+            while self.free() < 1:
+                try:
+                    # poll to notice changes in the system load as well
+                    await asyncio.wait_for(self.condition.wait(),
+                                           _POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            granted = min(wanted, self.free())
+            self.in_use += granted
+        return granted
+
+    async def release(self, tokens):
+        """Give back the tokens
+
+        Parameters
+        ----------
+        tokens : int
+            number of tokens to release, as returned by :meth:`acquire`
+        """
+        async with self.condition:
+            self.in_use -= tokens
+            self.condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def tokens(self, wanted):
+        """Context manager acquiring tokens and releasing them on exit
+
+        Parameters
+        ----------
+        wanted : int
+            number of tokens wanted
+
+        Yields
+        ------
+        int
+            number of tokens granted
+        """
+        granted = await self.acquire(wanted)
+        try:
+            yield granted
+        finally:
+            await self.release(granted)
+
+
+def tokens_for_duration(duration):
+    """Number of tokens to ask for a build that lasted ``duration`` seconds
+
+    Parameters
+    ----------
+    duration : float or None
+        duration of the last build; ``None`` if unknown
+
+    Returns
+    -------
+    int
+    """
+    if duration is None:
+        return 1
+    return max(1, int(math.ceil(duration / SECONDS_PER_TOKEN)))
+
+
+class BuildDurations(object):
+    """Duration of the last build of the projects of a profile, persisted in
+    the state directory of the profile.
+
+    The durations are multiplied by the number of tokens used for the build,
+    so that they approximate the duration of a build with one token.
+
+    Parameters
+    ----------
+    profile : string
+        name of the profile
+    """
+    def __init__(self, profile):
+        self.profile = profile
+        self.fname = dutils.state_dir(profile) / DURATIONS_FILE
+        try:
+            with self.fname.open() as f:
+                self._durations = json.load(f)
+        except (OSError, ValueError):
+            self._durations = {}
+
+    def get(self, project):
+        """Duration of the last build of ``project``, ``None`` if unknown"""
+        return self._durations.get(project)
+
+    def set(self, project, duration):
+        """Store the duration of the last build of ``project``"""
+        self._durations[project] = duration
+
+    def save(self):
+        """Write the durations to the state directory"""
+        self.fname.parent.mkdir(parents=True, exist_ok=True)
+        with self.fname.open("w") as f:
+            json.dump(self._durations, f, indent=2, sort_keys=True)
@@ -0,0 +1,223 @@
+"""Build session
+
+Resources shared by all the projects built in one ``mkdocs`` run.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+
+import asyncio
+from concurrent import futures
+
+import dodocs.logger as dlog
+
+from dodocs.cache import artifacts
+from dodocs.mkdoc.builders import sphinxworker
+from dodocs.mkdoc.builders import venvpool
+from dodocs.mkdoc.builders import wheelhouse
+from dodocs.mkdoc import manifest
+from dodocs.mkdoc import runner
+from dodocs.mkdoc import scheduler
+
+
+class BuildSession(object):
+    """Resources shared by all the builds of one ``mkdocs`` run.
+
+    It must be created and used within the event loop driving the builds.
+
+    Parameters
+    ----------
+    args : namespace
+        parsed command line arguments
+
+    Attributes
+    ----------
+    args : as above
+    runner : :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner used to execute all the external commands
+    scheduler : :class:`~dodocs.mkdoc.scheduler.CPUScheduler`
+        CPU budget shared by the documentation builds
+    cache : :class:`~dodocs.cache.artifacts.ArtifactCache` or None
+        cache of the documentation builds; ``None`` if disabled
+    wheelhouse : :class:`~dodocs.mkdoc.builders.wheelhouse.Wheelhouse`
+        wheelhouse providing the packages installed with ``pip``
+    """
+    def __init__(self, args):
+        self.args = args
+        self.runner = runner.CommandRunner(max_procs=args.max_procs,
+                                           timeout=args.timeout)
+        self.scheduler = scheduler.CPUScheduler(
+            budget=args.cpu_budget, adapt=not args.no_adapt,
+            mem_per_token=args.mem_per_cpu * 2 ** 20)
+        self.cache = None if args.no_cache else artifacts.ArtifactCache()
+        self.wheelhouse = wheelhouse.Wheelhouse(offline=args.offline)
+        self._locks = {}
+        self._once = {}
+        self._durations = {}
+        self._manifests = {}
+        self._workers = []
+        self._background = []
+        self._process_pool = None
+
+    def lock(self, key):
+        """Lock associated with ``key``.
+
+        Use it to serialise operations on shared resources, e.g. ``pip
+        install`` in a virtual environment shared by multiple projects.
+
+        Parameters
+        ----------
+        key : hashable
+            identifier of the resource, e.g. a directory name
+
+        Returns
+        -------
+        :class:`asyncio.Lock`
+        """
+        return self._locks.setdefault(key, asyncio.Lock())
+
+    async def once(self, key, func, *args):
+        """Run ``func(*args)`` only the first time it's called with ``key``.
+
+        Use it for operations that must be executed at most once per session,
+        e.g. updating the mirror of a repository shared by multiple profiles.
+        The later calls wait for the first one to finish and get the same
+        result or exception.
+
+        Parameters
+        ----------
+        key : hashable
+            identifier of the operation
+        func : coroutine function
+            operation to run
+        args :
+            arguments passed to ``func``
+
+        Returns
+        -------
+        whatever ``func`` returns
+        """
+        try:
+            task = self._once[key]
+        except KeyError:
+            task = asyncio.ensure_future(func(*args))
+            self._once[key] = task
+        # cancelling a caller must not cancel the operation for the others
+        return await asyncio.shield(task)
+
+    async def sphinx_worker(self, python, environment):
+        """Warm sphinx worker for the virtual environment of ``python``,
+        started the first time it's asked for.
+
+        Parameters
+        ----------
+        python : :class:`pathlib.Path`
+            python executable of the virtual environment
+        environment : string
+            fingerprint of the virtual environment: if the installed packages
+            change, a new worker is started
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.builders.sphinxworker.SphinxWorker` or None
+            ``None`` if disabled or if the worker can't be started
+        """
+        if self.args.no_sphinx_worker:
+            return None
+        return await self.once(("sphinx-worker", str(python), environment),
+                               self._start_worker, python)
+
+    async def _start_worker(self, python):
+        """Start the sphinx worker for ``python``, ``None`` on failure"""
+        worker = sphinxworker.SphinxWorker(python)
+        try:
+            await worker.start()
+        except (sphinxworker.WorkerError, OSError) as e:
+            dlog.getLogger().warning("%s: using sphinx-build", e)
+            return None
+        self._workers.append(worker)
+        return worker
+
+    @property
+    def process_pool(self):
+        """Pool of processes, sized after the CPU budget, for CPU bound
+        work, e.g. compressing the documentation"""
+        if self._process_pool is None:
+            self._process_pool = futures.ProcessPoolExecutor(
+                max_workers=self.scheduler.budget)
+        return self._process_pool
+
+    def background(self, func, *args):
+        """Run the blocking function ``func(*args)`` in a thread, without
+        waiting for it, e.g. to remove old files. :meth:`close` waits for it.
+
+        Parameters
+        ----------
+        func : callable
+            function to run
+        args :
+            arguments passed to ``func``
+        """
+        self._background.append(asyncio.ensure_future(
+            runner.in_thread(func, *args)))
+
+    async def close(self):
+        """Stop the sphinx workers and the process pool and wait for the
+        background operations"""
+        await asyncio.gather(*[w.close() for w in self._workers])
+        self._workers = []
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._background = []
+        if self._process_pool is not None:
+            await runner.in_thread(self._process_pool.shutdown)
+            self._process_pool = None
+
+    def durations(self, profile):
+        """Durations of the past builds of the projects of ``profile``
+
+        Parameters
+        ----------
+        profile : string
+            name of the profile
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.scheduler.BuildDurations`
+        """
+        try:
+            return self._durations[profile]
+        except KeyError:
+            durations = scheduler.BuildDurations(profile)
+            self._durations[profile] = durations
+            return durations
+
+    def manifest(self, profile):
+        """Manifest of the builds of ``profile``
+
+        Parameters
+        ----------
+        profile : string
+            name of the profile
+
+        Returns
+        -------
+        :class:`~dodocs.mkdoc.manifest.Manifest`
+        """
+        try:
+            return self._manifests[profile]
+        except KeyError:
+            profile_manifest = manifest.Manifest(profile)
+            self._manifests[profile] = profile_manifest
+            return profile_manifest
+
+    def save(self):
+        """Persist the information collected during the session, shrink the
+        cache to its maximum size and remove the unused virtual environments
+        of the pool"""
+        for durations in self._durations.values():
+            durations.save()
+        for profile_manifest in self._manifests.values():
+            profile_manifest.save()
+        if self.cache is not None:
+            self.cache.prune(self.args.cache_size * 2 ** 20)
+        venvpool.VenvPool().gc()
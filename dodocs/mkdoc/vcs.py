@@ -4,19 +4,116 @@ Copyright (c) 2015 Francesco Montesano
 MIT Licence
 """
 
-import subprocess as sp
+import collections
+import os
+import shutil
+
+from dodocs.mkdoc import runner as drunner
 
 known_vcs = {"git": "git",
              }
 "Map of known version control system names to executables"
 
 
+FetchOptions = collections.namedtuple("FetchOptions",
+                                      ["depth", "filter", "single_branch",
+                                       "branch", "tags", "sparse", "lfs",
+                                       "submodules"])
+"""How much of the repository to fetch and check out: history depth (``None``
+for all), partial clone filter (e.g. ``blob:none``), whether to fetch only one
+branch, branch or tag to check out (``None`` for the default one), whether to
+fetch the tags, directories to check out (``None`` for all), whether to
+download the LFS files and submodules to check out (``None`` for none, an empty
+list for all)"""
+
+FULL_FETCH = FetchOptions(depth=None, filter=None, single_branch=False,
+                          branch=None, tags=True, sparse=None, lfs=True,
+                          submodules=None)
+"fetch the whole repository and check out the default branch"
+
+OPTION_NAMES = FetchOptions(depth="depth", filter="filter",
+                            single_branch="single-branch", branch="branch",
+                            tags="tags", sparse="sparse-checkout", lfs="lfs",
+                            submodules="submodules")
+"name of the project option setting each of the :class:`FetchOptions`"
+
+FETCH_ONLY = ("depth", "filter", "single_branch", "tags")
+"""the :class:`FetchOptions` that change how much of the repository is
+fetched, but not the files checked out"""
+
+SUBMODULE_JOBS = 8
+"number of submodules fetched in parallel"
+
+
 class VCSError(KeyError):
     """Unknown vcs type"""
     pass
 
 
-def get_or_update_source(vcs_name, from_where):
+def fetch_options(conf, project):
+    """Read the :class:`FetchOptions` from the configuration of ``project``
+
+    Parameters
+    ----------
+    conf : :class:`configparser.ConfigParser` instance
+        configuration object
+    project : string
+        name of the project
+
+    Returns
+    -------
+    :class:`FetchOptions`
+    """
+    names = OPTION_NAMES
+    return FetchOptions(
+        depth=conf.getint(project, names.depth, fallback=None),
+        filter=conf.get(project, names.filter, fallback=None) or None,
+        single_branch=conf.getboolean(project, names.single_branch,
+                                      fallback=False),
+        branch=conf.get(project, names.branch, fallback=None) or None,
+        tags=conf.getboolean(project, names.tags, fallback=True),
+        sparse=_split(conf.get(project, names.sparse, fallback="")),
+        lfs=conf.getboolean(project, names.lfs, fallback=True),
+        submodules=_split(conf.get(project, names.submodules, fallback=""),
+                          everything="all"))
+
+
+def fetch_only_options():
+    """Names of the project options that don't change the files checked out,
+    so neither the documentation built from them
+
+    Returns
+    -------
+    list of strings
+    """
+    return [getattr(OPTION_NAMES, field) for field in FETCH_ONLY]
+
+
+def _split(value, everything=None):
+    """Split a space separated list of paths
+
+    Parameters
+    ----------
+    value : string
+        value of the option
+    everything : string, optional
+        value meaning all the paths
+
+    Returns
+    -------
+    list of strings or None
+        ``None`` if ``value`` is empty; empty if ``value`` is ``everything``
+    """
+    value = value.strip()
+    if not value:
+        return None
+    if value == everything:
+        return []
+    return value.split()
+
+
+async def get_or_update_source(vcs_name, from_where, cwd, runner,
+                               mirror=None, options=FULL_FETCH):
     """Get or update the source code
 
     Parameters
@@ -25,6 +122,16 @@ def get_or_update_source(vcs_name, from_where):
         kind of version control system
     from_where: string
         path or url of the repository/source code
+    cwd: string or :class:`pathlib.Path`
+        directory containing, or that will contain, the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+    mirror: string or :class:`pathlib.Path`, optional
+        up to date mirror of ``from_where`` (see :func:`update_mirror`). If
+        given, new repositories borrow its objects and existing ones are
+        updated from it instead of ``from_where``
+    options: :class:`FetchOptions`, optional
+        what to fetch
 
     Raises
     ------
@@ -38,59 +145,344 @@ def get_or_update_source(vcs_name, from_where):
     except KeyError as e:
         raise VCSError from e
 
-    if is_repo(vcs_exe):
-        update_repo(vcs_exe)
+    if await is_repo(vcs_exe, cwd, runner):
+        await update_repo(vcs_exe, cwd, runner, mirror=mirror,
+                          options=options)
     else:
-        clone_repo(vcs_exe, from_where)
+        await clone_repo(vcs_exe, from_where, cwd, runner, mirror=mirror,
+                         options=options)
+
+
+async def update_mirror(vcs_name, from_where, mirror, runner):
+    """Create or update the bare mirror of a repository
+
+    The mirror is created in a temporary directory and then renamed, so that
+    an interrupted clone doesn't leave a broken mirror behind. Its objects are
+    never pruned, as the repositories created with :func:`clone_repo` may
+    borrow them.
+
+    Parameters
+    ----------
+    vcs_name: string
+        kind of version control system
+    from_where: string
+        path or url of the repository/source code
+    mirror: :class:`pathlib.Path`
+        directory of the mirror
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+
+    Raises
+    ------
+    VCSError
+        if the vcs type is unknown or the mirror cannot be created or updated
+    """
+    try:
+        vcs_exe = known_vcs[vcs_name]
+    except KeyError as e:
+        raise VCSError from e
+
+    try:
+        if mirror.exists():
+            await runner.run([vcs_exe, "remote", "update", "--prune"],
+                             cwd=mirror, check=True)
+            return
 
+        mirror.parent.mkdir(parents=True, exist_ok=True)
+        tmp = mirror.with_name("{}.{}.tmp".format(mirror.name, os.getpid()))
+        if tmp.exists():
+            shutil.rmtree(str(tmp))
+        await runner.run([vcs_exe, "clone", "--mirror", from_where, str(tmp)],
+                         cwd=mirror.parent, check=True)
+        await runner.run([vcs_exe, "config", "gc.pruneExpire", "never"],
+                         cwd=tmp, check=True)
+    except drunner.CommandError as e:
+        raise VCSError(e.result.stderr) from e
 
-def is_repo(vcs_exe):
-    """check if current working directory is under version control
+    try:
+        os.rename(str(tmp), str(mirror))
+    except OSError:
+        # an other process created the mirror in the meantime
+        shutil.rmtree(str(tmp))
+
+
+async def get_revision(vcs_name, cwd, runner):
+    """Get the revision checked out in ``cwd``
+
+    Parameters
+    ----------
+    vcs_name: string
+        kind of version control system
+    cwd: string or :class:`pathlib.Path`
+        directory of the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+
+    Returns
+    -------
+    string
+        identifier of the revision
+
+    Raises
+    ------
+    VCSError
+        if the vcs type is unknown or the revision cannot be retrieved
+    """
+    return await _rev_parse(vcs_name, "HEAD", cwd, runner)
+
+
+async def changed_files(vcs_name, old, new, paths, cwd, runner):
+    """List the files under ``paths`` changed between two revisions
+
+    Parameters
+    ----------
+    vcs_name: string
+        kind of version control system
+    old, new: string
+        revisions to compare
+    paths: list of strings
+        paths, relative to ``cwd``, to restrict the comparison to
+    cwd: string or :class:`pathlib.Path`
+        directory of the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+
+    Returns
+    -------
+    list of strings
+        names of the changed files
+
+    Raises
+    ------
+    VCSError
+        if the vcs type is unknown or the revisions cannot be compared, e.g.
+        because ``old`` is not in a shallow clone
+    """
+    try:
+        vcs_exe = known_vcs[vcs_name]
+    except KeyError as e:
+        raise VCSError from e
+
+    cmd = [vcs_exe, "diff", "--name-only", old, new, "--"] + list(paths)
+    try:
+        result = await runner.run(cmd, cwd=cwd, check=True)
+    except drunner.CommandError as e:
+        raise VCSError(e.result.stderr) from e
+    return result.stdout.split()
+
+
+async def _rev_parse(vcs_name, what, cwd, runner):
+    """Run ``rev-parse`` with the arguments ``what`` and return the output
+
+    Parameters
+    ----------
+    vcs_name: string
+        kind of version control system
+    what: string or list of strings
+        arguments of ``rev-parse``
+    cwd: string or :class:`pathlib.Path`
+        directory of the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+
+    Returns
+    -------
+    string
+
+    Raises
+    ------
+    VCSError
+        if the vcs type is unknown or the command fails
+    """
+    try:
+        vcs_exe = known_vcs[vcs_name]
+    except KeyError as e:
+        raise VCSError from e
+
+    if isinstance(what, str):
+        what = [what]
+    cmd = [vcs_exe, "rev-parse"] + what
+    try:
+        result = await runner.run(cmd, cwd=cwd, check=True)
+    except drunner.CommandError as e:
+        raise VCSError(e.result.stderr) from e
+    return result.stdout.strip()
+
+
+async def is_repo(vcs_exe, cwd, runner):
+    """check if ``cwd`` is the root of a repository.
+
+    For git, this doesn't scan the working tree, so it's cheap also for large
+    repositories.
 
     Parameters
     ----------
     vcs_exe: string
         name of the vsc command to execute
+    cwd: string or :class:`pathlib.Path`
+        directory to check
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
 
     Returns
     -------
     bool
         whether it's are repository or not
     """
-    cmd = [vcs_exe, "status"]
+    if not os.path.isdir(str(cwd)):
+        return False
+    if vcs_exe == "svn":
+        result = await runner.run([vcs_exe, "status"], cwd=cwd)
+        return (result.returncode == 0 and
+                "warning: W155007:" not in result.stdout)
+
+    # ``cwd`` might be inside an other repository
+    cmd = [vcs_exe, "rev-parse", "--show-toplevel"]
+    result = await runner.run(cmd, cwd=cwd)
+    if result.returncode != 0:
+        return False
+    return os.path.samefile(result.stdout.strip(), str(cwd))
+
+
+async def is_up_to_date(vcs_name, from_where, cwd, runner,
+                        options=FULL_FETCH):
+    """Check, without fetching anything, whether the repository in ``cwd`` is
+    at the same revision as the branch, or tag, to check out from
+    ``from_where``.
+
+    Parameters
+    ----------
+    vcs_name: string
+        kind of version control system
+    from_where: string
+        path or url of the repository/source code
+    cwd: string or :class:`pathlib.Path`
+        directory of the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+    options: :class:`FetchOptions`, optional
+        what to fetch
+
+    Returns
+    -------
+    bool
+        ``False`` if ``cwd`` is not a repository or the remote revision
+        cannot be found
+
+    Raises
+    ------
+    VCSError
+        if the vcs type is unknown
+    """
     try:
-        stdout = sp.check_output(cmd, stderr=sp.STDOUT)
-        if vcs_exe != "svn":
-            return True
-        else:
-            if "warning: W155007:" in stdout:
-                return False
-    except sp.CalledProcessError:
+        vcs_exe = known_vcs[vcs_name]
+    except KeyError as e:
+        raise VCSError from e
+
+    if not await is_repo(vcs_exe, cwd, runner):
+        return False
+    try:
+        remote = await remote_revision(vcs_name, from_where, options.branch,
+                                       runner)
+        local = await get_revision(vcs_name, cwd, runner)
+    except VCSError:
         return False
+    return remote is not None and remote == local
 
 
-def update_repo(vcs_exe):
-    """Update the repository in the current directory
+async def remote_revision(vcs_name, from_where, ref, runner):
+    """Get the revision of ``ref`` in the remote repository, without
+    fetching it
+
+    Parameters
+    ----------
+    vcs_name: string
+        kind of version control system
+    from_where: string
+        path or url of the repository/source code
+    ref: string or None
+        branch or tag; ``None`` for the default branch
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+
+    Returns
+    -------
+    string or None
+        identifier of the revision; ``None`` if ``ref`` does not exist
+
+    Raises
+    ------
+    VCSError
+        if the vcs type is unknown or the remote repository cannot be queried
+    """
+    try:
+        vcs_exe = known_vcs[vcs_name]
+    except KeyError as e:
+        raise VCSError from e
+
+    if ref is None:
+        ref = "HEAD"
+        candidates = ["HEAD"]
+    else:
+        # same precedence as git fetch; annotated tags are peeled to commits
+        candidates = ["refs/tags/{}^{{}}".format(ref), "refs/tags/" + ref,
+                      "refs/heads/" + ref, ref]
+    cmd = [vcs_exe, "ls-remote", from_where, ref, ref + "^{}"]
+    try:
+        result = await runner.run(cmd, check=True)
+    except drunner.CommandError as e:
+        raise VCSError(e.result.stderr) from e
+
+    refs = {}
+    for line in result.stdout.splitlines():
+        revision, _, name = line.partition("\t")
+        refs[name.strip()] = revision.strip()
+    for name in candidates:
+        if name in refs:
+            return refs[name]
+    return None
+
+
+async def update_repo(vcs_exe, cwd, runner, mirror=None, options=FULL_FETCH):
+    """Update the repository in ``cwd``: fetch the branch, or tag, to check
+    out and reset the working tree to it, discarding any local change.
 
     Parameters
     ----------
     vcs_exe: string
         name of the vsc command to execute
+    cwd: string or :class:`pathlib.Path`
+        directory of the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+    mirror: string or :class:`pathlib.Path`, optional
+        mirror of the ``origin`` remote. If given, fetch from it instead of
+        from ``origin``
+    options: :class:`FetchOptions`, optional
+        what to fetch
 
     Raises
     ------
     VCSError
         if the repository update fails
     """
-    cmd = [vcs_exe, "pull"]
+    remote = "origin" if mirror is None else str(mirror)
+    env = _checkout_env(options)
+    cmd = [vcs_exe, "fetch"] + _fetch_args(options)
+    cmd += [remote, options.branch or "HEAD"]
     try:
-        sp.check_output(cmd, stderr=sp.STDOUT)
-    except sp.CalledProcessError as e:
-        raise VCSError from e
+        await runner.run(cmd, cwd=cwd, env=env, check=True)
+        await _set_sparse_checkout(vcs_exe, cwd, runner, options, env)
+        await runner.run([vcs_exe, "reset", "--hard", "FETCH_HEAD"], cwd=cwd,
+                         env=env, check=True)
+        await _update_submodules(vcs_exe, cwd, runner, options, env)
+    except drunner.CommandError as e:
+        raise VCSError(e.result.stderr) from e
 
 
-def clone_repo(vcs_exe, from_where):
-    """Create the new repository
+async def clone_repo(vcs_exe, from_where, cwd, runner, mirror=None,
+                     options=FULL_FETCH):
+    """Create the new repository in ``cwd``
 
     Parameters
     ----------
@@ -98,6 +490,15 @@ def clone_repo(vcs_exe, from_where):
         name of the vsc command to execute
     from_where: string
         path or url of the repository/source code
+    cwd: string or :class:`pathlib.Path`
+        directory where to clone the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+    mirror: string or :class:`pathlib.Path`, optional
+        mirror of ``from_where``. If given, the new repository borrows its
+        objects instead of downloading and storing them again
+    options: :class:`FetchOptions`, optional
+        what to fetch
 
     Raises
     ------
@@ -105,8 +506,127 @@ def clone_repo(vcs_exe, from_where):
         if the vcs type is unknown or something happened when creating/updating
         the repository
     """
-    cmd = [vcs_exe, "clone", from_where, '.']
+    cmd = [vcs_exe, "clone"]
+    if mirror is not None:
+        cmd += ["--reference", str(mirror)]
+    cmd += _fetch_args(options)
+    if options.single_branch:
+        cmd.append("--single-branch")
+    if options.branch is not None:
+        cmd += ["--branch", options.branch]
+    if options.sparse is not None:
+        # check out only the top level files, until the sparse checkout is set
+        cmd.append("--sparse")
+    cmd += [from_where, '.']
+    env = _checkout_env(options)
     try:
-        sp.check_output(cmd, stderr=sp.STDOUT)
-    except sp.CalledProcessError as e:
-        raise VCSError from e
+        await runner.run(cmd, cwd=cwd, env=env, check=True)
+        await _set_sparse_checkout(vcs_exe, cwd, runner, options, env)
+        await _update_submodules(vcs_exe, cwd, runner, options, env)
+    except drunner.CommandError as e:
+        raise VCSError(e.result.stderr) from e
+
+
+def _checkout_env(options):
+    """Environment of the commands checking out files
+
+    Parameters
+    ----------
+    options: :class:`FetchOptions`
+        what to fetch
+
+    Returns
+    -------
+    dict or None
+        ``None`` to use the current environment
+    """
+    if options.lfs:
+        return None
+    # check out the LFS pointers instead of downloading the files
+    return dict(os.environ, GIT_LFS_SKIP_SMUDGE="1")
+
+
+async def _set_sparse_checkout(vcs_exe, cwd, runner, options, env):
+    """Restrict the working tree to the directories in ``options.sparse``,
+    plus the top level files, or restore the full working tree
+
+    Parameters
+    ----------
+    vcs_exe: string
+        name of the vsc command to execute
+    cwd: string or :class:`pathlib.Path`
+        directory of the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+    options: :class:`FetchOptions`
+        what to check out
+    env: dict or None
+        environment of the commands
+
+    Raises
+    ------
+    :class:`~dodocs.mkdoc.runner.CommandError`
+        if any command fails
+    """
+    if options.sparse is not None:
+        await runner.run([vcs_exe, "sparse-checkout", "set", "--cone"] +
+                         options.sparse, cwd=cwd, env=env, check=True)
+        return
+    result = await runner.run([vcs_exe, "config", "--get",
+                               "core.sparseCheckout"], cwd=cwd)
+    if result.stdout.strip() == "true":
+        await runner.run([vcs_exe, "sparse-checkout", "disable"], cwd=cwd,
+                         env=env, check=True)
+
+
+async def _update_submodules(vcs_exe, cwd, runner, options, env):
+    """Check out the submodules in ``options.submodules``, in parallel
+
+    Parameters
+    ----------
+    vcs_exe: string
+        name of the vsc command to execute
+    cwd: string or :class:`pathlib.Path`
+        directory of the repository
+    runner: :class:`~dodocs.mkdoc.runner.CommandRunner`
+        runner executing the vcs commands
+    options: :class:`FetchOptions`
+        what to check out
+    env: dict or None
+        environment of the commands
+
+    Raises
+    ------
+    :class:`~dodocs.mkdoc.runner.CommandError`
+        if any command fails
+    """
+    if options.submodules is None:
+        return
+    cmd = [vcs_exe, "submodule", "update", "--init", "--recursive",
+           "--jobs={}".format(SUBMODULE_JOBS)]
+    if options.depth is not None:
+        cmd.append("--depth={}".format(options.depth))
+    cmd += ["--"] + options.submodules
+    await runner.run(cmd, cwd=cwd, env=env, check=True)
+
+
+def _fetch_args(options):
+    """Arguments shared by ``clone`` and ``fetch``
+
+    Parameters
+    ----------
+    options: :class:`FetchOptions`
+        what to fetch
+
+    Returns
+    -------
+    list of strings
+    """
+    args = []
+    if options.depth is not None:
+        args.append("--depth={}".format(options.depth))
+    if options.filter is not None:
+        args.append("--filter={}".format(options.filter))
+    if not options.tags:
+        args.append("--no-tags")
+    return args
@@ -32,6 +32,8 @@ def plist(args):
         return
 
     dirpath, dirnames = next(os.walk(str(dodocs_dir)))[:2]
+    # hidden directories contain data shared by the profiles, e.g. caches
+    dirnames = sorted(d for d in dirnames if not d.startswith('.'))
     if dirnames:
         log.info("Available profiles:")
         for d in dirnames:
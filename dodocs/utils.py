@@ -10,7 +10,9 @@ Copyright (c) 2015 Francesco Montesano
 MIT Licence
 """
 
+import argparse as ap
 import contextlib
+import hashlib
 import os
 from pathlib import Path
 
@@ -20,6 +22,27 @@ VENV_DIRECTORY = "venvs"
 "The virtual environments of the profiles go here"
 BUILD_DIRECTORY = "temp"
 "Temporary documentation builds of the profiles go here"
+STATE_DIRECTORY = "state"
+"Information persisted between builds of the profiles goes here"
+CACHE_DIRECTORY = ".cache"
+"""The documentation builds shared across profiles go here. Hidden, so that it
+is not mistaken for a profile"""
+
+SHARED_DIRECTORY = ".shared"
+"""The checkouts shared by multiple projects of a profile go here, within the
+sources directory"""
+VENV_POOL_DIRECTORY = ".venvs"
+"""The virtual environments shared across profiles go here. Hidden, so that it
+is not mistaken for a profile"""
+WHEELHOUSE_DIRECTORY = ".wheels"
+"""The wheels installed in the virtual environments go here. Hidden, so that it
+is not mistaken for a profile"""
+MIRRORS_DIRECTORY = ".mirrors"
+"""The bare mirrors of the repositories shared across profiles go here. Hidden,
+so that it is not mistaken for a profile"""
+BLOBS_DIRECTORY = ".blobs"
+"""The single copies of the files of the deduplicated documentation go here.
+Hidden, so that it is not mistaken for a profile"""
 
 
 class DodocsOSError(OSError):
@@ -66,6 +89,59 @@ def dodocs_directory():
     return dodocs_dir
 
 
+def cache_dir():
+    """Returns the directory of the cache of documentation builds shared by all
+    the profiles
+
+    Returns
+    -------
+    :class:`Path` instance
+        cache directory
+    """
+    return dodocs_directory() / CACHE_DIRECTORY
+
+
+def wheelhouse_dir():
+    """Returns the directory of the wheelhouse shared by all the profiles
+
+    Returns
+    -------
+    :class:`Path` instance
+        wheelhouse directory
+    """
+    return dodocs_directory() / WHEELHOUSE_DIRECTORY
+
+
+def blobs_dir():
+    """Returns the directory of the blob store of the deduplicated
+    documentation, shared by all the profiles
+
+    Returns
+    -------
+    :class:`Path` instance
+        blob store directory
+    """
+    return dodocs_directory() / BLOBS_DIRECTORY
+
+
+def mirror_dir(project_path):
+    """Returns the directory of the bare mirror of the repository in
+    ``project_path``, shared by all the profiles
+
+    Parameters
+    ----------
+    project_path : string
+        path or url of the repository
+
+    Returns
+    -------
+    :class:`Path` instance
+        mirror directory
+    """
+    name = hashlib.sha1(project_path.encode()).hexdigest() + ".git"
+    return dodocs_directory() / MIRRORS_DIRECTORY / name
+
+
 def format_docstring(*args, **kwargs):
     """Decorator to format the docstring using :func:`string.format` syntax
 
@@ -126,7 +202,25 @@ def project_dir(profile, project):
     return profile_dir(profile) / SRC_DIRECTORY / project
 
 
-def venv_dir(profile, language):
+def shared_project_dir(profile, key):
+    """Name of a directory containing source code shared by multiple projects
+
+    Parameters
+    ----------
+    profile : string
+        name of the profile
+    key : string
+        identifier of the source code, e.g. the hash of the repository url
+
+    Returns
+    -------
+    :class:`Path` instance
+        the name of the directory where the shared source lives
+    """
+    return profile_dir(profile) / SRC_DIRECTORY / SHARED_DIRECTORY / key
+
+
+def venv_dir(profile, language, key=None, project=None):
     """Name of the virtual environment
 
     Parameters
@@ -135,13 +229,34 @@ def venv_dir(profile, language):
         name of the profile
     language : string
         name of python version to use (e.g. ``python3``)
+    key : string, optional
+        identifier of the virtual environment, if the profile has more than
+        one, e.g. the key of its base in the pool of virtual environments
+    project : string, optional
+        name of the project, if the virtual environment belongs to it only
 
     Returns
     -------
     :class:`Path` instance
         the name of the directory where the venv is created
     """
-    return profile_dir(profile) / VENV_DIRECTORY / language
+    name = language if key is None else "{}-{}".format(language, key[:12])
+    venvs = profile_dir(profile) / VENV_DIRECTORY
+    if project is not None:
+        venvs = venvs / project
+    return venvs / name
+
+
+def venv_pool_dir():
+    """Returns the directory of the pool of virtual environments shared by all
+    the profiles
+
+    Returns
+    -------
+    :class:`Path` instance
+        pool directory
+    """
+    return dodocs_directory() / VENV_POOL_DIRECTORY
 
 
 def build_dir(profile, project):
@@ -163,6 +278,23 @@ def build_dir(profile, project):
     return profile_dir(profile) / BUILD_DIRECTORY / project
 
 
+def state_dir(profile):
+    """Name of the directory where the information about past builds, e.g.
+    their duration, is stored
+
+    Parameters
+    ----------
+    profile : string
+        name of the profile
+
+    Returns
+    -------
+    :class:`Path` instance
+        the name of the state directory of the profile
+    """
+    return profile_dir(profile) / STATE_DIRECTORY
+
+
 def mk_project(profile, project):
     """Create the project directory for the profile
 
@@ -220,3 +352,30 @@ def cd(path):
         yield
     finally:
         os.chdir(cwd)
+
+
+def positive_int(value):
+    """Convert ``value`` to a strictly positive integer.
+
+    Parameters
+    ----------
+    value : string
+        command line value
+
+    Returns
+    -------
+    int
+
+    Raises
+    ------
+    :class:`argparse.ArgumentTypeError`
+        if ``value`` is not a positive integer
+    """
+    try:
+        ivalue = int(value)
+    except ValueError:
+        ivalue = 0
+    if ivalue < 1:
+        raise ap.ArgumentTypeError("'{}' is not a positive"
+                                   " integer".format(value))
+    return ivalue
@@ -52,6 +52,10 @@ def extras_require():
 
     req_dic['livedoc'] = req_dic['doc'] + ['sphinx-autobuild>=0.5.2', ]
 
+    req_dic['brotli'] = ['brotli', ]
+
+    req_dic['toml'] = ['tomli; python_version < "3.11"', ]
+
     req_dic['test'] = ['pytest-cov', 'pytest-capturelog', 'pytest']
 
     req_dic['all'] = set(sum((v for v in req_dic.values()), []))
@@ -62,8 +66,7 @@ classifiers = ["Development Status :: 1 - Planning",
                "Environment :: Console",
                "Intended Audience :: Developers",
                "Intended Audience :: Other Audience",
-               "Programming Language :: Python :: 3.3",
-               "Programming Language :: Python :: 3.4",
+               "Programming Language :: Python :: 3.7",
                "Topic :: Documentation",
                "Topic :: Documentation :: Sphinx",
                ]
@@ -93,6 +96,7 @@ setup(
     entry_points={"console_scripts": ["dodoc = dodocs:main", ], },
 
     # dependences
+    python_requires='>=3.7',
     install_requires=['colorlog'],
     extras_require=extras_require(),
 
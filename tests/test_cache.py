@@ -0,0 +1,101 @@
+"""Test the cache of documentation builds
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import configparser
+import os
+from pathlib import Path
+
+import pytest
+
+import dodocs.cmdline as dcmdline
+
+from dodocs.cache import artifacts, manage
+
+
+@pytest.fixture
+def html(tmpdir):
+    """Directory with some fake documentation"""
+    html = Path(str(tmpdir.mkdir("html")))
+    (html / "index.html").write_text("x" * 1000)
+    return html
+
+
+@pytest.fixture
+def cache(tmpdir):
+    """Empty cache"""
+    return artifacts.ArtifactCache(path=Path(str(tmpdir.mkdir("cache"))))
+
+
+def test_cache_key():
+    """The key ignores the options not affecting the documentation"""
+    conf = configparser.ConfigParser()
+    conf.read_dict({"A": {"project_path": "url", "cpu-weight": "2"}})
+    key = artifacts.cache_key("url", "rev", ["cmd"], conf, "A", "env")
+    conf.set("A", "cpu-weight", "4")
+    assert artifacts.cache_key("url", "rev", ["cmd"], conf, "A",
+                               "env") == key
+    assert artifacts.cache_key("url", "rev2", ["cmd"], conf, "A",
+                               "env") != key
+    assert artifacts.cache_key("url", "rev", ["cmd"], conf, "A",
+                               None) is None
+
+
+def test_cache_key_fetch_options():
+    """The options changing only what is fetched don't change the key, the
+    ones changing the checked out files do"""
+    conf = configparser.ConfigParser()
+    conf.read_dict({"A": {"project_path": "url"}})
+    key = artifacts.cache_key("url", "rev", ["cmd"], conf, "A", "env")
+    for option, value in [("depth", "1"), ("filter", "blob:none"),
+                          ("single-branch", "yes"), ("tags", "no")]:
+        conf.set("A", option, value)
+    assert artifacts.cache_key("url", "rev", ["cmd"], conf, "A",
+                               "env") == key
+    for option, value in [("sparse-checkout", "docs"), ("lfs", "no"),
+                          ("submodules", "all")]:
+        conf.set("A", option, value)
+        assert artifacts.cache_key("url", "rev", ["cmd"], conf, "A",
+                                   "env") != key
+        conf.remove_option("A", option)
+
+
+def test_max_size():
+    """The cache can't be pruned to nothing by mistake"""
+    with pytest.raises(SystemExit):
+        dcmdline.parse(["cache", "prune", "--max-size", "0"])
+    assert dcmdline.parse(["cache", "prune", "-s", "10"]).max_size == 10
+
+
+@pytest.mark.parametrize("venvs", [False, True])
+def test_clear_venvs(tmp_homedir, monkeypatch, venvs):
+    """The shared virtual environments are removed only if asked"""
+    collected = []
+    monkeypatch.setattr(manage, "_gc_venvs", collected.append)
+    argv = ["cache", "clear"] + (["--venvs"] if venvs else [])
+    manage.clear(dcmdline.parse(argv))
+    assert collected == ([0] if venvs else [])
+
+
+def test_store_lookup(cache, html):
+    """Stored builds are found"""
+    assert cache.lookup("key") is None
+    cache.store("key", html, {"project": "A"})
+    cached = cache.lookup("key")
+    assert (cached / "index.html").read_text() == "x" * 1000
+    entries = cache.entries()
+    assert [e["key"] for e in entries] == ["key"]
+    assert entries[0]["project"] == "A"
+
+
+def test_prune_lru(cache, html):
+    """The least recently used builds are removed first"""
+    for i, key in enumerate(["old", "new", "used"]):
+        cache.store(key, html, {})
+        os.utime(str(cache.path / key / artifacts.INFO_FILE), (i, i))
+    cache.lookup("old")  # now it's the most recently used
+
+    removed = cache.prune(2 * cache.size() // 3)
+    assert [e["key"] for e in removed] == ["new"]
+    assert sorted(e["key"] for e in cache.entries()) == ["old", "used"]
@@ -0,0 +1,42 @@
+"""Test the precompression of the documentation
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import gzip
+from pathlib import Path
+
+from dodocs.mkdoc import compress
+
+
+def test_compress_file(tmpdir):
+    """The compressed copy has the same content"""
+    fname = Path(str(tmpdir)) / "index.html"
+    fname.write_text("<html>" * 100)
+    compress.compress_file(str(fname), "gzip")
+    with gzip.open(str(fname) + ".gz", "rt") as f:
+        assert f.read() == "<html>" * 100
+
+
+def test_reuse_compressed(tmpdir):
+    """Only the changed files are compressed again"""
+    tmpdir = Path(str(tmpdir))
+    html_dir, target_dir = tmpdir / "html", tmpdir / "target"
+    for d in [html_dir, target_dir]:
+        d.mkdir()
+        (d / "small.html").write_text("small")
+    for name in ["same.html", "changed.css"]:
+        (target_dir / name).write_text(name * 100)
+        compress.compress_file(str(target_dir / name), "gzip")
+    (html_dir / "same.html").write_text("same.html" * 100)
+    (html_dir / "changed.css").write_text("new" * 100)
+    (html_dir / "image.png").write_text("png" * 100)
+
+    digests, _ = compress._reuse_compressed(target_dir, target_dir, [])
+    compress.save_digests(target_dir, digests)
+    digests, to_compress = compress._reuse_compressed(html_dir, target_dir,
+                                                      ["gzip"])
+
+    assert sorted(digests) == ["changed.css", "same.html"]
+    assert to_compress == [(str(html_dir / "changed.css"), "gzip")]
+    assert (html_dir / "same.html.gz").samefile(target_dir / "same.html.gz")
@@ -0,0 +1,123 @@
+"""Test the deduplication of the published documentation
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import configparser
+import os
+from pathlib import Path
+import threading
+
+import dodocs.utils as dutils
+
+from dodocs.mkdoc import dedupe
+
+
+def test_dedupe_tree(tmpdir):
+    """The identical files of two trees are linked to the same blob"""
+    tmpdir = Path(str(tmpdir))
+    store = tmpdir / "blobs"
+    for project in ["p1", "p2"]:
+        (tmpdir / project / "_static").mkdir(parents=True)
+        (tmpdir / project / "_static" / "theme.css").write_text("body {}")
+        # copied from the theme, keeping the timestamp
+        os.utime(str(tmpdir / project / "_static" / "theme.css"), (10, 10))
+        (tmpdir / project / "index.html").write_text(project)
+
+    assert dedupe.dedupe_tree(tmpdir / "p1", store) == 0
+    assert dedupe.dedupe_tree(tmpdir / "p2", store) == len("body {}")
+    css1 = (tmpdir / "p1" / "_static" / "theme.css").stat()
+    css2 = (tmpdir / "p2" / "_static" / "theme.css").stat()
+    assert css1.st_ino == css2.st_ino
+    assert css1.st_nlink == 3
+    assert (tmpdir / "p2" / "_static" / "theme.css").read_text() == "body {}"
+    assert (tmpdir / "p2" / "index.html").read_text() == "p2"
+    # already deduplicated
+    assert dedupe.dedupe_tree(tmpdir / "p2", store) == 0
+
+
+def test_gc(tmpdir):
+    """Only the blobs not linked anymore are removed"""
+    tmpdir = Path(str(tmpdir))
+    store = tmpdir / "blobs"
+    for project in ["p1", "p2"]:
+        (tmpdir / project).mkdir()
+        (tmpdir / project / "index.html").write_text(project)
+        dedupe.dedupe_tree(tmpdir / project, store)
+
+    (tmpdir / "p1" / "index.html").unlink()
+    assert dedupe.gc(store) == 1
+    assert dedupe.gc(store) == 0
+    assert len(list(store.glob("*/*"))) == 1
+    assert (store / dedupe.LOCK_FILE).exists()
+
+
+def test_dedupe_linked(tmpdir):
+    """Files with other links, e.g. from the old documentation not removed
+    yet, are deduplicated too"""
+    tmpdir = Path(str(tmpdir))
+    store = tmpdir / "blobs"
+    for project in ["p1", "p2", "old"]:
+        (tmpdir / project).mkdir()
+    for project in ["p1", "old"]:
+        (tmpdir / project / "theme.css").write_text("body {}")
+        os.utime(str(tmpdir / project / "theme.css"), (10, 10))
+    os.link(str(tmpdir / "old" / "theme.css"),
+            str(tmpdir / "p2" / "theme.css"))
+
+    dedupe.dedupe_tree(tmpdir / "p1", store)
+    assert dedupe.dedupe_tree(tmpdir / "p2", store) == len("body {}")
+    assert (tmpdir / "p2" / "theme.css").samefile(tmpdir / "p1" /
+                                                  "theme.css")
+
+
+def test_dedupe_timestamps(tmpdir):
+    """Files with the same content but different modification times or
+    permissions don't share a blob, so they keep them"""
+    tmpdir = Path(str(tmpdir))
+    store = tmpdir / "blobs"
+    for i, project in enumerate(["p1", "p2", "p3"]):
+        (tmpdir / project).mkdir()
+        fname = tmpdir / project / "index.html"
+        fname.write_text("same")
+        os.utime(str(fname), (10 * i, 10 * i))
+    (tmpdir / "p3" / "index.html").chmod(0o600)
+    os.utime(str(tmpdir / "p3" / "index.html"), (10, 10))
+    for project in ["p1", "p2", "p3"]:
+        assert dedupe.dedupe_tree(tmpdir / project, store) == 0
+
+    assert len(list(store.glob("*/*"))) == 3
+    assert (tmpdir / "p2" / "index.html").stat().st_mtime == 10
+    assert (tmpdir / "p3" / "index.html").stat().st_mode & 0o777 == 0o600
+
+
+def test_blob_store(tmp_homedir):
+    """The blob store is out of the published tree, unless configured"""
+    conf = configparser.ConfigParser()
+    conf.read_dict({"general": {"target_dir": str(tmp_homedir / "target")}})
+    assert dedupe.blob_store(conf) == dutils.blobs_dir()
+    assert tmp_homedir / "target" not in dedupe.blob_store(conf).parents
+
+    conf.set("general", "dedupe_store", str(tmp_homedir / "blobs"))
+    assert dedupe.blob_store(conf) == tmp_homedir / "blobs"
+
+
+def test_gc_waits(tmpdir):
+    """The blobs are not removed while a deduplication is running"""
+    tmpdir = Path(str(tmpdir))
+    store = tmpdir / "blobs"
+    (tmpdir / "p1").mkdir()
+    (tmpdir / "p1" / "index.html").write_text("p1")
+    dedupe.dedupe_tree(tmpdir / "p1", store)
+    (tmpdir / "p1" / "index.html").unlink()
+
+    removed = []
+    with dedupe._locked(store, exclusive=False):
+        thread = threading.Thread(target=lambda: removed.append(
+            dedupe.gc(store)))
+        thread.start()
+        thread.join(timeout=0.2)
+        assert thread.is_alive()
+        assert len(list(store.glob("*/*"))) == 1
+    thread.join()
+    assert removed == [1]
@@ -0,0 +1,42 @@
+"""Test the logger adapters
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import threading
+
+import dodocs.logger as dlog
+
+
+def test_project_logger():
+    """The profile and project given to getLogger don't leak to the other
+    adapters"""
+    log = dlog.getLogger(profile="p1", project="A")
+    assert log.extra["profile"] == "p1"
+    assert log.extra["project"] == "A"
+
+    default = dlog.getLogger()
+    assert default.extra is not log.extra
+    assert default.extra.get("project") != "A"
+
+
+def test_concurrent_loggers(caplog):
+    """Projects logging from concurrent threads tag the records with their own
+    name"""
+    barrier = threading.Barrier(2, timeout=10)
+
+    def work(project):
+        log = dlog.getLogger(profile="p1", project=project)
+        barrier.wait()
+        for i in range(50):
+            log.warning("building %s", project)
+
+    threads = [threading.Thread(target=work, args=(p, )) for p in "AB"]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(caplog.records) == 100
+    assert all(r.getMessage() == "building " + r.project
+               for r in caplog.records)
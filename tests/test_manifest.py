@@ -0,0 +1,25 @@
+"""Test the build manifest
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+from dodocs.mkdoc import manifest
+
+
+def test_changed_inputs(tmp_homedir):
+    """Only the inputs that differ are reported"""
+    target = tmp_homedir / "target"
+    target.mkdir()
+    entry = {"revision": "a", "config": "c", "environment": "e",
+             "target": str(target)}
+    profile_manifest = manifest.Manifest("profile")
+    assert profile_manifest.changed_inputs("project", entry) == set(entry)
+
+    profile_manifest.set("project", entry)
+    assert profile_manifest.changed_inputs("project", entry) == set()
+    new_entry = dict(entry, revision="b")
+    assert profile_manifest.changed_inputs("project",
+                                           new_entry) == {"revision"}
+
+    target.rmdir()
+    assert profile_manifest.changed_inputs("project", entry) == set(entry)
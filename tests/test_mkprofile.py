@@ -0,0 +1,242 @@
+"""Test the documentation build of whole profiles
+
+The projects are built by a fake builder, that doesn't need any repository or
+virtual environment.
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import os
+import re
+import shutil
+import sys
+
+import pytest
+
+import dodocs
+import dodocs.config as dconf
+import dodocs.utils as dutils
+
+from dodocs.mkdoc import builders
+from dodocs.mkdoc import mkprofile as mkp
+import dodocs.mkdoc.builders.base_builder as bb
+
+# writes the page of the project and a style sheet shared by all the projects;
+# arguments: html directory, project name, return code and optionally a
+# directory where the builds wait for each other after the first line
+BUILD_SCRIPT = """
+import os, pathlib, sys, time
+html_dir = pathlib.Path(sys.argv[1])
+html_dir.mkdir(parents=True, exist_ok=True)
+(html_dir / "index.html").write_text(sys.argv[2] * 300)
+(html_dir / "_static").mkdir(exist_ok=True)
+(html_dir / "_static" / "theme.css").write_text("body {}" * 50)
+# copied from the theme, keeping the timestamp
+os.utime(html_dir / "_static" / "theme.css", (1e9, 1e9))
+print("building", sys.argv[2], flush=True)
+if len(sys.argv) > 4:
+    rendezvous = pathlib.Path(sys.argv[4])
+    (rendezvous / sys.argv[2]).touch()
+    for i in range(200):
+        if len(list(rendezvous.iterdir())) > 1:
+            break
+        time.sleep(0.05)
+    else:
+        sys.exit(1)
+for i in range(2):
+    time.sleep(0.05)
+    print("building", sys.argv[2], flush=True)
+sys.exit(int(sys.argv[3]))
+"""
+
+# number of builds of every project; key: (profile, project)
+BUILDS = {}
+
+
+class FakeBuilder(bb.BaseBuilder):
+    """Builder writing a page with the name of the project, repeated. The
+    build fails if the ``fail`` option of the project is ``yes``"""
+    async def probe(self):
+        return False
+
+    async def fetch(self):
+        dutils.mk_project(self.profile, self.project)
+
+    async def build_inputs(self):
+        return {"revision": "1",
+                "config": "",
+                "environment": "",
+                "target": str(self.target_dir),
+                }
+
+    def build_signature(self):
+        return ["fake"]
+
+    @property
+    def build_cmd(self):
+        fail = self.conf.getboolean(self.project, "fail", fallback=False)
+        rendezvous = self.conf.get(self.project, "rendezvous", fallback=None)
+        cmd = [sys.executable, "-c", BUILD_SCRIPT, str(self.html_dir),
+               self.project, str(int(fail))]
+        return cmd + [rendezvous] if rendezvous else cmd
+
+    async def build_doc(self):
+        key = (self.profile, self.project)
+        BUILDS[key] = BUILDS.get(key, 0) + 1
+        return await super(FakeBuilder, self).build_doc()
+
+    def clear_tmp(self):
+        shutil.rmtree(str(self.html_dir), ignore_errors=True)
+
+
+builders.register_builder("fake", FakeBuilder)
+
+
+@pytest.fixture
+def make_profile(tmp_and_clear):
+    """Create profiles of fake projects; returns a function taking the name
+    of the profile, a dictionary with the options of each project and,
+    optionally, one with the options of the ``general`` section. The function
+    returns the target directory of the profile"""
+    BUILDS.clear()
+
+    def make(profile, projects, general={}):
+        profile_dir = dutils.profile_dir(profile)
+        profile_dir.mkdir(parents=True)
+        lines = ["[general]", "is_edited = off",
+                 "version = {}".format(dutils.get_version()),
+                 "target_dir = {}".format(tmp_and_clear / "target")]
+        lines += ["{} = {}".format(k, v) for k, v in general.items()]
+        lines.append("")
+        for project, options in projects.items():
+            lines += ["[{}]".format(project), "project_path = nowhere",
+                      "language = fake"]
+            lines += ["{} = {}".format(k, v) for k, v in options.items()]
+            lines.append("")
+        (profile_dir / dconf.CONF_FILE).write_text("\n".join(lines))
+        return tmp_and_clear / "target" / profile
+
+    yield make
+    BUILDS.clear()
+
+
+def mkdocs(*args, cache=False, verbose=False):
+    """Run ``dodocs mkdocs`` without sphinx workers and, unless ``cache`` is
+    ``True``, without the artifact cache"""
+    dconf._config_dic.clear()
+    argv = ["-v"] if verbose else []
+    argv += ["mkdocs", "--no-sphinx-worker"] + list(args)
+    if not cache:
+        argv.append("--no-cache")
+    dodocs.main(argv)
+
+
+def test_unchanged_skipped(make_profile):
+    """A project is built again only if something changed or if forced"""
+    target = make_profile("p1", {"A": {}})
+    mkdocs("p1")
+    assert (target / "A" / "index.html").read_text() == "A" * 300
+    mkdocs("p1")
+    assert BUILDS == {("p1", "A"): 1}
+    mkdocs("-f", "p1")
+    assert BUILDS == {("p1", "A"): 2}
+
+
+def test_jobs_logs(make_profile, caplog, tmpdir):
+    """The output of the builds running concurrently is logged with the name
+    of the right project"""
+    rendezvous = tmpdir.mkdir("rendezvous")
+    target = make_profile("p1", {"A": {"rendezvous": str(rendezvous)},
+                                 "B": {"rendezvous": str(rendezvous)}})
+    mkdocs("-j", "2", "--cpu-budget", "2", "p1", verbose=True)
+
+    assert BUILDS == {("p1", "A"): 1, ("p1", "B"): 1}
+    assert (target / "B" / "index.html").exists()
+    building = [r for r in caplog.records
+                if re.match("building [AB]$", r.getMessage())]
+    assert len(building) == 6
+    assert all(r.getMessage() == "building " + r.project for r in building)
+    # the builds did run concurrently: each one started before the other one
+    # finished
+    projects = [r.project for r in building]
+    assert projects.index("B") < len(projects) - projects[::-1].index("A")
+    assert projects.index("A") < len(projects) - projects[::-1].index("B")
+
+
+def test_profiles_together(make_profile, caplog):
+    """The projects of the profiles are built alternating between profiles,
+    after checking all the configurations and skipping the invalid ones"""
+    make_profile("p1", {"A": {}, "B": {}})
+    make_profile("p2", {"C": {}})
+    make_profile("p3", {"D": {}})
+    cfg = dutils.profile_dir("p3") / dconf.CONF_FILE
+    cfg.write_text(cfg.read_text().replace("is_edited = off",
+                                           "is_edited = on"))
+    mkdocs("p1", "p3", "p2")
+
+    assert list(BUILDS) == [("p1", "A"), ("p2", "C"), ("p1", "B")]
+    messages = [r.getMessage() for r in caplog.records]
+    invalid = [i for i, m in enumerate(messages)
+               if m.startswith("Profile p3 won't be built")]
+    started = [i for i, m in enumerate(messages)
+               if m.endswith("Building documentation for profile 'p1'")]
+    assert len(invalid) == 1 and invalid < started
+
+
+def test_failed_rebuilt(make_profile):
+    """A failed build is not recorded, so the next run builds it again"""
+    make_profile("p1", {"A": {"fail": "yes"}, "B": {}})
+    mkdocs("p1")
+    mkdocs("p1")
+    assert BUILDS == {("p1", "A"): 2, ("p1", "B"): 1}
+
+
+def test_cache_not_modified(make_profile):
+    """Compressing the documentation found in the cache doesn't modify the
+    cache entry"""
+    make_profile("p1", {"A": {}})
+    target = make_profile("p2", {"A": {}}, general={"compress": "gzip"})
+    mkdocs("p1", cache=True)
+    mkdocs("p2", cache=True)
+
+    assert BUILDS == {("p1", "A"): 1}
+    assert (target / "A" / "index.html.gz").exists()
+    assert list(dutils.cache_dir().glob("*/html/index.html"))
+    assert not list(dutils.cache_dir().glob("*/html/**/*.gz"))
+
+
+@pytest.mark.parametrize("mode", ["rename", "symlink"])
+def test_publish_dedupe(make_profile, mode):
+    """Every published file is linked to a blob, also when the documentation
+    is replaced and the old one is still linked to the blobs"""
+    target = make_profile("p1", {"A": {}, "B": {}},
+                          general={"publish": mode, "dedupe": "yes",
+                                   "compress": "gzip"})
+    mkdocs("p1")
+    mkdocs("-f", "p1")
+
+    store = dutils.blobs_dir()
+    blobs = {b.stat().st_ino for b in store.glob("*/*")}
+    assert not (target.parent / ".blobs").exists()
+    published = []
+    for project in ["A", "B"]:
+        for dirpath, _, filenames in os.walk(str(target / project)):
+            published += [os.path.join(dirpath, f) for f in filenames]
+    assert len(published) == 8
+    assert all(os.stat(f).st_ino in blobs for f in published)
+    # index.html and its compressed copy for each project, the style sheet
+    # and its compressed copy
+    assert len(blobs) == 6
+    css = [target / p / "_static" / "theme.css" for p in ["A", "B"]]
+    assert css[0].samefile(css[1])
+
+
+def test_interleave_projects(monkeypatch):
+    """The projects are paired with their profile alternating between the
+    profiles"""
+    projects = {"p1": ["A", "B", "C"], "p2": ["D"], "p3": ["E", "F"]}
+    monkeypatch.setattr(dconf, "get_projects", projects.get)
+
+    assert mkp.interleave_projects(["p1", "p2", "p3"]) == [
+        ("p1", "A"), ("p2", "D"), ("p3", "E"), ("p1", "B"), ("p3", "F"),
+        ("p1", "C")]
@@ -0,0 +1,78 @@
+"""Test the staged pipeline
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import asyncio
+
+import pytest
+
+from dodocs.mkdoc import pipeline
+
+
+def test_all_stages_in_order():
+    """Every item goes through every stage, in order"""
+    seen = []
+
+    def make_stage(name):
+        async def func(item):
+            await asyncio.sleep(0.001 * item)
+            seen.append((item, name))
+        return pipeline.Stage(name, func, workers=2, maxsize=1)
+
+    stages = [make_stage(n) for n in ("a", "b", "c")]
+    asyncio.run(pipeline.Pipeline(stages).run(range(5)))
+
+    assert len(seen) == 15
+    for item in range(5):
+        names = [n for i, n in seen if i == item]
+        assert names == ["a", "b", "c"]
+
+
+def test_failure_is_isolated():
+    """A failing item is reported and dropped, the others go on"""
+    done, errors = [], []
+
+    async def first(item):
+        if item == 2:
+            raise RuntimeError("boom")
+
+    async def second(item):
+        done.append(item)
+
+    def on_error(item, stage):
+        errors.append((item, stage.name))
+
+    stages = [pipeline.Stage("first", first),
+              pipeline.Stage("second", second)]
+    finished = asyncio.run(pipeline.Pipeline(stages,
+                                             on_error=on_error).run(range(4)))
+
+    assert sorted(done) == [0, 1, 3]
+    assert sorted(finished) == [0, 1, 3]
+    assert errors == [(2, "first")]
+
+
+def test_stages_overlap():
+    """Slow items in one stage don't block the others in the next stage"""
+    running = set()
+    overlaps = []
+
+    def make_stage(name):
+        async def func(item):
+            running.add(name)
+            if len(running) > 1:
+                overlaps.append(item)
+            await asyncio.sleep(0.01)
+            running.discard(name)
+        return pipeline.Stage(name, func)
+
+    stages = [make_stage(n) for n in ("a", "b")]
+    asyncio.run(pipeline.Pipeline(stages).run(range(3)))
+    assert overlaps
+
+
+def test_no_workers():
+    """A stage without workers is refused"""
+    with pytest.raises(ValueError):
+        pipeline.Stage("none", print, workers=0)
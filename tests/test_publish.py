@@ -0,0 +1,101 @@
+"""Test the publish modes
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+from pathlib import Path
+
+import pytest
+
+from dodocs.mkdoc import publish
+
+
+def make_html(path, content):
+    """Create a fake documentation in ``path``"""
+    path.mkdir(parents=True)
+    (path / "index.html").write_text(content)
+    return path
+
+
+@pytest.mark.parametrize("mode", ["replace", "rename", "symlink", "sync"])
+def test_publish(tmpdir, mode):
+    """The new documentation replaces the old one and nothing is left
+    behind"""
+    tmpdir = Path(str(tmpdir))
+    target_dir = tmpdir / "target" / "project"
+    for i in range(3):
+        html_dir = make_html(tmpdir / "html{}".format(i), str(i))
+        old = publish.publish(mode, html_dir, target_dir, move=i % 2 == 0)
+        if old is not None:
+            publish.remove_tree(old)
+        assert (target_dir / "index.html").read_text() == str(i)
+        assert html_dir.exists() != (i % 2 == 0)
+
+    published = list((tmpdir / "target").iterdir())
+    assert len(published) == (2 if mode in ["symlink", "sync"] else 1)
+
+
+def test_rename_fallback(tmpdir, monkeypatch):
+    """Without renameat2 the documentation is swapped with two renames"""
+    monkeypatch.setattr(publish, "_renameat2", None)
+    tmpdir = Path(str(tmpdir))
+    target_dir = tmpdir / "target" / "project"
+    publish.publish("rename", make_html(tmpdir / "html0", "0"), target_dir)
+    old = publish.publish("rename", make_html(tmpdir / "html1", "1"),
+                          target_dir)
+
+    assert (target_dir / "index.html").read_text() == "1"
+    assert old.name.endswith(".old")
+    assert (old / "index.html").read_text() == "0"
+    publish.remove_tree(old)
+    assert list((tmpdir / "target").iterdir()) == [target_dir]
+
+
+def test_default_mode():
+    """The documentation is replaced, unless the profile asks otherwise"""
+    assert publish.DEFAULT_MODE == "replace"
+
+
+def test_sync(tmpdir):
+    """Only the changed files are written and the removed ones deleted"""
+    tmpdir = Path(str(tmpdir))
+    target_dir = tmpdir / "target" / "project"
+    html_dir = make_html(tmpdir / "html0", "index")
+    (html_dir / "_static").mkdir()
+    (html_dir / "_static" / "style.css").write_text("css")
+    (html_dir / "page.html").write_text("page")
+    publish.publish("sync", html_dir, target_dir)
+    index_inode = (target_dir / "index.html").stat().st_ino
+
+    html_dir = make_html(tmpdir / "html1", "index")
+    (html_dir / "page.html").write_text("new page")
+    publish.publish("sync", html_dir, target_dir)
+
+    assert (target_dir / "index.html").stat().st_ino == index_inode
+    assert (target_dir / "page.html").read_text() == "new page"
+    assert not (target_dir / "_static").exists()
+
+
+def test_switch_mode(tmpdir):
+    """Switching from the symlink mode leaves nothing behind"""
+    tmpdir = Path(str(tmpdir))
+    target_dir = tmpdir / "target" / "project"
+    for i, mode in enumerate(["symlink", "rename", "symlink", "replace"]):
+        html_dir = make_html(tmpdir / "html{}".format(i), str(i))
+        old = publish.publish(mode, html_dir, target_dir)
+        if old is not None:
+            publish.remove_tree(old)
+        assert (target_dir / "index.html").read_text() == str(i)
+    assert list((tmpdir / "target").iterdir()) == [target_dir]
+    assert not target_dir.is_symlink()
+
+
+def test_unknown_mode(tmpdir):
+    with pytest.raises(ValueError):
+        publish.publish("nope", Path(str(tmpdir)), Path(str(tmpdir)) / "t")
+
+
+def test_same_file_system(tmpdir):
+    """Paths not existing yet are checked through their parents"""
+    tmpdir = Path(str(tmpdir))
+    assert publish.same_file_system(tmpdir / "a" / "b", tmpdir / "c")
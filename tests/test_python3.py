@@ -0,0 +1,112 @@
+"""Test the python 3 builder
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import asyncio
+import configparser
+import json
+
+import dodocs.cmdline as dcmdline
+import dodocs.config as dconf
+import dodocs.logger as dlog
+import dodocs.utils as dutils
+
+from dodocs.mkdoc.builders import python3
+import dodocs.mkdoc.builders.base_builder as bb
+from dodocs.mkdoc import session as dsession
+
+
+def test_install_stamp(tmp_homedir, monkeypatch):
+    """The project is installed again only if its packaging changes"""
+    conf = configparser.ConfigParser(defaults=dconf.defaults())
+    conf.read_dict({"A": {"project_path": "nowhere", "py-install": "yes"}})
+    installs = []
+
+    async def install_pkg(self, what_install):
+        installs.append(what_install)
+
+    monkeypatch.setattr(python3.Python3Builder, "_install_pkg", install_pkg)
+
+    async def install():
+        session = dsession.BuildSession(dcmdline.parse(["mkdocs", "p"]))
+        builder = python3.Python3Builder("p", "A", conf, dlog.getLogger(),
+                                         session)
+        builder.project_dir.mkdir(parents=True, exist_ok=True)
+        builder.venv_dir.mkdir(parents=True, exist_ok=True)
+        await builder.install()
+        await session.close()
+        return builder
+
+    builder = asyncio.run(install())
+    asyncio.run(install())
+    assert installs == ["yes"]
+
+    (builder.project_dir / "setup.py").write_text("setup()\n")
+    (builder.project_dir / "index.rst").write_text("A\n")
+    asyncio.run(install())
+    assert installs == ["yes", "yes"]
+
+    # only the packaging files matter
+    (builder.project_dir / "index.rst").write_text("A\n=\n")
+    asyncio.run(install())
+    assert installs == ["yes", "yes"]
+
+    (builder.project_dir / "requirements.txt").write_text("numpy\n")
+    asyncio.run(install())
+    assert installs == ["yes", "yes", "yes"]
+
+    conf.set("A", "py-install", "docs")
+    asyncio.run(install())
+    assert installs == ["yes", "yes", "yes", "docs"]
+    assert (builder.venv_dir / python3.INSTALL_STAMP_FILE).exists()
+
+
+def test_incremental_failed(tmp_homedir, monkeypatch):
+    """After a failed build, the next one is a full rebuild"""
+    conf = configparser.ConfigParser(defaults=dconf.defaults())
+    conf.read_dict({"general": {"target_dir": str(tmp_homedir / "target")},
+                    "A": {"project_path": "nowhere", "incremental": "yes"}})
+    builder = python3.Python3Builder("p", "A", conf, dlog.getLogger(), None)
+    build_dir = dutils.build_dir("p", "A")
+    results = []
+
+    async def build_doc(self):
+        # sphinx writes the doctrees as it goes
+        (build_dir / "doctrees").mkdir(exist_ok=True)
+        (build_dir / "doctrees" / str(len(results))).touch()
+        return results[-1]
+
+    monkeypatch.setattr(bb.BaseBuilder, "build_doc", build_doc)
+
+    def build(stamp, success):
+        monkeypatch.setattr(builder, "_incremental_stamp", lambda: stamp)
+        results.append(success)
+        assert asyncio.run(builder.build_doc()) == success
+        return sorted(p.name for p in (build_dir / "doctrees").iterdir())
+
+    assert build({"conf.py": "1"}, True) == ["1"]
+    assert build({"conf.py": "1"}, True) == ["1", "2"]
+    # conf.py changed, but the build failed half way
+    assert build({"conf.py": "2"}, False) == ["3"]
+    assert not (build_dir / python3.STAMP_FILE).exists()
+    assert build({"conf.py": "2"}, True) == ["4"]
+    assert build({"conf.py": "2"}, True) == ["4", "5"]
+
+
+def test_incremental_stamp(tmp_homedir):
+    """In incremental mode the previous build is kept until the stamp
+    changes"""
+    conf = configparser.ConfigParser(defaults=dconf.defaults())
+    conf.read_dict({"general": {"target_dir": str(tmp_homedir / "target")},
+                    "A": {"project_path": "nowhere", "incremental": "yes"}})
+    builder = python3.Python3Builder("p", "A", conf, dlog.getLogger(), None)
+    doctrees = dutils.build_dir("p", "A") / "doctrees"
+    doctrees.mkdir(parents=True)
+    with (doctrees.parent / python3.STAMP_FILE).open("w") as f:
+        json.dump({"conf.py": "1"}, f)
+
+    builder._check_stamp({"conf.py": "1"})
+    assert doctrees.exists()
+    builder._check_stamp({"conf.py": "2"})
+    assert not doctrees.exists()
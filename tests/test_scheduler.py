@@ -0,0 +1,46 @@
+"""Test the CPU budget scheduler
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import asyncio
+
+import pytest
+
+from dodocs.mkdoc import scheduler
+
+
+@pytest.mark.parametrize("duration, tokens",
+                         [(None, 1), (0., 1), (10., 1),
+                          (scheduler.SECONDS_PER_TOKEN * 3.5, 4)])
+def test_tokens_for_duration(duration, tokens):
+    """Long builds ask for more tokens"""
+    assert scheduler.tokens_for_duration(duration) == tokens
+
+
+def test_budget_not_exceeded():
+    """The granted tokens never exceed the budget"""
+    sched = scheduler.CPUScheduler(budget=4, adapt=False)
+    granted, peak = [], []
+
+    async def build(wanted):
+        async with sched.tokens(wanted) as tokens:
+            granted.append(tokens)
+            peak.append(sched.in_use)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*[build(w) for w in (3, 3, 1, 8, 2)])
+
+    asyncio.run(main())
+    assert max(peak) <= 4
+    assert all(1 <= g <= 4 for g in granted)
+    assert granted[0] == 3
+    assert sched.in_use == 0
+
+
+def test_always_progress(monkeypatch):
+    """If the machine is overloaded, one build can still run"""
+    monkeypatch.setattr(scheduler, "load_average", lambda: 100.)
+    sched = scheduler.CPUScheduler(budget=4)
+    assert sched.free() == 1
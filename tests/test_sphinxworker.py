@@ -0,0 +1,74 @@
+"""Test the warm sphinx worker
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import asyncio
+from pathlib import Path
+import sys
+
+import pytest
+
+from dodocs.mkdoc.builders import sphinxworker
+
+
+def test_worker_builds(tmpdir):
+    """Concurrent builds succeed and the failures are reported"""
+    pytest.importorskip("sphinx")
+    source = Path(str(tmpdir)) / "source"
+    source.mkdir()
+    (source / "conf.py").write_text("project = 'test'\n")
+    (source / "index.rst").write_text("Title\n=====\n")
+
+    async def run():
+        worker = sphinxworker.SphinxWorker(Path(sys.executable))
+        await worker.start()
+        try:
+            builds = [worker.build(["-b", "html", "source",
+                                    "html{}".format(i)],
+                                   str(tmpdir)) for i in range(2)]
+            builds.append(worker.build(["-b", "html", "missing", "html"],
+                                       str(tmpdir)))
+            return await asyncio.gather(*builds)
+        finally:
+            await worker.close()
+
+    results = asyncio.run(run())
+    assert [r.returncode for r in results[:2]] == [0, 0]
+    assert results[2].returncode != 0
+    assert (Path(str(tmpdir)) / "html1" / "index.html").exists()
+
+
+def test_worker_path(tmpdir):
+    """The modules in the build directory are importable, as with
+    ``python -m sphinx``, and not shadowed by the ones of ``dodocs``"""
+    pytest.importorskip("sphinx")
+    tmpdir = Path(str(tmpdir))
+    (tmpdir / "source").mkdir()
+    (tmpdir / "wheelhouse.py").write_text("NAME = 'local module'\n")
+    (tmpdir / "source" / "conf.py").write_text(
+        "import wheelhouse\nproject = wheelhouse.NAME\n")
+    (tmpdir / "source" / "index.rst").write_text("Title\n=====\n")
+
+    async def run():
+        worker = sphinxworker.SphinxWorker(Path(sys.executable))
+        await worker.start()
+        try:
+            return await worker.build(["-b", "html", "source", "html"],
+                                      str(tmpdir))
+        finally:
+            await worker.close()
+
+    result = asyncio.run(run())
+    assert result.returncode == 0, result.stderr
+    assert "local module" in (tmpdir / "html" / "index.html").read_text()
+
+
+def test_worker_not_started(tmpdir):
+    """A worker without sphinx doesn't start"""
+    async def run():
+        worker = sphinxworker.SphinxWorker(Path(str(tmpdir)) / "python")
+        with pytest.raises((sphinxworker.WorkerError, OSError)):
+            await worker.start()
+
+    asyncio.run(run())
@@ -58,6 +58,15 @@ def test_venv_dir(dodocs_homedir):
     assert dodocs_homedir == vdir.parent
 
 
+def test_project_venv_dir(dodocs_homedir):
+    """Virtual environment dir of a single project"""
+    venv_dir = du.venv_dir("profile", "python3", key="0123456789abcdef",
+                           project="project")
+    assert venv_dir.name == "python3-0123456789ab"
+    assert venv_dir.parent == du.venv_dir("profile", "python3").parent / \
+        "project"
+
+
 def test_build_dir(dodocs_homedir):
     """Correct build directory directory"""
     project_dir = du.build_dir("profile", "project")
@@ -69,6 +78,30 @@ def test_build_dir(dodocs_homedir):
     assert dodocs_homedir == profdir.parent
 
 
+def test_state_dir(dodocs_homedir):
+    """Correct state directory"""
+    state_dir = du.state_dir("profile")
+    assert state_dir.name == du.STATE_DIRECTORY
+    profdir = state_dir.parent
+    assert profdir.name == "profile"
+    assert dodocs_homedir == profdir.parent
+
+
+def test_cache_dir(dodocs_homedir):
+    """Correct, hidden, cache directory"""
+    cache_dir = du.cache_dir()
+    assert cache_dir.name.startswith('.')
+    assert dodocs_homedir == cache_dir.parent
+
+
+def test_mirror_dir(dodocs_homedir):
+    """One hidden mirror directory per repository"""
+    mirror_dir = du.mirror_dir("https://example.com/repo.git")
+    assert mirror_dir.parent.name.startswith('.')
+    assert dodocs_homedir == mirror_dir.parent.parent
+    assert mirror_dir != du.mirror_dir("https://example.com/other.git")
+
+
 def test_project_creation(tmp_homedir):
     """Test that the directory is correctly created"""
     du.mk_project("profile", "project")
@@ -0,0 +1,318 @@
+"""Test the version control system abstraction layer
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import asyncio
+import configparser
+from pathlib import Path
+import subprocess
+import types
+
+import pytest
+
+import dodocs.cmdline as dcmdline
+import dodocs.config as dconf
+import dodocs.logger as dlog
+
+from dodocs.mkdoc.builders import python3
+from dodocs.mkdoc import runner as drunner
+from dodocs.mkdoc import session as dsession
+from dodocs.mkdoc import vcs
+
+
+def git(*args, cwd):
+    """Run git in ``cwd`` and return its output"""
+    cmd = ["git", "-c", "user.name=dodocs", "-c",
+           "user.email=dodocs@example.com", "-c", "init.defaultBranch=main"]
+    result = subprocess.run(cmd + list(args), cwd=str(cwd), check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    return result.stdout.strip()
+
+
+def commit(work, files, message):
+    """Write the ``files``, a dictionary of path: content, in the repository
+    ``work`` and commit them"""
+    for path, content in files.items():
+        (work / path).parent.mkdir(parents=True, exist_ok=True)
+        (work / path).write_text(content)
+    git("add", "-A", cwd=work)
+    git("commit", "-q", "-m", message, cwd=work)
+    return git("rev-parse", "HEAD", cwd=work)
+
+
+@pytest.fixture
+def origin(tmp_path):
+    """Bare repository with a ``main`` branch, where ``v1.0`` is an
+    annotated tag of the first commit, and a ``dev`` branch, that changes the
+    sphinx configuration
+
+    Returns
+    -------
+    :class:`pathlib.Path`
+        directory of the bare repository
+    """
+    work = tmp_path / "work"
+    work.mkdir()
+    git("init", "-q", cwd=work)
+    commit(work, {"docs/source/conf.py": "project = 'main'\n",
+                  "pkg/__init__.py": "", "README": "readme\n"}, "first")
+    git("tag", "-a", "v1.0", "-m", "release", cwd=work)
+    commit(work, {"README": "second\n"}, "second")
+    git("checkout", "-q", "-b", "dev", cwd=work)
+    commit(work, {"docs/source/conf.py": "project = 'dev'\n"}, "dev")
+    git("checkout", "-q", "main", cwd=work)
+    bare = tmp_path / "origin.git"
+    git("clone", "-q", "--bare", str(work), str(bare), cwd=tmp_path)
+    git("config", "uploadpack.allowFilter", "true", cwd=bare)
+    git("remote", "add", "origin", str(bare), cwd=work)
+    return bare
+
+
+def push(origin, files, message):
+    """Commit the ``files`` on the ``main`` branch of ``origin``
+
+    Returns
+    -------
+    string
+        the new revision
+    """
+    work = origin.with_name("work")
+    revision = commit(work, files, message)
+    git("push", "-q", "origin", "main", cwd=work)
+    return revision
+
+
+def get_source(origin, cwd, mirror=None, **options):
+    """Clone or update ``origin`` in ``cwd`` with the given fetch
+    ``options``. The url is used, as git ignores the depth and the filter of
+    local clones"""
+    cwd.mkdir(parents=True, exist_ok=True)
+    options = vcs.FULL_FETCH._replace(**options)
+    asyncio.run(vcs.get_or_update_source("git", origin.as_uri(), cwd,
+                                         drunner.CommandRunner(),
+                                         mirror=mirror, options=options))
+
+
+def make_session(**args):
+    """Minimal build session, with the given command line arguments"""
+    args.setdefault("no_mirrors", True)
+    return types.SimpleNamespace(runner=drunner.CommandRunner(),
+                                 args=types.SimpleNamespace(**args))
+
+
+def test_default_fetch_options():
+    """Without options the whole repository is fetched"""
+    conf = configparser.ConfigParser()
+    conf.read_dict({"A": {"project_path": "url"}})
+    options = vcs.fetch_options(conf, "A")
+    assert options == vcs.FULL_FETCH
+    assert vcs._fetch_args(options) == []
+
+
+def test_fetch_options():
+    """The options are converted to command line arguments"""
+    conf = configparser.ConfigParser()
+    conf.read_dict({"A": {"project_path": "url", "depth": "1",
+                          "filter": "blob:none", "single-branch": "yes",
+                          "branch": "v1.0", "tags": "no",
+                          "sparse-checkout": "docs pkg", "lfs": "no",
+                          "submodules": "all"}})
+    options = vcs.fetch_options(conf, "A")
+    assert options == vcs.FetchOptions(depth=1, filter="blob:none",
+                                       single_branch=True, branch="v1.0",
+                                       tags=False, sparse=["docs", "pkg"],
+                                       lfs=False, submodules=[])
+    assert vcs._fetch_args(options) == ["--depth=1", "--filter=blob:none",
+                                        "--no-tags"]
+
+
+def test_incremental_branch_switch(origin, tmp_homedir, monkeypatch):
+    """Switching branch changes the stamp of the incremental builds, also if
+    the name of the local branch stays the same"""
+    conf = configparser.ConfigParser(defaults=dconf.defaults())
+    conf.read_dict({"A": {"project_path": str(origin), "branch": "main",
+                          "incremental": "yes"}})
+    builder = python3.Python3Builder("profile", "A", conf, dlog.getLogger(),
+                                     make_session())
+    monkeypatch.setattr(builder, "env_fingerprint", lambda: "")
+    asyncio.run(builder.fetch())
+    main_stamp = builder._incremental_stamp()
+
+    conf.set("A", "branch", "dev")
+    asyncio.run(builder.fetch())
+    conf_py = builder.source_dir / "conf.py"
+    assert conf_py.read_text() == "project = 'dev'\n"
+    assert builder._incremental_stamp() != main_stamp
+
+
+def test_mirror_reference(origin, tmp_path):
+    """The clones borrow the objects of the mirror and are updated from it"""
+    mirror = tmp_path / "mirror.git"
+    runner = drunner.CommandRunner()
+    asyncio.run(vcs.update_mirror("git", origin.as_uri(), mirror, runner))
+    repo = tmp_path / "repo"
+    get_source(origin, repo, mirror=mirror)
+
+    alternates = repo / ".git" / "objects" / "info" / "alternates"
+    assert Path(alternates.read_text().strip()).samefile(mirror / "objects")
+    assert git("rev-parse", "HEAD", cwd=repo) == git("rev-parse", "main",
+                                                     cwd=origin)
+
+    revision = push(origin, {"README": "third\n"}, "third")
+    asyncio.run(vcs.update_mirror("git", origin.as_uri(), mirror, runner))
+    assert git("rev-parse", "main", cwd=mirror) == revision
+    get_source(origin, repo, mirror=mirror)
+    assert git("rev-parse", "HEAD", cwd=repo) == revision
+
+
+def test_shallow_partial(origin, tmp_path):
+    """Shallow and partial clones get only the last commit and no blobs
+    besides the checked out ones, also after an update, that discards the
+    local changes"""
+    repo = tmp_path / "repo"
+    get_source(origin, repo, depth=1, filter="blob:none")
+    assert git("rev-list", "--count", "HEAD", cwd=repo) == "1"
+    assert git("config", "remote.origin.partialclonefilter",
+               cwd=repo) == "blob:none"
+
+    (repo / "README").write_text("local change\n")
+    revision = push(origin, {"README": "third\n"}, "third")
+    get_source(origin, repo, depth=1, filter="blob:none")
+    assert git("rev-parse", "HEAD", cwd=repo) == revision
+    assert git("rev-list", "--count", "HEAD", cwd=repo) == "1"
+    assert (repo / "README").read_text() == "third\n"
+
+
+def test_single_branch(origin, tmp_path):
+    """Only the branch, or tag, to check out is fetched"""
+    repo = tmp_path / "repo"
+    get_source(origin, repo, single_branch=True, branch="dev", tags=False)
+    assert git("branch", "-r", cwd=repo) == "origin/dev"
+    assert git("tag", cwd=repo) == ""
+    conf_py = repo / "docs" / "source" / "conf.py"
+    assert conf_py.read_text() == "project = 'dev'\n"
+
+    get_source(origin, repo, single_branch=True, branch="v1.0", tags=False)
+    assert git("rev-parse", "HEAD", cwd=repo) == git(
+        "rev-parse", "v1.0^{commit}", cwd=origin)
+    assert conf_py.read_text() == "project = 'main'\n"
+
+
+def remote_revision(origin, ref):
+    """Revision of ``ref`` in ``origin``, as found by the probe"""
+    return asyncio.run(vcs.remote_revision("git", origin.as_uri(), ref,
+                                           drunner.CommandRunner()))
+
+
+def test_remote_revision(origin):
+    """Branches and tags are resolved to commits without fetching them"""
+    assert remote_revision(origin, None) == git("rev-parse", "main",
+                                                cwd=origin)
+    assert remote_revision(origin, "dev") == git("rev-parse", "dev",
+                                                 cwd=origin)
+    # the annotated tag is peeled to the commit it points to
+    first = git("rev-parse", "main~1", cwd=origin)
+    assert remote_revision(origin, "v1.0") == first
+    assert remote_revision(origin, "missing") is None
+
+
+def test_is_up_to_date(origin, tmp_path):
+    """A checkout is up to date until a new commit is pushed"""
+    repo = tmp_path / "repo"
+
+    def is_up_to_date(**options):
+        return asyncio.run(vcs.is_up_to_date(
+            "git", origin.as_uri(), repo, drunner.CommandRunner(),
+            options=vcs.FULL_FETCH._replace(**options)))
+
+    assert not is_up_to_date()
+    get_source(origin, repo)
+    assert is_up_to_date()
+    assert not is_up_to_date(branch="dev")
+    push(origin, {"README": "third\n"}, "third")
+    assert not is_up_to_date()
+    get_source(origin, repo)
+    assert is_up_to_date()
+
+    get_source(origin, repo, branch="v1.0")
+    assert is_up_to_date(branch="v1.0")
+
+
+def test_sparse_checkout(origin, tmp_path):
+    """The sparse checkout has only the given directories and the top level
+    files, until it is disabled"""
+    repo = tmp_path / "repo"
+    get_source(origin, repo, sparse=["docs"])
+    assert (repo / "docs" / "source" / "conf.py").exists()
+    assert (repo / "README").exists()
+    assert not (repo / "pkg").exists()
+
+    get_source(origin, repo)
+    assert (repo / "pkg" / "__init__.py").exists()
+
+
+def test_submodules(origin, tmp_path, monkeypatch):
+    """The submodules are checked out only if asked"""
+    # git refuses submodules from the local file system by default
+    monkeypatch.setenv("GIT_CONFIG_COUNT", "1")
+    monkeypatch.setenv("GIT_CONFIG_KEY_0", "protocol.file.allow")
+    monkeypatch.setenv("GIT_CONFIG_VALUE_0", "always")
+    theme = tmp_path / "theme"
+    theme.mkdir()
+    git("init", "-q", cwd=theme)
+    commit(theme, {"theme.conf": "[theme]\n"}, "theme")
+    work = origin.with_name("work")
+    git("submodule", "-q", "add", theme.as_uri(), "docs/theme", cwd=work)
+    push(origin, {}, "add the theme")
+
+    without = tmp_path / "without"
+    get_source(origin, without)
+    assert (without / "docs" / "theme").is_dir()
+    assert not (without / "docs" / "theme" / "theme.conf").exists()
+
+    repo = tmp_path / "repo"
+    get_source(origin, repo, submodules=[])
+    assert (repo / "docs" / "theme" / "theme.conf").exists()
+
+    get_source(origin, without, submodules=["docs/theme"])
+    assert (without / "docs" / "theme" / "theme.conf").exists()
+
+
+def test_shared_checkout(origin, tmp_homedir):
+    """Sub-projects of the same repository share one checkout, cloned once,
+    unless they fetch it differently"""
+    conf = configparser.ConfigParser(defaults=dconf.defaults())
+    conf.read_dict({"A": {"project_path": str(origin), "subdir": "docs"},
+                    "B": {"project_path": str(origin), "subdir": "pkg/"},
+                    "C": {"project_path": str(origin), "subdir": "docs",
+                          "depth": "1"}})
+    commands = []
+
+    async def fetch_all():
+        session = dsession.BuildSession(dcmdline.parse(["mkdocs", "p"]))
+        run = session.runner.run
+
+        async def record(cmd, *args, **kwargs):
+            commands.append(cmd)
+            return await run(cmd, *args, **kwargs)
+
+        session.runner.run = record
+        builders = [python3.Python3Builder("p", project, conf,
+                                           dlog.getLogger(), session)
+                    for project in ["A", "B", "C"]]
+        await asyncio.gather(*[b.fetch() for b in builders])
+        await session.close()
+        return builders
+
+    a, b, c = asyncio.run(fetch_all())
+    assert a.repo_dir == b.repo_dir != c.repo_dir
+    assert a.project_dir == a.repo_dir / "docs"
+    assert b.project_dir == b.repo_dir / "pkg"
+    assert (a.project_dir / "source" / "conf.py").exists()
+    assert (b.project_dir / "__init__.py").exists()
+    assert (c.project_dir / "source" / "conf.py").exists()
+    clones = [cmd for cmd in commands if "clone" in cmd]
+    # the mirror, the shared checkout and the shallow one
+    assert len(clones) == 3
+    assert sum("--mirror" in cmd for cmd in clones) == 1
@@ -0,0 +1,113 @@
+"""Test the pool of virtual environments
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import asyncio
+import json
+import os
+from pathlib import Path
+import subprocess
+
+import pytest
+
+from dodocs.mkdoc.builders import pyvenvex, venvpool
+
+
+@pytest.fixture
+def pool(tmpdir):
+    """Pool with three fake virtual environments, from the least to the most
+    recently used"""
+    pool = venvpool.VenvPool(path=Path(str(tmpdir)) / "pool")
+    for i, key in enumerate(["old", "mid", "new"]):
+        venv_dir = pool.path / key
+        venv_dir.mkdir(parents=True)
+        info_file = venv_dir / venvpool.INFO_FILE
+        with info_file.open("w") as f:
+            json.dump({"requirements": [key]}, f)
+        os.utime(str(info_file), (i, i))
+    return pool
+
+
+def test_pool_key():
+    """The order of the requirements doesn't matter"""
+    key = venvpool.pool_key(["sphinx", "numpydoc"])
+    assert key == venvpool.pool_key(["numpydoc", "sphinx"])
+    assert key != venvpool.pool_key(["sphinx"])
+
+
+def test_refs(pool, tmpdir):
+    """Users are counted while they exist and only in one environment"""
+    profile = tmpdir.mkdir("profile")
+    pool.add_ref("old", "profile.project", profile)
+    assert pool.refs("old") == ["profile.project"]
+
+    pool.add_ref("mid", "profile.project", profile)
+    assert pool.refs("old") == []
+    assert pool.refs("mid") == ["profile.project"]
+
+    profile.remove()
+    assert pool.refs("mid") == []
+
+
+def test_gc(pool, tmpdir):
+    """The used and the most recently used environments are kept"""
+    pool.add_ref("old", "profile.project", tmpdir)
+
+    removed = pool.gc(keep=1)
+    assert [e["key"] for e in removed] == ["mid"]
+    assert sorted(e["key"] for e in pool.entries()) == ["new", "old"]
+
+
+def test_clone_relocate(tmpdir):
+    "the clone shares the files with the original, except the relocated ones"
+    src = Path(str(tmpdir)) / "src"
+    (src / "bin").mkdir(parents=True)
+    (src / "lib").mkdir()
+    (src / "lib64").symlink_to("lib")
+    (src / "lib" / "module.py").write_text("x = 1\n")
+    (src / "pyvenv.cfg").write_text("command = venv {}\n".format(src))
+    (src / "bin" / "script").write_text("#!{}/bin/python\n".format(src))
+
+    dest = Path(str(tmpdir)) / "dest"
+    pyvenvex.clone_venv(src, dest)
+    pyvenvex.relocate_venv(dest, src, dest)
+
+    assert os.readlink(str(dest / "lib64")) == "lib"
+    assert (dest / "lib" / "module.py").samefile(src / "lib" / "module.py")
+    assert (dest / "bin" / "script").read_text() == \
+        "#!{}/bin/python\n".format(dest)
+    assert (src / "bin" / "script").read_text() == \
+        "#!{}/bin/python\n".format(src)
+    assert (dest / "pyvenv.cfg").read_text() == \
+        "command = venv {}\n".format(dest)
+
+
+def test_layer_venv(tmpdir):
+    """The layered environment sees the packages of the base one, unless it
+    installs a package with the same name"""
+    base = Path(str(tmpdir)) / "base"
+    pyvenvex.VenvInVenvBuilder(with_pip=False).create(str(base))
+    for module in ["shared", "override"]:
+        (pyvenvex.site_packages(base) / (module + ".py")).write_text(
+            "where = 'base'\n")
+    (pyvenvex.site_packages(base) / "pkg-1.0.dist-info").mkdir()
+
+    layer = Path(str(tmpdir)) / "layer"
+    asyncio.run(pyvenvex.layer_venv(layer, base))
+    (pyvenvex.site_packages(layer) / "override.py").write_text(
+        "where = 'layer'\n")
+
+    code = "import override, shared; print(shared.where, override.where)"
+    result = subprocess.run([str(pyvenvex.python_exe(layer)), "-c", code],
+                            check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    assert result.stdout.split() == ["base", "layer"]
+    assert pyvenvex.layer_base(layer) == base
+    assert pyvenvex.layer_base(base) is None
+
+    # the fingerprint follows the packages of the base
+    before = pyvenvex.fingerprint(layer)
+    (pyvenvex.site_packages(base) / "pkg-1.0.dist-info").rename(
+        pyvenvex.site_packages(base) / "pkg-2.0.dist-info")
+    assert pyvenvex.fingerprint(layer) != before
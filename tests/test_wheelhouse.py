@@ -0,0 +1,131 @@
+"""Test the wheelhouse
+
+Copyright (c) 2015 Francesco Montesano
+MIT Licence
+"""
+import asyncio
+import json
+from pathlib import Path
+import types
+
+from dodocs.mkdoc.builders import wheelhouse
+from dodocs.mkdoc import runner as drunner
+
+# report of "pip install --dry-run --report" for "-e ." with one dependency
+REPORT = {"version": "1", "install": [
+    {"download_info": {"url": "file:///src/project", "dir_info": {}},
+     "is_direct": True,
+     "metadata": {"name": "project", "version": "0.1.dev3"}},
+    {"download_info": {"url": "https://files/six-1.17.0-py3-none-any.whl",
+                       "archive_info": {}},
+     "is_direct": False,
+     "metadata": {"name": "six", "version": "1.17.0"}},
+]}
+
+
+class FakeRunner(object):
+    """Record the commands, write :data:`REPORT` when asked for and pretend
+    that the version of pip is ``pip_version``"""
+    def __init__(self, pip_version="24.0"):
+        self.cmds = []
+        self.pip_version = pip_version
+
+    async def run(self, cmd, cwd=None):
+        self.cmds.append(cmd)
+        stdout = ""
+        if "--report" in cmd:
+            report = cmd[cmd.index("--report") + 1]
+            with open(report, "w") as f:
+                json.dump(REPORT, f)
+        elif "--version" in cmd:
+            stdout = "pip {} from /pip (python 3.7)".format(self.pip_version)
+        return drunner.CommandResult(cmd, 0, stdout, "")
+
+
+def make_session(runner):
+    """Minimal build session running the commands with ``runner``"""
+    once = {}
+
+    async def run_once(key, func, *args):
+        if key not in once:
+            once[key] = await func(*args)
+        return once[key]
+
+    return types.SimpleNamespace(runner=runner, once=run_once,
+                                 lock=lambda key: asyncio.Lock())
+
+
+def test_install_args(tmpdir):
+    "pip installs from the wheelhouse only"
+    wheels = wheelhouse.Wheelhouse(path=Path(str(tmpdir)))
+    assert wheels.install_args() == ['--no-index', '--find-links',
+                                     str(tmpdir)]
+
+
+def test_record(tmpdir):
+    "the local projects are not recorded, the others only once"
+    wheels = wheelhouse.Wheelhouse(path=Path(str(tmpdir)))
+    assert wheels.requirements() == []
+
+    wheels._record(['.[doc]', 'sphinx', 'numpydoc'])
+    wheels._record(['.', 'sphinx'])
+    assert wheels.requirements() == ['numpydoc', 'sphinx']
+
+
+def test_add_dependencies_only(tmpdir):
+    "only the dependencies of the local projects are added"
+    wheels = wheelhouse.Wheelhouse(path=Path(str(tmpdir)))
+    runner = FakeRunner()
+    asyncio.run(wheels.add("python", [".[doc]"], make_session(runner)))
+
+    wheel_cmd = runner.cmds[-1]
+    assert wheel_cmd[2:4] == ["pip", "wheel"]
+    assert wheel_cmd[-1] == "six==1.17.0"
+    assert not any("project" in arg for arg in wheel_cmd)
+
+
+def test_add_build_requirements(tmpdir):
+    "the packages building the local projects are added, apart"
+    wheels = wheelhouse.Wheelhouse(path=Path(str(tmpdir)) / "wheels")
+    project = Path(str(tmpdir)) / "project"
+    project.mkdir()
+    (project / "pyproject.toml").write_text(
+        '[build-system]\nrequires = ["hatchling", "hatch-vcs"]\n'
+        'build-backend = "hatchling.build"\n')
+    runner = FakeRunner()
+    asyncio.run(wheels.add("python", ["."], make_session(runner),
+                           cwd=project))
+
+    resolves = [cmd for cmd in runner.cmds if "--dry-run" in cmd]
+    assert len(resolves) == 2
+    assert resolves[0][-3:] == [".", "setuptools", "wheel"]
+    assert resolves[1][-2:] == ["hatch-vcs", "hatchling"]
+    assert "hatchling" in wheels.requirements()
+
+
+def test_build_requirements(tmpdir):
+    "without the build-system table, the projects are built with setuptools"
+    project = Path(str(tmpdir))
+    assert wheelhouse._build_requirements(project) == \
+        wheelhouse.BUILD_REQUIREMENTS
+    (project / "pyproject.toml").write_text('[tool.black]\n')
+    assert wheelhouse._build_requirements(project) == \
+        wheelhouse.BUILD_REQUIREMENTS
+    (project / "pyproject.toml").write_text(
+        '[build-system]\nrequires = ["flit_core >=3.2,<4"]\n')
+    assert wheelhouse._build_requirements(project) == ["flit_core >=3.2,<4"]
+
+
+def test_old_pip_upgraded(tmpdir):
+    "pip is upgraded, once, if it can't resolve the requirements"
+    wheels = wheelhouse.Wheelhouse(path=Path(str(tmpdir)))
+    runner = FakeRunner(pip_version="21.1.1")
+    session = make_session(runner)
+    asyncio.run(wheels.add("python", ["sphinx"], session))
+    asyncio.run(wheels.add("python", ["numpydoc"], session))
+
+    upgrades = [cmd for cmd in runner.cmds if "--upgrade" in cmd]
+    assert upgrades == [["python", "-m", "pip", "install", "--upgrade",
+                         "pip>=22.2"]]
+    assert wheelhouse._pip_version("pip 22.2 from /pip") == (22, 2)
+    assert wheelhouse._pip_version("garbage") == (0, 0)